@@ -0,0 +1,192 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+
+from langgraph.checkpoint.memory import MemorySaver
+
+try:
+    from langgraph.checkpoint.sqlite import SqliteSaver
+except ImportError:  # langgraph-checkpoint-sqlite is optional
+    SqliteSaver = None
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DB_PATH = os.environ.get("CHECKPOINT_DB_PATH", "./checkpoints.sqlite")
+# Threads idle for longer than this are deleted
+CHECKPOINT_TTL_SECONDS = int(os.environ.get("CHECKPOINT_TTL_SECONDS", 24 * 3600))
+# Least recently used threads are deleted beyond these limits
+CHECKPOINT_MAX_THREADS = int(os.environ.get("CHECKPOINT_MAX_THREADS", 1000))
+CHECKPOINT_MAX_BYTES = int(os.environ.get("CHECKPOINT_MAX_BYTES", 256 * 1024**2))
+# Number of most recent checkpoints kept per thread by compaction
+CHECKPOINT_KEEP_LAST = int(os.environ.get("CHECKPOINT_KEEP_LAST", 2))
+
+
+if SqliteSaver is not None:
+
+    class PrunedSqliteSaver(SqliteSaver):
+        """SQLite checkpointer that keeps its own size bounded.
+
+        Every write compacts the thread's history down to the ``keep_last``
+        newest checkpoints. At most every ``maintenance_interval`` seconds,
+        threads idle for longer than ``ttl_seconds`` are deleted, followed by
+        the least recently used threads while the store exceeds ``max_threads``
+        or ``max_bytes``.
+        """
+
+        def __init__(
+            self,
+            conn,
+            ttl_seconds=CHECKPOINT_TTL_SECONDS,
+            max_threads=CHECKPOINT_MAX_THREADS,
+            max_bytes=CHECKPOINT_MAX_BYTES,
+            keep_last=CHECKPOINT_KEEP_LAST,
+            maintenance_interval=60,
+        ):
+            super().__init__(conn)
+            self.ttl_seconds = ttl_seconds
+            self.max_threads = max_threads
+            self.max_bytes = max_bytes
+            self.keep_last = keep_last
+            self.maintenance_interval = maintenance_interval
+            self._last_maintenance = 0.0
+            self._maintenance_lock = threading.Lock()
+
+        def setup(self):
+            if self.is_setup:
+                return
+            # Lets deleted pages be returned to the OS (only applies to new files)
+            self.conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            self.conn.execute("PRAGMA journal_mode = WAL")
+            super().setup()
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS thread_activity (
+                    thread_id TEXT PRIMARY KEY,
+                    last_seen REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS thread_activity_last_seen
+                    ON thread_activity (last_seen);
+                """)
+
+        def put(self, config, checkpoint, metadata, new_versions):
+            next_config = super().put(config, checkpoint, metadata, new_versions)
+            thread_id = str(config["configurable"]["thread_id"])
+            with self.cursor() as cur:
+                cur.execute(
+                    "INSERT OR REPLACE INTO thread_activity (thread_id, last_seen) "
+                    "VALUES (?, ?)",
+                    (thread_id, time.time()),
+                )
+            self.compact(thread_id)
+            self.maybe_run_maintenance()
+            return next_config
+
+        def compact(self, thread_id):
+            """Delete all but the newest ``keep_last`` checkpoints of a thread"""
+            with self.cursor() as cur:
+                # Checkpoint ids are time-ordered, so the largest ids are newest
+                cur.execute(
+                    """
+                    DELETE FROM checkpoints
+                    WHERE thread_id = ? AND checkpoint_id NOT IN (
+                        SELECT checkpoint_id FROM checkpoints AS c
+                        WHERE c.thread_id = checkpoints.thread_id
+                            AND c.checkpoint_ns = checkpoints.checkpoint_ns
+                        ORDER BY checkpoint_id DESC LIMIT ?
+                    )
+                    """,
+                    (thread_id, self.keep_last),
+                )
+                cur.execute(
+                    """
+                    DELETE FROM writes
+                    WHERE thread_id = ? AND NOT EXISTS (
+                        SELECT 1 FROM checkpoints AS c
+                        WHERE c.thread_id = writes.thread_id
+                            AND c.checkpoint_ns = writes.checkpoint_ns
+                            AND c.checkpoint_id = writes.checkpoint_id
+                    )
+                    """,
+                    (thread_id,),
+                )
+
+        def maybe_run_maintenance(self):
+            if time.time() - self._last_maintenance < self.maintenance_interval:
+                return
+            if not self._maintenance_lock.acquire(blocking=False):
+                return
+            try:
+                self._last_maintenance = time.time()
+                self.evict()
+            finally:
+                self._maintenance_lock.release()
+
+        def evict(self):
+            """Delete expired threads, then LRU threads while over the limits"""
+            cutoff = time.time() - self.ttl_seconds
+            with self.cursor() as cur:
+                cur.execute(
+                    "SELECT thread_id FROM thread_activity WHERE last_seen < ?",
+                    (cutoff,),
+                )
+                expired = [row[0] for row in cur.fetchall()]
+            for thread_id in expired:
+                self.delete_thread(thread_id)
+
+            while True:
+                with self.cursor() as cur:
+                    cur.execute("SELECT COUNT(*) FROM thread_activity")
+                    num_threads = cur.fetchone()[0]
+                    if num_threads <= 1:
+                        break
+                    if (
+                        num_threads <= self.max_threads
+                        and self.size_bytes() <= self.max_bytes
+                    ):
+                        break
+                    cur.execute(
+                        "SELECT thread_id FROM thread_activity "
+                        "ORDER BY last_seen LIMIT 1"
+                    )
+                    thread_id = cur.fetchone()[0]
+                self.delete_thread(thread_id)
+
+            with self.cursor() as cur:
+                cur.execute("PRAGMA incremental_vacuum")
+
+        def delete_thread(self, thread_id):
+            super().delete_thread(thread_id)
+            with self.cursor() as cur:
+                cur.execute(
+                    "DELETE FROM thread_activity WHERE thread_id = ?",
+                    (str(thread_id),),
+                )
+
+        def size_bytes(self):
+            """Return the number of bytes used by live pages of the database"""
+            page_count = self.conn.execute("PRAGMA page_count").fetchone()[0]
+            free_pages = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+            page_size = self.conn.execute("PRAGMA page_size").fetchone()[0]
+            return (page_count - free_pages) * page_size
+
+
+@lru_cache(maxsize=None)
+def get_checkpointer(db_path=CHECKPOINT_DB_PATH):
+    """Return the process-wide checkpointer used by agent graphs.
+
+    Falls back to an in-memory saver when langgraph-checkpoint-sqlite is not
+    installed; that saver is neither persistent nor bounded.
+    """
+    if SqliteSaver is None:
+        logger.warning(
+            "langgraph-checkpoint-sqlite is not installed, agent state is kept "
+            "in memory only"
+        )
+        return MemorySaver()
+
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    checkpointer = PrunedSqliteSaver(conn)
+    checkpointer.setup()
+    return checkpointer
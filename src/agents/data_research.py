@@ -1,127 +1,324 @@
 from typing import Annotated
 
+from langchain_core.messages import (
+    AIMessage,
+    HumanMessage,
+    ToolMessage,
+    message_chunk_to_message,
+    trim_messages,
+)
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
 from typing_extensions import TypedDict
 
-from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
-from langgraph.prebuilt import ToolNode, tools_condition
 from langgraph.types import Command, interrupt
 import pandas as pd
-import numpy as np
 import json
-import matplotlib.pyplot as plt
+import logging
 import os
+import re
 import tempfile
-from datetime import datetime
+
+from agents.checkpoint import get_checkpointer
+from agents.datasets import get_dataset_registry, summarize_dataset
+from agents.tool_executor import create_tool_node
+from utils.cancellation import is_cancelled
+from utils.history import count_langchain_tokens
+from utils.metrics import get_metrics_registry, trace
+from utils.plotting import render_time_series_png, save_plot
+from utils.synthetic import generate_panel
+
+logger = logging.getLogger(__name__)
+
+# Model calls per user message, including the final answer; overridable per
+# run with the "max_llm_calls" config entry
+AGENT_MAX_LLM_CALLS = int(os.environ.get("AGENT_MAX_LLM_CALLS", 6))
+# Tool calls per user message ("max_tool_calls" config entry)
+AGENT_MAX_TOOL_CALLS = int(os.environ.get("AGENT_MAX_TOOL_CALLS", 8))
+
+LIMIT_REACHED_MESSAGE = (
+    "Not run: the limit of {limit} for this message was reached. Answer the "
+    "user with the information gathered so far."
+)
+CANCELLED_MESSAGE = "Not run: the user stopped the response."
 
 
 class State(TypedDict):
     messages: Annotated[list, add_messages]
 
 
+def _session_id(config):
+    """Return the session that owns the datasets created during a run"""
+    return config.get("configurable", {}).get("thread_id", "default")
+
+
 @tool
-def get_time_series_data(start_date, end_date) -> str:
+def get_time_series_data(start_date, end_date, config: RunnableConfig) -> str:
     """Get random time series data for a specified date range.
 
+    The data stays on the server; pass the returned handle to other tools
+    (such as plot_time_series_data) instead of copying values around.
+
     Args:
         start_date: The start date for the time series data (format: 'YYYY-MM-DD')
         end_date: The end date for the time series data (format: 'YYYY-MM-DD')
 
     Returns:
-        str: A JSON string containing the time series data with two keys:
-            - 'date': List of dates between start_date and end_date
-            - 'value': List of random values generated from standard normal distribution
+        str: A JSON string describing the dataset with keys:
+            - 'handle': Reference to the stored data, e.g. 'ds_1a2b3c4d5e6f'
+            - 'rows', 'columns', 'start_date', 'end_date': Shape and range
+            - 'stats': Min, max, mean and last value per numeric column
+            - 'preview': The first and last few rows
 
     Example:
-        >>> data = get_time_series_data('2024-01-01', '2024-01-10')
+        >>> summary = get_time_series_data('2024-01-01', '2024-01-10')
         >>> # Returns JSON string like:
-        >>> # {"date": ["2024-01-01", "2024-01-02", ...], "value": [-0.5, 1.2, ...]}
+        >>> # {"handle": "ds_1a2b3c4d5e6f", "rows": 10, "columns": ["date", "value"], ...}
     """
-    # generate random time series data between start_date and end_date
-    df = pd.DataFrame(
-        {"date": pd.date_range(start_date, end_date), "value": np.random.randn(10)}
-    )
-    data_dict = df.to_dict(orient="list")
-    json_data = json.dumps(data_dict, default=str)
-    return json_data
+    # generate a random walk between start_date and end_date
+    df = generate_panel(["value"], start_date, end_date).reset_index()
+
+    handle = get_dataset_registry().put(_session_id(config), df)
+    return json.dumps(summarize_dataset(handle, df), default=str)
 
 
 @tool
-def plot_time_series_data(data: str) -> str:
-    """Plot time series data and save it as a PNG image.
+def plot_time_series_data(handle: str, config: RunnableConfig) -> str:
+    """Plot a stored time series dataset and save it as a PNG image.
 
     Args:
-        data: JSON string containing time series data with two required keys:
-            - 'date': List of dates in string format ('YYYY-MM-DD')
-            - 'value': List of numerical values corresponding to each date
+        handle: Dataset handle returned by get_time_series_data, e.g. 'ds_1a2b3c4d5e6f'
 
     Returns:
         str: Image file path: <plot>/path_to_plots/</plot>
 
     Example:
-        >>> data = '{"date": ["2024-01-01", "2024-01-02"], "value": [1.2, -0.5]}'
-        >>> path = plot_time_series_data(data)
-        >>> # Returns something like: 'Image file path:<plot>/path/to/plots/plot_20240315_143022.png</plot>'
+        >>> path = plot_time_series_data('ds_1a2b3c4d5e6f')
+        >>> # Returns something like: 'Image file path:<plot>/path/to/plots/plot_3f2a9c0e1b7d4a65.png</plot>'
 
     Notes:
         - The plot is saved in a 'plots' directory relative to the current working directory
-        - The filename includes a timestamp to ensure uniqueness
+        - The filename is derived from a hash of the data, so identical plots
+          share one file
         - The plot includes a title, x-label (Date), and y-label (Value)
         - Figure dimensions are set to 10x6 inches
     """
     # plot time series data
-    print("!!!!!plotting...")
-    json_data = json.loads(data)
-    df = pd.DataFrame(json_data)
-
-    # Create plot
-    plt.figure(figsize=(10, 6))
-    df.plot(x="date", y="value")
-    plt.title("Time Series Data")
-    plt.xlabel("Date")
-    plt.ylabel("Value")
-
-    # Create plots directory if it doesn't exist
-    plots_dir = os.path.abspath("./plots")
-    os.makedirs(plots_dir, exist_ok=True)
-
-    # Generate unique filename using timestamp
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"plot_{timestamp}.png"
-    filepath = os.path.join(plots_dir, filename)
-
-    print(f"Saving plot to {filepath}")
-    # Save plot to file
-    plt.savefig(filepath)
-    plt.close()
+    logger.debug("Plotting dataset %s", handle)
+    df = get_dataset_registry().get(_session_id(config), handle.strip())
+
+    # Render off pyplot's global state; identical inputs reuse the cached PNG
+    with trace("plot_render") as span:
+        key, png = render_time_series_png(pd.to_datetime(df["date"]), df["value"])
+        span["rows"] = len(df)
+        span["png_bytes"] = len(png)
+
+    # Content-addressed filename, so concurrent plots never overwrite each other
+    filepath = save_plot(key, png)
+    logger.debug("Saved plot to %s", filepath)
 
     return f"Image file path:<plot>{filepath}</plot>"
 
 
-def get_graph(llm_client):
+def _dataset_exists(content, config):
+    # A memoized result is only useful while its dataset is still stored
+    try:
+        get_dataset_registry().get(_session_id(config), json.loads(content)["handle"])
+    except (KeyError, ValueError):
+        return False
+    return True
+
+
+def _plot_exists(content, config):
+    # Plot files are deleted when the sessions showing them expire
+    paths = re.findall(r"<plot>(.*?)</plot>", content)
+    return bool(paths) and all(os.path.exists(path) for path in paths)
+
+
+# Same arguments, same dataset within a thread; plots are content-addressed
+get_time_series_data.metadata = {"cache": _dataset_exists}
+plot_time_series_data.metadata = {"cache": _plot_exists}
+
+
+def turn_usage(messages):
+    """Return the model and tool calls made since the last user message"""
+    llm_calls = tool_calls = 0
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            break
+        if isinstance(message, AIMessage):
+            llm_calls += 1
+        elif isinstance(message, ToolMessage):
+            tool_calls += 1
+    return llm_calls, tool_calls
+
+
+def _turn_limits(config):
+    configurable = config.get("configurable", {})
+    return (
+        configurable.get("max_llm_calls", AGENT_MAX_LLM_CALLS),
+        configurable.get("max_tool_calls", AGENT_MAX_TOOL_CALLS),
+    )
+
+
+def _skip_tool_calls(message, content):
+    # Answer tool calls without running them, so the history stays valid
+    return [
+        ToolMessage(
+            content=content,
+            name=tool_call["name"],
+            tool_call_id=tool_call["id"],
+            status="error",
+        )
+        for tool_call in message.tool_calls
+    ]
+
+
+def _stream_message(llm, messages, llm_kwargs, config, span):
+    """
+    Stream a model response, stopping as soon as the run is cancelled.
+
+    Closing the stream closes the HTTP response, so the model server stops
+    decoding right away. A cancelled response keeps its text but not its
+    tool calls, which may be incomplete.
+    """
+    message = None
+    stream = llm.stream(messages, **llm_kwargs)
+    try:
+        for chunk in stream:
+            message = chunk if message is None else message + chunk
+            if is_cancelled(config):
+                span["cancelled"] = True
+                break
+    finally:
+        stream.close()
+    if message is None:
+        return AIMessage(content="")
+    if span.get("cancelled"):
+        return AIMessage(content=message.content, id=message.id)
+    return message_chunk_to_message(message)
+
+
+def route_tools(state: State, config: RunnableConfig):
+    """
+    Send tool calls to the tools node unless the run was cancelled or they
+    would exceed a per-turn limit, in which case the turn ends with an
+    answer from final_answer.
+    """
+    message = state["messages"][-1]
+    if not getattr(message, "tool_calls", None):
+        return END
+    if is_cancelled(config):
+        return "cancelled"
+    max_llm_calls, max_tool_calls = _turn_limits(config)
+    llm_calls, tool_calls = turn_usage(state["messages"])
+    # The final answer is a model call too, so stop one call early
+    if llm_calls >= max_llm_calls - 1 or (
+        tool_calls + len(message.tool_calls) > max_tool_calls
+    ):
+        return "final_answer"
+    return "tools"
+
+
+def route_after_tools(state: State, config: RunnableConfig):
+    """Stop between nodes once the run is cancelled"""
+    return END if is_cancelled(config) else "chatbot"
+
+
+def get_graph(llm_client, checkpointer=None):
     graph_builder = StateGraph(State)
-    tools = [get_time_series_data, plot_time_series_data]
+    # Sorted, so the tool schemas in the prompt prefix never change order
+    tools = sorted([get_time_series_data, plot_time_series_data], key=lambda t: t.name)
     llm_with_tools = llm_client.bind_tools(tools)
+    # Same tools in the prompt, so the prefix stays cacheable, but no calls
+    llm_answer_only = llm_client.bind_tools(tools, tool_choice="none")
 
-    def chatbot(state: State):
-        message = llm_with_tools.invoke(state["messages"])
+    def prepare_messages(messages, configurable):
+        # Drop the oldest turns of long threads to stay within the token budget
+        if configurable.get("history_budget"):
+            messages = trim_messages(
+                messages,
+                max_tokens=configurable["history_budget"],
+                token_counter=count_langchain_tokens,
+                strategy="last",
+                include_system=True,
+                start_on="human",
+            )
+        return messages
+
+    def chatbot(state: State, config: RunnableConfig):
+        # Per-request sampling settings, applied without rebuilding the graph
+        configurable = config.get("configurable", {})
+        llm_kwargs = configurable.get("llm_kwargs", {})
+        messages = prepare_messages(state["messages"], configurable)
+
+        with trace("node", node="chatbot") as span:
+            span["input_messages"] = len(messages)
+            message = _stream_message(
+                llm_with_tools, messages, llm_kwargs, config, span
+            )
+            span["tool_calls"] = len(message.tool_calls)
         # assert len(message.tool_calls) <= 1
         return {"messages": [message]}
 
+    def final_answer(state: State, config: RunnableConfig):
+        # Answer the pending tool calls without running them, so the history
+        # stays valid, then ask for an answer without tools
+        configurable = config.get("configurable", {})
+        max_llm_calls, max_tool_calls = _turn_limits(config)
+        llm_calls, tool_calls = turn_usage(state["messages"])
+        limit = (
+            f"{max_llm_calls} model calls"
+            if llm_calls >= max_llm_calls - 1
+            else f"{max_tool_calls} tool calls"
+        )
+        skipped = _skip_tool_calls(
+            state["messages"][-1], LIMIT_REACHED_MESSAGE.format(limit=limit)
+        )
+        get_metrics_registry().inc("agent_turn_limits_total", limit=limit.split()[1])
+        messages = prepare_messages(state["messages"] + skipped, configurable)
+
+        with trace("node", node="final_answer") as span:
+            span["skipped_tool_calls"] = len(skipped)
+            message = _stream_message(
+                llm_answer_only,
+                messages,
+                configurable.get("llm_kwargs", {}),
+                config,
+                span,
+            )
+        if message.tool_calls:
+            # Servers that ignore tool_choice may still call a tool
+            message = AIMessage(
+                content=message.content
+                or f"I stopped here because the limit of {limit} for a single "
+                "message was reached. Ask me to continue if you need more.",
+                id=message.id,
+            )
+        return {"messages": skipped + [message]}
+
+    def cancelled(state: State):
+        return {"messages": _skip_tool_calls(state["messages"][-1], CANCELLED_MESSAGE)}
+
     graph_builder.add_node("chatbot", chatbot)
+    graph_builder.add_node("final_answer", final_answer)
+    graph_builder.add_node("cancelled", cancelled)
 
-    tool_node = ToolNode(tools=tools)
+    # Runs the tool calls of a turn concurrently, each with a timeout
+    tool_node = create_tool_node(tools)
     graph_builder.add_node("tools", tool_node)
 
     graph_builder.add_conditional_edges(
-        "chatbot",
-        tools_condition,
+        "chatbot", route_tools, ["tools", "final_answer", "cancelled", END]
     )
-    graph_builder.add_edge("tools", "chatbot")
+    graph_builder.add_conditional_edges("tools", route_after_tools, ["chatbot", END])
+    graph_builder.add_edge("final_answer", END)
+    graph_builder.add_edge("cancelled", END)
     graph_builder.add_edge(START, "chatbot")
 
-    memory = MemorySaver()
-    graph = graph_builder.compile(checkpointer=memory)
+    if checkpointer is None:
+        checkpointer = get_checkpointer()
+    graph = graph_builder.compile(checkpointer=checkpointer)
     return graph
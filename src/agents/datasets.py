@@ -0,0 +1,148 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+import pandas as pd
+
+# Limits on the datasets a single session (agent thread) can hold
+DATASET_MAX_BYTES_PER_SESSION = int(
+    os.environ.get("DATASET_MAX_BYTES_PER_SESSION", 256 * 1024**2)
+)
+DATASET_MAX_PER_SESSION = int(os.environ.get("DATASET_MAX_PER_SESSION", 32))
+# Sessions idle for longer than this lose their datasets
+DATASET_SESSION_TTL_SECONDS = int(
+    os.environ.get("DATASET_SESSION_TTL_SECONDS", 2 * 3600)
+)
+PREVIEW_ROWS = 3
+
+
+class _Session:
+    def __init__(self):
+        self.datasets = OrderedDict()
+        self.nbytes = 0
+        self.last_used = time.time()
+
+
+class DatasetRegistry:
+    """Server-side store of DataFrames that agent tools reference by handle.
+
+    Tools return a short handle and a summary instead of the data itself, so
+    the prompt does not grow with the size of the data. Datasets are scoped
+    to a session; each session is bounded in count and bytes (least recently
+    used datasets are dropped first) and expires after ``ttl_seconds`` idle.
+    """
+
+    def __init__(
+        self,
+        max_bytes_per_session=DATASET_MAX_BYTES_PER_SESSION,
+        max_datasets_per_session=DATASET_MAX_PER_SESSION,
+        ttl_seconds=DATASET_SESSION_TTL_SECONDS,
+    ):
+        self.max_bytes_per_session = max_bytes_per_session
+        self.max_datasets_per_session = max_datasets_per_session
+        self.ttl_seconds = ttl_seconds
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def put(self, session_id, df):
+        """Store a DataFrame and return its handle.
+
+        Handles are derived from the content, so storing the same data twice
+        returns the same handle.
+        """
+        digest = hashlib.sha1(pd.util.hash_pandas_object(df, index=True).values)
+        digest.update(repr(list(df.columns)).encode("utf-8"))
+        handle = f"ds_{digest.hexdigest()[:12]}"
+        nbytes = int(df.memory_usage(index=True, deep=True).sum())
+
+        with self._lock:
+            self._evict_expired()
+            session = self._sessions.setdefault(session_id, _Session())
+            session.last_used = time.time()
+            if handle in session.datasets:
+                session.datasets.move_to_end(handle)
+                return handle
+
+            session.datasets[handle] = (df, nbytes)
+            session.nbytes += nbytes
+            while len(session.datasets) > 1 and (
+                len(session.datasets) > self.max_datasets_per_session
+                or session.nbytes > self.max_bytes_per_session
+            ):
+                _, (_, evicted_bytes) = session.datasets.popitem(last=False)
+                session.nbytes -= evicted_bytes
+        return handle
+
+    def get(self, session_id, handle):
+        """Return the DataFrame for a handle, raising KeyError if unknown"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or handle not in session.datasets:
+                raise KeyError(
+                    f"Unknown dataset handle '{handle}'. Fetch the data again "
+                    "to get a new handle."
+                )
+            session.last_used = time.time()
+            session.datasets.move_to_end(handle)
+            return session.datasets[handle][0]
+
+    def drop_session(self, session_id):
+        """Delete all datasets of a session"""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self):
+        """Return the number of sessions, datasets and bytes held"""
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "datasets": sum(len(s.datasets) for s in self._sessions.values()),
+                "bytes": sum(s.nbytes for s in self._sessions.values()),
+            }
+
+    def _evict_expired(self):
+        cutoff = time.time() - self.ttl_seconds
+        for session_id in [
+            session_id
+            for session_id, session in self._sessions.items()
+            if session.last_used < cutoff
+        ]:
+            del self._sessions[session_id]
+
+
+@lru_cache(maxsize=None)
+def get_dataset_registry():
+    """Return the process-wide dataset registry"""
+    return DatasetRegistry()
+
+
+def summarize_dataset(handle, df):
+    """Build the compact description of a dataset returned to the model"""
+    summary = {"handle": handle, "rows": len(df), "columns": list(df.columns)}
+    if len(df) == 0:
+        return summary
+
+    if "date" in df.columns:
+        summary["start_date"] = str(df["date"].iloc[0])[:10]
+        summary["end_date"] = str(df["date"].iloc[-1])[:10]
+
+    numeric = df.select_dtypes("number")
+    if not numeric.empty:
+        summary["stats"] = {
+            column: {
+                "min": round(float(numeric[column].min()), 4),
+                "max": round(float(numeric[column].max()), 4),
+                "mean": round(float(numeric[column].mean()), 4),
+                "last": round(float(numeric[column].iloc[-1]), 4),
+            }
+            for column in numeric.columns
+        }
+
+    preview = df
+    if len(df) > 2 * PREVIEW_ROWS:
+        preview = pd.concat([df.head(PREVIEW_ROWS), df.tail(PREVIEW_ROWS)])
+    summary["preview"] = preview.round(4).astype(str).to_dict(orient="records")
+    return summary
@@ -0,0 +1,268 @@
+"""Local retrieval for the RAG Agent.
+
+Documents are split into page chunks in parallel worker processes,
+deduplicated by content hash and indexed with BM25 (see
+utils.search_index). The index lives on disk and is memory-mapped, so
+searches need no network access and every process shares one copy::
+
+    cd src
+    python -m agents.rag index docs/*.pdf
+    python -m agents.rag search "quarterly revenue"
+"""
+
+import argparse
+import hashlib
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+
+from utils.search_index import load_index, write_index
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # pypdf is optional, only text files can be indexed without it
+    PdfReader = None
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows, where rebuilds only exclude this process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+RAG_INDEX_DIR = os.environ.get("RAG_INDEX_DIR", "./rag_index")
+# Words per chunk and words shared by consecutive chunks of a page
+RAG_CHUNK_WORDS = int(os.environ.get("RAG_CHUNK_WORDS", 200))
+RAG_CHUNK_OVERLAP = int(os.environ.get("RAG_CHUNK_OVERLAP", 40))
+# Chunks added to the prompt for each question
+RAG_TOP_K = int(os.environ.get("RAG_TOP_K", 4))
+# Processes extracting pages, and pages extracted per task
+RAG_WORKERS = int(os.environ.get("RAG_WORKERS", os.cpu_count() or 1))
+RAG_PAGES_PER_TASK = int(os.environ.get("RAG_PAGES_PER_TASK", 32))
+# Optional sentence-transformers model (a local name or path) for a dense
+# index next to BM25; empty uses BM25 only
+RAG_EMBEDDING_MODEL = os.environ.get("RAG_EMBEDDING_MODEL", "")
+
+_WHITESPACE = re.compile(r"\s+")
+_thread_lock = threading.Lock()
+
+
+@contextmanager
+def _index_lock(index_dir):
+    """
+    Hold the index for a read-rebuild-swap: the app's sessions, agent worker
+    processes and the command line may all add documents to one index.
+
+    The lock file lies next to the index directory, so clear_index can
+    remove the directory while holding it.
+    """
+    with _thread_lock:
+        if fcntl is None:
+            yield
+            return
+        parent = os.path.dirname(os.path.abspath(index_dir))
+        os.makedirs(parent, exist_ok=True)
+        with open(os.path.abspath(index_dir) + ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def content_hash(text):
+    """64-bit hash of a chunk, ignoring case and whitespace differences"""
+    normalized = _WHITESPACE.sub(" ", text).strip().lower().encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(normalized, digest_size=8).digest(), "big")
+
+
+def chunk_text(text, words=RAG_CHUNK_WORDS, overlap=RAG_CHUNK_OVERLAP):
+    """Split text into windows of ``words`` words overlapping by ``overlap``"""
+    tokens = text.split()
+    step = max(1, words - overlap)
+    return [
+        " ".join(tokens[start : start + words])
+        for start in range(0, max(len(tokens) - overlap, 1), step)
+        if tokens[start : start + words]
+    ]
+
+
+def page_count(path):
+    """Number of pages of a document; text files are a single page"""
+    if not path.lower().endswith(".pdf"):
+        return 1
+    if PdfReader is None:
+        raise RuntimeError("Indexing PDF files requires pypdf (pip install pypdf)")
+    return len(PdfReader(path).pages)
+
+
+def extract_pages(path, start, stop):
+    """Return (page number, text) for pages ``start`` to ``stop`` of a document"""
+    if not path.lower().endswith(".pdf"):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            return [(1, f.read())]
+    reader = PdfReader(path)
+    return [
+        (number + 1, reader.pages[number].extract_text() or "")
+        for number in range(start, min(stop, len(reader.pages)))
+    ]
+
+
+def _extract_chunks(task):
+    # Runs in a worker process: extract a page range and chunk it
+    path, source, start, stop = task
+    return [
+        {"text": text, "source": source, "page": page, "hash": content_hash(text)}
+        for page, page_text in extract_pages(path, start, stop)
+        for text in chunk_text(page_text)
+    ]
+
+
+def load_chunks(documents, workers=RAG_WORKERS):
+    """
+    Extract and chunk documents, spreading page ranges over processes.
+
+    Args:
+        documents (list[tuple[str, str]]): (path, source name) pairs
+        workers (int): Worker processes; 1 extracts in this process
+
+    Returns:
+        list[dict]: Chunks with "text", "source", "page" and "hash", in
+        document and page order
+    """
+    tasks = [
+        (path, source, start, start + RAG_PAGES_PER_TASK)
+        for path, source in documents
+        for start in range(0, page_count(path), RAG_PAGES_PER_TASK)
+    ]
+    if workers <= 1 or len(tasks) <= 1:
+        results = map(_extract_chunks, tasks)
+        return [chunk for chunks in results for chunk in chunks]
+
+    # Spawned workers do not inherit the threads of a running Streamlit server
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(min(workers, len(tasks)), mp_context=context) as pool:
+        results = pool.map(_extract_chunks, tasks)
+        return [chunk for chunks in results for chunk in chunks]
+
+
+@lru_cache(maxsize=None)
+def get_embedder(model_name=RAG_EMBEDDING_MODEL):
+    """Return a texts -> vectors function for the dense index, or None"""
+    if not model_name:
+        return None
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        logger.warning("sentence-transformers is not installed, using BM25 only")
+        return None
+
+    model = SentenceTransformer(model_name)
+    return lambda texts: model.encode(list(texts), convert_to_numpy=True)
+
+
+def add_documents(documents, index_dir=RAG_INDEX_DIR, workers=RAG_WORKERS):
+    """
+    Add documents to the index, skipping chunks that are already indexed.
+
+    Args:
+        documents (list[tuple[str, str]]): (path, source name) pairs
+
+    Returns:
+        dict: Numbers of "added" and "duplicate" chunks
+    """
+    chunks = load_chunks(documents, workers)
+    with _index_lock(index_dir):
+        index = load_index(index_dir)
+        existing = list(index.chunks()) if index is not None else []
+        seen = {chunk["hash"] for chunk in existing}
+        added = []
+        for chunk in chunks:
+            if chunk["hash"] not in seen:
+                seen.add(chunk["hash"])
+                added.append(chunk)
+        if added:
+            all_chunks = existing + added
+            embed = get_embedder()
+            vectors = embed([c["text"] for c in all_chunks]) if embed else None
+            os.makedirs(index_dir, exist_ok=True)
+            write_index(index_dir, all_chunks, vectors)
+    return {"added": len(added), "duplicate": len(chunks) - len(added)}
+
+
+def add_uploaded_file(uploaded_file, index_dir=RAG_INDEX_DIR):
+    """Store an uploaded file next to the index and add it"""
+    data = uploaded_file.getvalue()
+    digest = hashlib.sha1(data).hexdigest()[:12]
+    documents_dir = os.path.join(index_dir, "documents")
+    os.makedirs(documents_dir, exist_ok=True)
+    path = os.path.join(
+        documents_dir, f"{digest}-{os.path.basename(uploaded_file.name)}"
+    )
+    if not os.path.exists(path):
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+    return add_documents([(path, uploaded_file.name)], index_dir)
+
+
+def search(query, k=RAG_TOP_K, index_dir=RAG_INDEX_DIR):
+    """Return the ``k`` chunks most relevant to ``query``, best first"""
+    index = load_index(index_dir)
+    if index is None or not query.strip():
+        return []
+    embed = get_embedder() if index.vectors is not None else None
+    query_vector = embed([query])[0] if embed else None
+    return index.search(query, k, query_vector=query_vector)
+
+
+def index_stats(index_dir=RAG_INDEX_DIR):
+    """Return the size of the index, or None when nothing is indexed"""
+    index = load_index(index_dir)
+    return index.stats() if index is not None else None
+
+
+def clear_index(index_dir=RAG_INDEX_DIR):
+    """Remove the index and the stored documents"""
+    with _index_lock(index_dir):
+        shutil.rmtree(index_dir, ignore_errors=True)
+
+
+def format_context(hits):
+    """Render retrieved chunks as numbered sources for the prompt"""
+    return "\n\n".join(
+        f"[{i}] {hit['source']}, page {hit['page']}:\n{hit['text']}"
+        for i, hit in enumerate(hits, start=1)
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query the RAG index")
+    parser.add_argument("--index-dir", default=RAG_INDEX_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+    index_parser = commands.add_parser("index", help="Add PDF or text files")
+    index_parser.add_argument("paths", nargs="+")
+    index_parser.add_argument("--workers", type=int, default=RAG_WORKERS)
+    search_parser = commands.add_parser("search", help="Print the best chunks")
+    search_parser.add_argument("query")
+    search_parser.add_argument("-k", type=int, default=RAG_TOP_K)
+    args = parser.parse_args(argv)
+
+    if args.command == "index":
+        documents = [(path, os.path.basename(path)) for path in args.paths]
+        print(add_documents(documents, args.index_dir, args.workers))
+        print(index_stats(args.index_dir))
+    else:
+        for hit in search(args.query, args.k, args.index_dir):
+            print(f"{hit['score']:.3f}  {hit['source']} p.{hit['page']}")
+            print(f"    {hit['text'][:200]}")
+
+
+if __name__ == "__main__":
+    main()
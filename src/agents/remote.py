@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+import zlib
+from functools import lru_cache, partial
+from types import SimpleNamespace
+
+import httpx
+from langchain_core.messages import (
+    BaseMessage,
+    message_to_dict,
+    messages_from_dict,
+)
+
+from utils.cancellation import is_cancelled
+
+logger = logging.getLogger(__name__)
+
+# Comma-separated base URLs of agent worker services, e.g.
+# "http://127.0.0.1:8765,http://10.0.0.2:8765"; empty runs agents in-process
+AGENT_WORKER_URL = os.environ.get("AGENT_WORKER_URL", "")
+# Run in-process when no worker service is reachable (for development)
+AGENT_WORKER_FALLBACK = os.environ.get("AGENT_WORKER_FALLBACK", "0") == "1"
+
+
+def encode_value(value):
+    """Make a value with nested messages JSON serializable"""
+    if isinstance(value, BaseMessage):
+        return {"__message__": message_to_dict(value)}
+    if isinstance(value, (list, tuple)):
+        return [encode_value(v) for v in value]
+    if isinstance(value, dict):
+        return {k: encode_value(v) for k, v in value.items()}
+    return value
+
+
+def decode_value(value):
+    """Inverse of encode_value"""
+    if isinstance(value, list):
+        return [decode_value(v) for v in value]
+    if isinstance(value, dict):
+        if "__message__" in value:
+            return messages_from_dict([value["__message__"]])[0]
+        return {k: decode_value(v) for k, v in value.items()}
+    return value
+
+
+def _event_metadata(metadata):
+    # Run metadata holds internal objects; the UI only reads these keys
+    return {
+        k: v
+        for k, v in metadata.items()
+        if k.startswith(("langgraph_", "ls_")) and isinstance(v, (str, int, float))
+    }
+
+
+def encode_event(mode, payload):
+    """Encode a (mode, payload) graph stream event as one JSON line"""
+    if mode == "messages":
+        chunk, metadata = payload
+        payload = [chunk, _event_metadata(metadata)]
+    return json.dumps({"mode": mode, "payload": encode_value(payload)}) + "\n"
+
+
+def decode_event(line):
+    """Decode a JSON line from encode_event back into (mode, payload)"""
+    event = json.loads(line)
+    if "error" in event:
+        raise RuntimeError(f"Agent worker failed: {event['error']}")
+    payload = decode_value(event["payload"])
+    if event["mode"] == "messages":
+        payload = tuple(payload)
+    return event["mode"], payload
+
+
+def encode_request(input, config, stream_mode, model_host, model):
+    """Build the JSON body of a run or state request"""
+    return {
+        "input": encode_value(input),
+        "config": config or {},
+        "stream_mode": stream_mode,
+        "model_host": model_host,
+        "model": model,
+    }
+
+
+def decode_request(body):
+    return {**body, "input": decode_value(body["input"])}
+
+
+def select_worker(urls, config):
+    """Pick the worker for a run, so all turns of a thread go to the same one"""
+    thread_id = str((config or {}).get("configurable", {}).get("thread_id", ""))
+    return urls[zlib.crc32(thread_id.encode("utf-8")) % len(urls)]
+
+
+class RemoteAgentGraph:
+    """
+    Client for agent graphs served by ``python -m agents.worker``.
+
+    Exposes the parts of a compiled graph the UI uses (``stream`` and
+    ``get_state``), so it is a drop-in replacement. Runs of the same thread
+    always go to the same worker service, which keeps its datasets for the
+    next turns.
+    """
+
+    def __init__(self, urls, model_host, model, fallback=None):
+        self.urls = [url.rstrip("/") for url in urls]
+        self.model_host = model_host
+        self.model = model
+        # Zero-argument callable returning an in-process graph
+        self.fallback = fallback
+        self._client = httpx.Client(timeout=httpx.Timeout(600.0, connect=5.0))
+
+    def _fallback_graph(self, error):
+        if self.fallback is None:
+            raise error
+        logger.warning("Agent worker unreachable (%s), running in-process", error)
+        return self.fallback()
+
+    def stream(self, input, config=None, stream_mode="updates"):
+        url = select_worker(self.urls, config)
+        # Workers always stream (mode, payload) pairs, like a list stream_mode
+        single_mode = isinstance(stream_mode, str)
+        modes = [stream_mode] if single_mode else list(stream_mode)
+        body = encode_request(input, config, modes, self.model_host, self.model)
+        try:
+            with self._client.stream("POST", f"{url}/v1/runs", json=body) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if is_cancelled(config):
+                        # Closing the response makes the worker cancel the run
+                        return
+                    if line:
+                        mode, payload = decode_event(line)
+                        yield payload if single_mode else (mode, payload)
+        except httpx.ConnectError as e:
+            yield from self._fallback_graph(e).stream(
+                input, config=config, stream_mode=stream_mode
+            )
+
+    def invoke(self, input, config=None):
+        state = None
+        for values in self.stream(input, config=config, stream_mode="values"):
+            state = values
+        return state
+
+    def get_state(self, config):
+        url = select_worker(self.urls, config)
+        body = encode_request(None, config, None, self.model_host, self.model)
+        try:
+            response = self._client.post(f"{url}/v1/state", json=body)
+        except httpx.ConnectError as e:
+            return self._fallback_graph(e).get_state(config)
+        response.raise_for_status()
+        return SimpleNamespace(values=decode_value(response.json()["values"]))
+
+
+@lru_cache(maxsize=None)
+def get_remote_agent_graph(model_host, model, urls=AGENT_WORKER_URL):
+    """Return the shared client for the agent worker services"""
+    fallback = None
+    if AGENT_WORKER_FALLBACK:
+        from utils.chat_utils import get_agent_graph
+
+        fallback = partial(get_agent_graph, model_host, model)
+    return RemoteAgentGraph(
+        [url for url in urls.split(",") if url.strip()], model_host, model, fallback
+    )
@@ -0,0 +1,316 @@
+import asyncio
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import lru_cache, partial
+
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.runnables import RunnableLambda
+
+from utils.metrics import get_metrics_registry, trace
+
+# Default time limit for a single tool call
+TOOL_TIMEOUT_SECONDS = float(os.environ.get("TOOL_TIMEOUT_SECONDS", 30))
+# Threads shared by all sessions for synchronous tools (same default as
+# ThreadPoolExecutor, since most tools wait on IO or release the GIL)
+TOOL_MAX_WORKERS = int(
+    os.environ.get("TOOL_MAX_WORKERS", min(32, (os.cpu_count() or 1) + 4))
+)
+# Memoized tool results kept by this process, over all threads
+TOOL_CACHE_MAX_ENTRIES = int(os.environ.get("TOOL_CACHE_MAX_ENTRIES", 1024))
+
+
+@lru_cache(maxsize=None)
+def get_tool_executor():
+    """Return the bounded thread pool that runs synchronous tools"""
+    return ThreadPoolExecutor(
+        max_workers=TOOL_MAX_WORKERS, thread_name_prefix="agent-tool"
+    )
+
+
+class ToolResultCache:
+    """Results of cacheable tools, memoized per agent thread.
+
+    A tool opts in with ``metadata={"cache": True}``, or with a callable
+    ``cache(content, config) -> bool`` that says whether a cached result is
+    still usable (e.g. whether a dataset handle it returned still exists).
+    Keys are the thread, the tool name and the normalized arguments, so a
+    model repeating a call within a conversation gets the earlier result
+    without running the tool again. Errors are never cached.
+    """
+
+    def __init__(self, max_entries=TOOL_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, content):
+        with self._lock:
+            self._entries[key] = content
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def drop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+@lru_cache(maxsize=None)
+def get_tool_cache():
+    """Return the process-wide tool result cache"""
+    return ToolResultCache()
+
+
+def _normalize(value):
+    # Equal arguments modulo key order and surrounding whitespace
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def _cache_key(tools_by_name, tool_call, config):
+    """Return the memoization key of a call, or None if it is not cacheable"""
+    tool = tools_by_name.get(tool_call["name"])
+    if tool is None or not (tool.metadata or {}).get("cache"):
+        return None
+    thread_id = (config or {}).get("configurable", {}).get("thread_id")
+    arguments = json.dumps(_normalize(tool_call["args"]), sort_keys=True, default=str)
+    return (str(thread_id), tool_call["name"], arguments)
+
+
+def _cached_message(tools_by_name, tool_call, key, config):
+    content = get_tool_cache().get(key)
+    if content is None:
+        return None
+    check = tools_by_name[tool_call["name"]].metadata["cache"]
+    if callable(check) and not check(content, config):
+        get_tool_cache().drop(key)
+        return None
+    get_metrics_registry().inc("tool_cache_hits_total", tool=tool_call["name"])
+    return ToolMessage(
+        content=content, name=tool_call["name"], tool_call_id=tool_call["id"]
+    )
+
+
+def _error_message(tool_call, content):
+    return ToolMessage(
+        content=content,
+        name=tool_call["name"],
+        tool_call_id=tool_call["id"],
+        status="error",
+    )
+
+
+def _record_result(span, tool_call, message):
+    # Tools report failures as error messages rather than exceptions
+    span["status"] = "error" if getattr(message, "status", None) == "error" else "ok"
+    get_metrics_registry().inc(
+        "tool_calls_total", tool=tool_call["name"], status=span["status"]
+    )
+    return message
+
+
+def _store_result(key, message):
+    if key is not None and getattr(message, "status", None) != "error":
+        get_tool_cache().put(key, message.content)
+    return message
+
+
+def _run_tool(tools_by_name, tool_call, config):
+    tool = tools_by_name.get(tool_call["name"])
+    if tool is None:
+        return _error_message(
+            tool_call,
+            f"Error: {tool_call['name']} is not a valid tool, try one of "
+            f"{list(tools_by_name)}.",
+        )
+    key = _cache_key(tools_by_name, tool_call, config)
+    if key is not None:
+        cached = _cached_message(tools_by_name, tool_call, key, config)
+        if cached is not None:
+            return cached
+    with trace("tool", tool=tool_call["name"]) as span:
+        try:
+            # Invoking a tool with a tool call returns a ToolMessage
+            message = tool.invoke({**tool_call, "type": "tool_call"}, config)
+        except Exception as e:
+            message = _error_message(
+                tool_call, f"Error: {e!r}\n Please fix your mistakes."
+            )
+        return _store_result(key, _record_result(span, tool_call, message))
+
+
+async def _arun_tool(tools_by_name, tool_call, config):
+    tool = tools_by_name.get(tool_call["name"])
+    if tool is None or getattr(tool, "coroutine", None) is None:
+        # Synchronous tools run on the shared, bounded thread pool
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            get_tool_executor(),
+            partial(context.run, _run_tool, tools_by_name, tool_call, config),
+        )
+    key = _cache_key(tools_by_name, tool_call, config)
+    if key is not None:
+        cached = _cached_message(tools_by_name, tool_call, key, config)
+        if cached is not None:
+            return cached
+    with trace("tool", tool=tool_call["name"]) as span:
+        try:
+            message = await tool.ainvoke({**tool_call, "type": "tool_call"}, config)
+        except Exception as e:
+            message = _error_message(
+                tool_call, f"Error: {e!r}\n Please fix your mistakes."
+            )
+        return _store_result(key, _record_result(span, tool_call, message))
+
+
+def _unique_calls(tools_by_name, tool_calls, config):
+    # Identical cacheable calls of one message run once; returns the calls to
+    # run and, for every call, the index of the call whose result it shares
+    first, unique, sources = {}, [], []
+    for tool_call in tool_calls:
+        key = _cache_key(tools_by_name, tool_call, config)
+        if key is None or key not in first:
+            if key is not None:
+                first[key] = len(unique)
+            sources.append(len(unique))
+            unique.append(tool_call)
+        else:
+            sources.append(first[key])
+    return unique, sources
+
+
+def _share_results(tool_calls, messages, sources):
+    # A duplicate call gets a copy of the result under its own tool call id
+    return [
+        messages[source].model_copy(update={"tool_call_id": tool_call["id"]})
+        for tool_call, source in zip(tool_calls, sources)
+    ]
+
+
+def _get_tool_calls(state):
+    messages = state["messages"] if isinstance(state, dict) else state
+    message = messages[-1]
+    if not isinstance(message, AIMessage):
+        raise ValueError("No AIMessage found in input")
+    return message.tool_calls
+
+
+def _get_timeout(config, timeout):
+    return (config or {}).get("configurable", {}).get("tool_timeout", timeout)
+
+
+def create_tool_node(tools, timeout=TOOL_TIMEOUT_SECONDS):
+    """
+    Create a graph node that runs all tool calls of the last AI message.
+
+    Calls run concurrently (async tools on the event loop, synchronous tools
+    on a bounded thread pool), so a turn takes as long as its slowest tool
+    rather than the sum of all tools. Each call is limited to ``timeout``
+    seconds, overridable per run with the "tool_timeout" config entry; a call
+    that times out is cancelled and reported to the model as an error. Tool
+    messages are returned in the order of the tool calls. Results of
+    cacheable tools are memoized per thread (see ToolResultCache), and
+    identical cacheable calls of one message run once.
+
+    Note that a synchronous tool that is already running cannot be stopped;
+    its result is discarded when it finishes after the timeout.
+
+    Args:
+        tools (list): LangChain tools available to the model
+        timeout (float): Default time limit for a single tool call in seconds
+
+    Returns:
+        RunnableLambda: Node usable in place of langgraph's ToolNode
+    """
+    tools_by_name = {tool.name: tool for tool in tools}
+
+    def run_tools(state, config):
+        with trace("node", node="tools") as span:
+            span["tool_calls"] = len(_get_tool_calls(state))
+            return _run_tools(state, config)
+
+    def _run_tools(state, config):
+        all_calls = _get_tool_calls(state)
+        tool_calls, sources = _unique_calls(tools_by_name, all_calls, config)
+        limit = _get_timeout(config, timeout)
+        context = contextvars.copy_context()
+        futures = [
+            get_tool_executor().submit(
+                context.copy().run, _run_tool, tools_by_name, tool_call, config
+            )
+            for tool_call in tool_calls
+        ]
+
+        # All calls share the same deadline since they run at the same time
+        deadline = time.monotonic() + limit
+        messages = []
+        for tool_call, future in zip(tool_calls, futures):
+            try:
+                messages.append(
+                    future.result(timeout=max(deadline - time.monotonic(), 0))
+                )
+            except FutureTimeoutError:
+                future.cancel()
+                get_metrics_registry().inc(
+                    "tool_timeouts_total", tool=tool_call["name"]
+                )
+                messages.append(
+                    _error_message(
+                        tool_call,
+                        f"Error: {tool_call['name']} timed out after {limit:g}s",
+                    )
+                )
+        return {"messages": _share_results(all_calls, messages, sources)}
+
+    async def arun_tools(state, config):
+        with trace("node", node="tools") as span:
+            span["tool_calls"] = len(_get_tool_calls(state))
+            return await _arun_tools(state, config)
+
+    async def _arun_tools(state, config):
+        all_calls = _get_tool_calls(state)
+        tool_calls, sources = _unique_calls(tools_by_name, all_calls, config)
+        limit = _get_timeout(config, timeout)
+
+        async def run_with_timeout(tool_call):
+            try:
+                return await asyncio.wait_for(
+                    _arun_tool(tools_by_name, tool_call, config), limit
+                )
+            except asyncio.TimeoutError:
+                get_metrics_registry().inc(
+                    "tool_timeouts_total", tool=tool_call["name"]
+                )
+                return _error_message(
+                    tool_call,
+                    f"Error: {tool_call['name']} timed out after {limit:g}s",
+                )
+
+        # gather keeps the results in the order of the tool calls
+        messages = await asyncio.gather(*map(run_with_timeout, tool_calls))
+        return {"messages": _share_results(all_calls, messages, sources)}
+
+    return RunnableLambda(run_tools, afunc=arun_tools, name="tools")
@@ -0,0 +1,409 @@
+"""Agent worker service.
+
+Runs Data Agent graphs in a pool of worker processes behind a local job
+queue and an HTTP API, so agent loops do not run in Streamlit's script
+threads and can scale independently of the UI. Each worker process keeps its
+compiled graphs and model clients warm between jobs.
+
+Start it from src and point the UI at it::
+
+    python -m agents.worker --port 8765 --processes 4
+    AGENT_WORKER_URL=http://127.0.0.1:8765 streamlit run multi_agent_ui.py
+
+API:
+    POST /v1/runs   Stream a run as NDJSON, one (mode, payload) event per line
+    POST /v1/state  Return the checkpointed state of a thread
+    GET  /health    Queue and worker statistics
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from agents.remote import encode_value, decode_request, encode_event
+from utils.cancellation import cancel_run, cancel_token, finish_run, start_run
+
+logger = logging.getLogger(__name__)
+
+# Worker processes; 0 runs jobs on threads of the service process instead
+AGENT_WORKER_PROCESSES = int(
+    os.environ.get("AGENT_WORKER_PROCESSES", os.cpu_count() or 1)
+)
+# Jobs accepted at once (queued or running) before new ones get HTTP 503
+AGENT_WORKER_MAX_PENDING = int(os.environ.get("AGENT_WORKER_MAX_PENDING", 64))
+# Seconds between checks that the worker process of a waiting job is alive
+AGENT_WORKER_POLL_SECONDS = float(os.environ.get("AGENT_WORKER_POLL_SECONDS", 1.0))
+
+
+class QueueFull(Exception):
+    pass
+
+
+def _run_job(job, emit):
+    """Run a job and pass its results to ``emit(kind, data)``"""
+    from utils.chat_utils import get_agent_graph
+    from utils.model_router import model_session
+
+    graph = get_agent_graph(job["model_host"], job["model"])
+    config = job["config"]
+    if job["kind"] == "state":
+        values = graph.get_state(config).values
+        emit("state", json.dumps({"values": encode_value(values)}))
+        return
+
+    token = start_run(cancel_token(config))
+    try:
+        with model_session(config.get("configurable", {}).get("thread_id")):
+            for mode, payload in graph.stream(
+                job["input"], config=config, stream_mode=job["stream_mode"]
+            ):
+                emit("event", encode_event(mode, payload))
+    finally:
+        finish_run(token)
+
+
+def _run_job_safely(job, emit):
+    try:
+        _run_job(job, emit)
+        emit("end", None)
+    except Exception as e:
+        logger.exception("Agent job %s failed", job["id"])
+        emit("error", repr(e))
+
+
+def _cancel_loop(cancels):
+    # Runs next to the job loop of a worker process, which is busy with a run
+    while True:
+        cancel_run(cancels.get())
+
+
+def _worker_main(jobs, results, cancels, warm_model_host, warm_model):
+    """Entry point of a worker process: run jobs until a None job arrives"""
+    logging.basicConfig(level=logging.INFO)
+    from utils.chat_utils import get_agent_graph
+
+    threading.Thread(target=_cancel_loop, args=(cancels,), daemon=True).start()
+
+    # Compile the graph and open the client before the first job arrives
+    get_agent_graph(warm_model_host, warm_model)
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        _run_job_safely(job, lambda kind, data: results.put((job["id"], kind, data)))
+
+
+class WorkerPool:
+    """
+    Job queue in front of a pool of agent worker processes.
+
+    Every worker process has its own queue and runs are assigned by thread
+    id, so all turns of a thread run in the same process and find the
+    datasets created by earlier turns. State reads only touch the shared
+    checkpoint database and are answered by this process, so they never wait
+    behind a long run. With ``processes=0`` runs also execute on threads of
+    this process, which is convenient for development.
+    """
+
+    def __init__(
+        self,
+        processes=AGENT_WORKER_PROCESSES,
+        max_pending=AGENT_WORKER_MAX_PENDING,
+        warm_model_host=None,
+        warm_model=None,
+    ):
+        from utils.chat_utils import DEFAULT_MODEL, DEFAULT_MODEL_HOST
+
+        self.processes = processes
+        self.max_pending = max_pending
+        self._streams = {}
+        self._lock = threading.Lock()
+        self._completed = 0
+
+        self._warm_model_host = warm_model_host or DEFAULT_MODEL_HOST
+        self._warm_model = warm_model or DEFAULT_MODEL
+        self.restarts = 0
+
+        if processes > 0:
+            self._context = multiprocessing.get_context("spawn")
+            self._results = self._context.Queue()
+            self._queues, self._cancels, self._workers = map(
+                list, zip(*(self._start_worker(i) for i in range(processes)))
+            )
+            threading.Thread(target=self._dispatch, daemon=True).start()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_pending, thread_name_prefix="agent-job"
+        )
+
+    def _start_worker(self, index):
+        # A process that died may have left its queues locked, so a
+        # replacement gets new ones
+        jobs, cancels = self._context.Queue(), self._context.Queue()
+        worker = self._context.Process(
+            target=_worker_main,
+            args=(
+                jobs,
+                self._results,
+                cancels,
+                self._warm_model_host,
+                self._warm_model,
+            ),
+            name=f"agent-worker-{index}",
+            daemon=True,
+        )
+        worker.start()
+        return jobs, cancels, worker
+
+    def _replace_dead_worker(self, index, worker):
+        with self._lock:
+            # Every job of the dead process notices; only the first restarts it
+            if self._workers[index] is not worker:
+                return
+            logger.error(
+                "Agent worker %s exited with code %s, restarting it",
+                worker.name,
+                worker.exitcode,
+            )
+            self._queues[index], self._cancels[index], self._workers[index] = (
+                self._start_worker(index)
+            )
+            self.restarts += 1
+
+    def _dispatch(self):
+        # Route results from the shared queue to the waiting request
+        while True:
+            job_id, kind, data = self._results.get()
+            with self._lock:
+                stream = self._streams.get(job_id)
+            if stream is not None:
+                stream.put((kind, data))
+
+    def submit(self, kind, request):
+        """
+        Queue a job and yield its results as ``(kind, data)`` pairs.
+
+        Raises:
+            QueueFull: When ``max_pending`` jobs are already queued or running
+        """
+        job = {**request, "kind": kind, "id": uuid.uuid4().hex}
+        if kind == "run":
+            # Every run can be cancelled, by its client's token or its job id
+            configurable = job["config"].get("configurable", {})
+            job["config"] = {
+                **job["config"],
+                "configurable": {
+                    **configurable,
+                    "cancel_token": configurable.get("cancel_token") or job["id"],
+                },
+            }
+        stream = queue.Queue()
+        with self._lock:
+            if len(self._streams) >= self.max_pending:
+                raise QueueFull(f"{len(self._streams)} agent jobs pending")
+            self._streams[job["id"]] = stream
+
+        index = worker = None
+        finished = False
+        try:
+            if self.processes > 0 and kind == "run":
+                thread_id = str(job["config"].get("configurable", {}).get("thread_id"))
+                index = zlib.crc32(thread_id.encode("utf-8")) % self.processes
+                with self._lock:
+                    jobs, worker = self._queues[index], self._workers[index]
+                jobs.put(job)
+            else:
+                self._executor.submit(
+                    _run_job_safely, job, lambda kind, data: stream.put((kind, data))
+                )
+
+            while True:
+                try:
+                    result_kind, data = self._next_result(stream, index, worker)
+                except queue.Empty:
+                    continue
+                finished = result_kind in ("end", "error")
+                if result_kind == "end":
+                    return
+                yield result_kind, data
+                if result_kind == "error":
+                    return
+        finally:
+            if not finished and kind == "run":
+                # The client went away: stop the run instead of finishing it
+                # for nobody
+                token = cancel_token(job["config"])
+                if index is not None:
+                    self._cancels[index].put(token)
+                else:
+                    cancel_run(token)
+            # Results of a job whose client went away are dropped on arrival
+            with self._lock:
+                self._streams.pop(job["id"], None)
+                self._completed += 1
+
+    def _next_result(self, stream, index, worker):
+        """
+        Wait for the next result of a job, or fail it when the worker
+        process running it has died (e.g. killed for running out of memory).
+
+        Raises:
+            queue.Empty: When no result arrived within the poll interval
+        """
+        try:
+            return stream.get(timeout=AGENT_WORKER_POLL_SECONDS)
+        except queue.Empty:
+            if worker is None or worker.is_alive():
+                raise
+        try:
+            # Results sent just before the process exited may still be on
+            # their way through the dispatcher
+            return stream.get(timeout=AGENT_WORKER_POLL_SECONDS)
+        except queue.Empty:
+            self._replace_dead_worker(index, worker)
+            return "error", (
+                f"Agent worker {worker.name} exited with code {worker.exitcode}"
+            )
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "processes": self.processes,
+                "pending": len(self._streams),
+                "max_pending": self.max_pending,
+                "completed": self._completed,
+            }
+        if self.processes > 0:
+            stats["alive"] = sum(worker.is_alive() for worker in self._workers)
+            stats["restarts"] = self.restarts
+        return stats
+
+    def close(self):
+        if self.processes > 0:
+            for jobs in self._queues:
+                jobs.put(None)
+            for worker in self._workers:
+                worker.join(timeout=5)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def make_server(pool, host="127.0.0.1", port=8765):
+    """Create the HTTP server exposing ``pool``"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+        def _send_json(self, body, status=200):
+            data = body.encode("utf-8") if isinstance(body, str) else body
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _write_chunk(self, text):
+            data = text.encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/health":
+                self._send_json(json.dumps({"status": "ok", **pool.stats()}))
+            else:
+                self._send_json(json.dumps({"error": "not found"}), status=404)
+
+        def do_POST(self):
+            path = self.path.rstrip("/")
+            if path not in ("/v1/runs", "/v1/state"):
+                self._send_json(json.dumps({"error": "not found"}), status=404)
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            request = decode_request(json.loads(self.rfile.read(length)))
+
+            kind = "run" if path == "/v1/runs" else "state"
+            results = pool.submit(kind, request)
+            try:
+                # Start the job before answering, so a full queue is a 503
+                first = next(results, None)
+            except QueueFull as e:
+                self._send_json(json.dumps({"error": str(e)}), status=503)
+                return
+
+            if kind == "state":
+                results.close()
+                if first is None or first[0] == "error":
+                    error = first[1] if first else "no result"
+                    self._send_json(json.dumps({"error": error}), status=500)
+                else:
+                    self._send_json(first[1])
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                if first is not None:
+                    for result_kind, data in itertools.chain([first], results):
+                        if result_kind == "error":
+                            self._write_chunk(json.dumps({"error": data}) + "\n")
+                        else:
+                            self._write_chunk(data)
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                # The UI went away or stopped the run; closing the results
+                # cancels the job
+                results.close()
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve Data Agent runs over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=AGENT_WORKER_PROCESSES,
+        help="Worker processes, 0 runs jobs in this process",
+    )
+    parser.add_argument("--max-pending", type=int, default=AGENT_WORKER_MAX_PENDING)
+    parser.add_argument("--model-host", help="Model server to warm up workers for")
+    parser.add_argument("--model", help="Model to warm up workers for")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    pool = WorkerPool(args.processes, args.max_pending, args.model_host, args.model)
+    server = make_server(pool, args.host, args.port)
+    logger.info(
+        "Agent worker service on http://%s:%s with %s processes",
+        args.host,
+        args.port,
+        args.processes,
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
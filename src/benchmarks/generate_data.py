@@ -0,0 +1,76 @@
+"""Generate synthetic price panels for load tests.
+
+Streams a seeded (dates x tickers) price panel to CSV, Parquet or Arrow IPC
+in chunks, so multi-GB files can be built without holding them in memory.
+CSV files can be loaded by the SN Agent (large ones through its columnar
+store)::
+
+    cd src
+    python -m benchmarks.generate_data panel.csv --rows 2000000 --tickers 500
+    python -m benchmarks.generate_data panel.parquet --model factor --seed 7
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from utils.synthetic import MODELS, ticker_names, write_panel
+
+# File extension -> write_panel format
+FORMATS = {".csv": "CSV", ".parquet": "Parquet", ".arrow": "Arrow IPC"}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Write a synthetic price panel to a CSV, Parquet or Arrow file"
+    )
+    parser.add_argument("path", help="Output file (.csv, .parquet or .arrow)")
+    parser.add_argument("--rows", type=int, default=100_000, help="Number of dates")
+    parser.add_argument("--tickers", type=int, default=100)
+    parser.add_argument("--start", default="2000-01-03", help="First date")
+    parser.add_argument("--freq", default="D", help="Pandas frequency, e.g. min")
+    parser.add_argument("--model", choices=MODELS, default="random_walk")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--volatility", type=float, default=0.01)
+    parser.add_argument("--drift", type=float, default=0.0)
+    parser.add_argument("--factors", type=int, default=3)
+    parser.add_argument("--correlation", type=float, default=0.5)
+    args = parser.parse_args(argv)
+
+    extension = os.path.splitext(args.path)[1].lower()
+    if extension not in FORMATS:
+        parser.error(f"unknown file extension, expected one of {list(FORMATS)}")
+
+    def progress(fraction):
+        sys.stderr.write(f"\r{fraction:.0%}")
+
+    start = time.perf_counter()
+    try:
+        size = write_panel(
+            args.path,
+            ticker_names(args.tickers),
+            args.start,
+            args.rows,
+            freq=args.freq,
+            fmt=FORMATS[extension],
+            progress=progress,
+            model=args.model,
+            seed=args.seed,
+            volatility=args.volatility,
+            drift=args.drift,
+            n_factors=args.factors,
+            correlation=args.correlation,
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    seconds = time.perf_counter() - start
+    sys.stderr.write("\n")
+    print(
+        f"{args.path}: {args.rows} rows x {args.tickers} tickers, "
+        f"{size / 1024**2:.1f} MB in {seconds:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Import-time profile of the app's entry points.
+
+Imports each entry point in a fresh interpreter with ``python -X importtime``
+and reports the total import time and the slowest modules it pulls in, so
+startup regressions (a heavy import moved back to module level) are visible::
+
+    cd src
+    python -m benchmarks.import_profile
+    python -m benchmarks.import_profile --json imports.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# What a fresh worker imports for each page, and the stacks loaded later
+ENTRY_POINTS = [
+    "multi_agent_ui",
+    "components.chat",
+    "components.sn_agent",
+    "utils.chat_utils",
+    "utils.response_cache",
+    "agents.data_research",
+]
+
+# Heavy stacks whose presence in an entry point's import tree is reported
+HEAVY_PACKAGES = [
+    "langchain",
+    "langchain_core",
+    "langchain_openai",
+    "langgraph",
+    "matplotlib",
+    "pandas",
+    "numpy",
+    "PIL",
+]
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_importtime(stderr):
+    """
+    Parse ``-X importtime`` output.
+
+    Returns:
+        list[tuple[str, float, float]]: (module, self seconds, cumulative
+        seconds) for every imported module
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        parts = line[len("import time:") :].split("|")
+        if len(parts) != 3:
+            continue
+        self_us, cumulative_us, name = parts
+        modules.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    return modules
+
+
+def profile_import(module, runs=3, top=10):
+    """Import ``module`` in ``runs`` fresh interpreters and summarize the cost"""
+    totals = []
+    modules = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=SRC_DIR,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+        modules = parse_importtime(result.stderr)
+        totals.append(sum(self_seconds for _, self_seconds, _ in modules))
+
+    names = {name for name, _, _ in modules}
+    slowest = sorted(modules, key=lambda m: m[2], reverse=True)
+    return {
+        "seconds": {
+            "median": statistics.median(totals),
+            "min": min(totals),
+            "max": max(totals),
+            "runs": runs,
+        },
+        "modules": len(modules),
+        "heavy_packages": [p for p in HEAVY_PACKAGES if p in names],
+        "slowest": [
+            {"module": name, "cumulative_seconds": cumulative}
+            for name, _, cumulative in slowest[:top]
+        ],
+    }
+
+
+def profile_imports(entry_points=ENTRY_POINTS, runs=3, top=10):
+    """Profile every entry point, keyed by module name"""
+    return {module: profile_import(module, runs, top) for module in entry_points}
+
+
+def format_report(profile):
+    """Render a profile as a plain text table"""
+    lines = []
+    for module, result in profile.items():
+        lines.append(
+            f"{module:<24} {result['seconds']['median'] * 1000:8.0f} ms  "
+            f"{result['modules']:5d} modules  "
+            f"heavy: {', '.join(result['heavy_packages']) or '-'}"
+        )
+        for entry in result["slowest"][:5]:
+            lines.append(
+                f"    {entry['module']:<40} {entry['cumulative_seconds'] * 1000:8.0f} ms"
+            )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Report the import time of the app's entry points"
+    )
+    parser.add_argument("modules", nargs="*", default=ENTRY_POINTS)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--json", help="Also write the profile to this file")
+    args = parser.parse_args(argv)
+
+    profile = profile_imports(args.modules, args.runs, args.top)
+    print(format_report(profile))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(profile, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,418 @@
+"""Offline performance benchmarks.
+
+Runs without a model server: chat and agent benchmarks talk to a local
+stub server (see benchmarks.stub_server) with a fixed time-to-first-token
+and per-token delay, so results measure the app's own overhead. Results are
+written as JSON and can be compared against an earlier run::
+
+    cd src
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --compare results.json
+
+The import-time profile of the entry points is included; run
+benchmarks.import_profile for a readable report of it.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.import_profile import profile_imports
+from benchmarks.stub_server import StubServer, agent_loop_script, text_reply
+
+# Sidebar defaults, with a deterministic temperature
+BENCH_SETTINGS = {
+    "temperature": 0.0,
+    "max_tokens": 4096,
+    "context_window": 16384,
+    "top_p": 0.1,
+    "repeat_penalty": 0.0,
+    "presence_penalty": 0.0,
+    "response_cache": False,
+    "force_cache": False,
+}
+
+# Metrics where a larger value is better, all others are timings
+_HIGHER_IS_BETTER = ("tokens_per_second",)
+
+
+def summarize_timings(samples):
+    """Return median, p95, min and max of a list of timings in seconds"""
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    return {
+        "median": statistics.median(ordered),
+        "p95": p95,
+        "min": ordered[0],
+        "max": ordered[-1],
+        "runs": len(ordered),
+    }
+
+
+def generate_panel_csv(path, n_rows, n_tickers, seed=0):
+    """Write a random-walk price panel with a "date" column and n_tickers columns"""
+    from utils.synthetic import ticker_names, write_panel
+
+    tickers = ticker_names(n_tickers)
+    write_panel(path, tickers, "2000-01-03", n_rows, seed=seed)
+    return tickers
+
+
+def bench_chat_stream(runs, reply_tokens, token_delay, first_token_delay):
+    """Time-to-first-token and streaming throughput of the chat client"""
+    from langchain_core.messages import HumanMessage
+
+    from utils.chat_utils import create_chat_client
+
+    reply = " ".join(f"token{i}" for i in range(reply_tokens))
+    ttft, tps, total = [], [], []
+    with StubServer(
+        default=text_reply(reply),
+        token_delay=token_delay,
+        first_token_delay=first_token_delay,
+    ) as server:
+        client = create_chat_client(BENCH_SETTINGS, model_host=server.url)
+        for i in range(runs):
+            start = time.perf_counter()
+            first = None
+            chunks = 0
+            for chunk in client.stream([HumanMessage(content=f"Hello {i}")]):
+                if chunk.content:
+                    if first is None:
+                        first = time.perf_counter()
+                    chunks += 1
+            end = time.perf_counter()
+            ttft.append(first - start)
+            total.append(end - start)
+            if chunks > 1 and end > first:
+                tps.append((chunks - 1) / (end - first))
+
+    return {
+        "reply_tokens": reply_tokens,
+        "token_delay": token_delay,
+        "first_token_delay": first_token_delay,
+        "ttft_seconds": summarize_timings(ttft),
+        "total_seconds": summarize_timings(total),
+        "tokens_per_second": statistics.median(tps) if tps else None,
+        # Time spent by the app beyond what the stub itself waits
+        "client_overhead_seconds": statistics.median(total)
+        - first_token_delay
+        - token_delay * reply_tokens,
+    }
+
+
+def bench_router(runs, endpoints, concurrency, reply_tokens, token_delay):
+    """Spread of concurrent chat streams over several endpoints, one of them down"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    import httpx
+    from langchain_core.messages import HumanMessage
+    from langchain_openai import ChatOpenAI
+
+    from utils.model_router import RouterTransport
+
+    reply = " ".join(f"token{i}" for i in range(reply_tokens))
+    servers = [
+        StubServer(default=text_reply(reply), token_delay=token_delay).start()
+        for _ in range(endpoints)
+    ]
+    # Nothing listens on port 9, so the router has to fail over from it
+    router = RouterTransport(
+        ["http://127.0.0.1:9/v1"] + [server.url for server in servers],
+        health_interval=0,
+    )
+    try:
+        llm = ChatOpenAI(
+            base_url=servers[0].url,
+            api_key="dummy",
+            model="llama3.1",
+            streaming=True,
+            http_client=httpx.Client(transport=router),
+        )
+
+        def stream(i):
+            start = time.perf_counter()
+            text = "".join(c.content for c in llm.stream([HumanMessage(f"Hi {i}")]))
+            return text, time.perf_counter() - start
+
+        requests = runs * concurrency
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            replies, latencies = zip(*executor.map(stream, range(requests)))
+        elapsed = time.perf_counter() - start
+        if any(r != reply for r in replies):
+            raise RuntimeError("Routed streams returned incomplete replies")
+    finally:
+        router.close()
+        for server in servers:
+            server.stop()
+
+    stats = router.stats()
+    return {
+        "endpoints": endpoints,
+        "concurrency": concurrency,
+        "requests": requests,
+        "total_seconds": elapsed,
+        "latency_seconds": summarize_timings(latencies),
+        "requests_per_endpoint": [s["requests"] for s in stats[1:]],
+        "failovers": stats[0]["failures"],
+    }
+
+
+def bench_agent_loop(runs, token_delay, first_token_delay):
+    """Latency of a full fetch, plot, answer loop through the agent graph"""
+    from langgraph.checkpoint.memory import MemorySaver
+
+    from agents.data_research import get_graph
+    from utils.chat_utils import get_agent_config, get_base_llm
+
+    latencies, model_calls = [], []
+    with StubServer(
+        script=agent_loop_script(),
+        token_delay=token_delay,
+        first_token_delay=first_token_delay,
+    ) as server:
+        graph = get_graph(get_base_llm(server.url), checkpointer=MemorySaver())
+        for i in range(runs):
+            config = get_agent_config(BENCH_SETTINGS, thread_id=uuid.uuid4().hex)
+            requests_before = len(server.requests)
+            start = time.perf_counter()
+            state = graph.invoke(
+                {"messages": [("user", f"Plot the data for 2024 ({i})")]}, config
+            )
+            latencies.append(time.perf_counter() - start)
+            model_calls.append(len(server.requests) - requests_before)
+            if "<plot>" not in state["messages"][-1].content:
+                raise RuntimeError("Agent loop did not finish with a plot")
+
+    return {
+        "token_delay": token_delay,
+        "first_token_delay": first_token_delay,
+        "model_calls_per_run": statistics.median(model_calls),
+        "latency_seconds": summarize_timings(latencies),
+    }
+
+
+def bench_csv(runs, n_rows, n_tickers, n_selected, workdir):
+    """Per-ticker process_csv_data calls and single-pass panel assembly"""
+    from components.sn_agent import process_csv_data
+    from utils.data_utils import get_panel_cache, load_panel
+
+    csv_path = os.path.join(workdir, f"panel_{n_rows}x{n_tickers}.csv")
+    start = time.perf_counter()
+    tickers = generate_panel_csv(csv_path, n_rows, n_tickers)
+    generate_seconds = time.perf_counter() - start
+    selected = tickers[:: max(1, n_tickers // n_selected)][:n_selected]
+    dates = pd.read_csv(csv_path, usecols=["date"])["date"]
+    start_date, end_date = dates.iloc[len(dates) // 4], dates.iloc[3 * len(dates) // 4]
+
+    def per_ticker():
+        return [
+            process_csv_data(csv_path, ticker, start_date, end_date)
+            for ticker in selected
+        ]
+
+    def panel():
+        return load_panel(csv_path, selected, start_date, end_date)
+
+    results = {
+        "rows": n_rows,
+        "tickers": n_tickers,
+        "selected": len(selected),
+        "file_bytes": os.path.getsize(csv_path),
+        "generate_seconds": generate_seconds,
+    }
+    for name, func in (("process_csv_data", per_ticker), ("load_panel", panel)):
+        cold, warm = [], []
+        for _ in range(runs):
+            get_panel_cache().clear()
+            start = time.perf_counter()
+            func()
+            cold.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            func()
+            warm.append(time.perf_counter() - start)
+        results[name] = {
+            "cold_seconds": summarize_timings(cold),
+            "warm_seconds": summarize_timings(warm),
+        }
+
+    # Every analysis over the selection from a warm panel, then a changed
+    # rolling window, which reuses the memoized prices and returns
+    from utils.analytics import ANALYSES, get_analytics_cache, run_analysis
+
+    all_analyses, window_change = [], []
+    for _ in range(runs):
+        get_analytics_cache().clear()
+        start = time.perf_counter()
+        for analysis in ANALYSES:
+            run_analysis(csv_path, selected, start_date, end_date, analysis, "Weekly")
+        all_analyses.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        run_analysis(
+            csv_path, selected, start_date, end_date, "Rolling Volatility", "Weekly", 60
+        )
+        window_change.append(time.perf_counter() - start)
+    results["analytics"] = {
+        "all_analyses_seconds": summarize_timings(all_analyses),
+        "window_change_seconds": summarize_timings(window_change),
+    }
+
+    # Columnar store: a chunked ingest, then range queries that only read the
+    # partitions and columns of the selection
+    from utils.partitioned_store import ingest_csv, query_store, store_available
+
+    if store_available():
+        store_root = os.path.join(workdir, "store")
+        ingest, query = [], []
+        for _ in range(runs):
+            shutil.rmtree(store_root, ignore_errors=True)
+            start = time.perf_counter()
+            store_dir = ingest_csv(csv_path, store_root)
+            ingest.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            df = query_store(store_dir, selected, start_date, end_date)
+            query.append(time.perf_counter() - start)
+        results["store"] = {
+            "ingest_seconds": summarize_timings(ingest),
+            "query_seconds": summarize_timings(query),
+            "bytes_scanned": df.attrs["scan"]["bytes_scanned"],
+            "bytes_total": df.attrs["scan"]["bytes_total"],
+        }
+
+    # Reference point: parsing the whole file with pandas
+    start = time.perf_counter()
+    pd.read_csv(csv_path, parse_dates=["date"])
+    results["full_read_csv_seconds"] = time.perf_counter() - start
+    return results
+
+
+def _flatten(results, prefix=""):
+    """Yield (dotted name, value) for every numeric leaf of the results"""
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{name}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+def compare_results(current, baseline, tolerance):
+    """
+    Compare median timings and throughput against an earlier run.
+
+    Returns:
+        list[str]: Descriptions of metrics that regressed by more than
+        ``tolerance`` (a fraction, e.g. 0.2 for 20%)
+    """
+    baseline_metrics = dict(_flatten(baseline["benchmarks"]))
+    regressions = []
+    for name, value in _flatten(current["benchmarks"]):
+        is_timing = name.endswith(".median")
+        is_rate = name.rsplit(".", 1)[-1] in _HIGHER_IS_BETTER
+        old = baseline_metrics.get(name)
+        if not (is_timing or is_rate) or not old:
+            continue
+        change = (value - old) / old
+        if (is_timing and change > tolerance) or (is_rate and -change > tolerance):
+            regressions.append(f"{name}: {old:.4g} -> {value:.4g} ({change:+.1%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run the offline benchmarks and save the results as JSON"
+    )
+    parser.add_argument("--output", help="Path of the JSON results file")
+    parser.add_argument("--compare", help="Earlier results file to compare with")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Allowed relative slowdown before --compare reports a regression",
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--only",
+        nargs="+",
+        choices=["chat", "router", "agent", "csv", "imports"],
+        default=["chat", "router", "agent", "csv", "imports"],
+    )
+    parser.add_argument("--reply-tokens", type=int, default=200)
+    parser.add_argument("--token-delay", type=float, default=0.001)
+    parser.add_argument("--first-token-delay", type=float, default=0.05)
+    parser.add_argument("--router-endpoints", type=int, default=3)
+    parser.add_argument("--router-concurrency", type=int, default=12)
+    parser.add_argument("--csv-rows", type=int, default=20000)
+    parser.add_argument("--csv-tickers", type=int, default=200)
+    parser.add_argument("--csv-selected", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="llama-chatbot-bench-") as workdir:
+        # Keep the benchmark's plots and caches out of the working directory
+        os.environ.setdefault("PLOTS_DIR", os.path.join(workdir, "plots"))
+        os.environ.setdefault("CHECKPOINT_DB_PATH", os.path.join(workdir, "ckpt.db"))
+        os.environ.setdefault(
+            "RESPONSE_CACHE_PATH", os.path.join(workdir, "responses.db")
+        )
+
+        benchmarks = {}
+        if "chat" in args.only:
+            benchmarks["chat_stream"] = bench_chat_stream(
+                args.runs, args.reply_tokens, args.token_delay, args.first_token_delay
+            )
+        if "router" in args.only:
+            benchmarks["router"] = bench_router(
+                args.runs,
+                args.router_endpoints,
+                args.router_concurrency,
+                args.reply_tokens,
+                args.token_delay,
+            )
+        if "agent" in args.only:
+            benchmarks["agent_loop"] = bench_agent_loop(
+                args.runs, args.token_delay, args.first_token_delay
+            )
+        if "imports" in args.only:
+            benchmarks["imports"] = profile_imports(runs=args.runs)
+        if "csv" in args.only:
+            benchmarks["csv"] = bench_csv(
+                args.runs, args.csv_rows, args.csv_tickers, args.csv_selected, workdir
+            )
+
+    results = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "versions": {"numpy": np.__version__, "pandas": pd.__version__},
+        "args": vars(args),
+        "benchmarks": benchmarks,
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare_results(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
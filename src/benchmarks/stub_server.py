@@ -0,0 +1,314 @@
+"""OpenAI-compatible stub model server for benchmarks and offline testing.
+
+Serves ``/v1/chat/completions`` (streaming and non-streaming, with tool
+calls), ``/v1/models`` and ``/health`` from scripted responses with a
+configurable time-to-first-token and per-token delay.
+
+Run standalone with::
+
+    python -m benchmarks.stub_server --port 11434 --token-delay 0.02
+"""
+
+import argparse
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = "This is a scripted reply from the stub model server."
+
+_TOKEN_PATTERN = re.compile(r"\s*\S+")
+
+
+def split_tokens(text):
+    """Split text into pseudo-tokens (words with their leading whitespace)"""
+    return _TOKEN_PATTERN.findall(text)
+
+
+def text_reply(content):
+    """Script step that answers with plain text"""
+    return {"content": content}
+
+
+def tool_call_reply(name, args):
+    """Script step that answers with a single tool call"""
+    return {"tool_calls": [{"name": name, "args": args}]}
+
+
+def agent_loop_script(start_date="2024-01-01", end_date="2024-12-31"):
+    """
+    Script that drives the Data Agent through a full fetch, plot, answer loop.
+
+    The reply depends on the last message of each request: a user message
+    triggers get_time_series_data, its result triggers plot_time_series_data
+    with the returned handle, and the plot result gets a final text answer.
+    """
+
+    def reply(request):
+        messages = request["messages"]
+        last = messages[-1]
+        if last["role"] != "tool" or not request.get("tools"):
+            return tool_call_reply(
+                "get_time_series_data",
+                {"start_date": start_date, "end_date": end_date},
+            )
+        if "<plot>" in last["content"]:
+            return text_reply(f"Here is the plot of the data. {last['content']}")
+        try:
+            handle = json.loads(last["content"])["handle"]
+        except (ValueError, KeyError):
+            return text_reply("The data could not be fetched.")
+        return tool_call_reply("plot_time_series_data", {"handle": handle})
+
+    return reply
+
+
+class StubServer:
+    """
+    Threaded OpenAI-compatible HTTP server with scripted responses.
+
+    Args:
+        script: A list of script steps (used in order, then ``default``), a
+            callable ``script(request) -> step``, or None for ``default``
+        token_delay (float): Seconds between streamed tokens
+        first_token_delay (float): Seconds before the first token (prefill)
+        host (str): Interface to bind
+        port (int): Port to bind, 0 picks a free port
+        default (dict): Step used when a list script is exhausted
+    """
+
+    def __init__(
+        self,
+        script=None,
+        token_delay=0.0,
+        first_token_delay=0.0,
+        host="127.0.0.1",
+        port=0,
+        default=None,
+    ):
+        self.script = script
+        self.token_delay = token_delay
+        self.first_token_delay = first_token_delay
+        self.default = default or text_reply(DEFAULT_REPLY)
+        self.requests = []
+        self.healthy = True
+        self._steps = iter(script) if isinstance(script, list) else None
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        """Base URL to pass as ``model_host`` / ``base_url``"""
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def next_step(self, request):
+        with self._lock:
+            self.requests.append(request)
+            if callable(self.script):
+                return self.script(request)
+            if self._steps is not None:
+                return next(self._steps, self.default)
+            return self.default
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if not server.healthy:
+                    self._send_json({"error": "unavailable"}, status=503)
+                elif self.path.rstrip("/").endswith("/models"):
+                    self._send_json(
+                        {
+                            "object": "list",
+                            "data": [{"id": "llama3.1", "object": "model"}],
+                        }
+                    )
+                elif self.path.rstrip("/").endswith("/health"):
+                    self._send_json({"status": "ok"})
+                else:
+                    self._send_json({"error": "not found"}, status=404)
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json({"error": "not found"}, status=404)
+                    return
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                step = server.next_step(request)
+                if request.get("stream"):
+                    self._stream(request, step)
+                else:
+                    self._complete(request, step)
+
+            def _send_json(self, body, status=200):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _usage(self, request, tokens):
+                prompt = json.dumps(request.get("messages", []))
+                prompt_tokens = len(split_tokens(prompt))
+                return {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(tokens),
+                    "total_tokens": prompt_tokens + len(tokens),
+                }
+
+            def _tool_calls(self, step):
+                return [
+                    {
+                        "id": f"call_{uuid.uuid4().hex[:24]}",
+                        "type": "function",
+                        "function": {
+                            "name": call["name"],
+                            "arguments": json.dumps(call["args"]),
+                        },
+                    }
+                    for call in step.get("tool_calls", [])
+                ]
+
+            def _complete(self, request, step):
+                tokens = split_tokens(step.get("content", ""))
+                time.sleep(server.first_token_delay + server.token_delay * len(tokens))
+                message = {"role": "assistant", "content": step.get("content", "")}
+                tool_calls = self._tool_calls(step)
+                if tool_calls:
+                    message["tool_calls"] = tool_calls
+                self._send_json(
+                    {
+                        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": request.get("model", "llama3.1"),
+                        "choices": [
+                            {
+                                "index": 0,
+                                "message": message,
+                                "finish_reason": (
+                                    "tool_calls" if tool_calls else "stop"
+                                ),
+                            }
+                        ],
+                        "usage": self._usage(request, tokens),
+                    }
+                )
+
+            def _stream(self, request, step):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                base = {
+                    "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": request.get("model", "llama3.1"),
+                }
+
+                def send(delta, finish_reason=None, **extra):
+                    chunk = {
+                        **base,
+                        "choices": [
+                            {"index": 0, "delta": delta, "finish_reason": finish_reason}
+                        ],
+                        **extra,
+                    }
+                    self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+
+                tokens = split_tokens(step.get("content", ""))
+                tool_calls = self._tool_calls(step)
+                try:
+                    time.sleep(server.first_token_delay)
+                    send({"role": "assistant", "content": ""})
+                    for token in tokens:
+                        send({"content": token})
+                        time.sleep(server.token_delay)
+                    for index, call in enumerate(tool_calls):
+                        send({"tool_calls": [{"index": index, **call}]})
+                    send({}, "tool_calls" if tool_calls else "stop")
+                    if (request.get("stream_options") or {}).get("include_usage"):
+                        self._write_chunk(
+                            "data: "
+                            + json.dumps(
+                                {
+                                    **base,
+                                    "choices": [],
+                                    "usage": self._usage(request, tokens),
+                                }
+                            )
+                            + "\n\n"
+                        )
+                    self._write_chunk("data: [DONE]\n\n")
+                    self.wfile.write(b"0\r\n\r\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client closed the stream early
+                    pass
+
+            def _write_chunk(self, text):
+                data = text.encode("utf-8")
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--first-token-delay", type=float, default=0.1)
+    parser.add_argument(
+        "--agent", action="store_true", help="Drive the Data Agent tool loop"
+    )
+    args = parser.parse_args()
+
+    server = StubServer(
+        script=agent_loop_script() if args.agent else None,
+        token_delay=args.token_delay,
+        first_token_delay=args.first_token_delay,
+        host=args.host,
+        port=args.port,
+    )
+    print(f"Stub model server listening on {server.url}")
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
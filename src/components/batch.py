@@ -0,0 +1,199 @@
+import os
+import tempfile
+import time
+import uuid
+from contextlib import closing
+
+import pandas as pd
+import streamlit as st
+
+from components.chat import split_plots
+from utils.batch import (
+    BATCH_CONCURRENCY,
+    BATCH_MAX_CONCURRENCY,
+    BATCH_MAX_RETRIES,
+    ITEM_PLACEHOLDER,
+    ResultWriter,
+    agent_answer,
+    parse_prompts,
+    read_prompt_file,
+    run_batch,
+)
+from utils.cancellation import start_run
+from utils.chat_utils import (
+    create_chat_client,
+    get_agent_config,
+    get_batch_agent_graph,
+    get_query_messages,
+)
+from utils.session_store import get_session_store
+
+
+def get_prompt_runner(settings, agent, prompts):
+    """
+    Return a run_prompt function for run_batch and the run's cancel token.
+
+    The messages are built here, on the script thread, because they read the
+    system message from session state. Data Agent prompts run in this
+    process on a graph that checkpoints in memory, each attempt on a new
+    thread that is deleted with its datasets once the answer is read.
+    """
+    token = start_run()
+    contexts = [None] * len(prompts)
+    if agent == "RAG Agent":
+        from agents.rag import format_context, search
+
+        contexts = [
+            format_context(hits) if (hits := search(p)) else None for p in prompts
+        ]
+    messages = [
+        get_query_messages([{"role": "user", "content": prompt}], context=context)
+        for prompt, context in zip(prompts, contexts)
+    ]
+
+    if agent == "Data Agent":
+        from agents.datasets import get_dataset_registry
+
+        graph = get_batch_agent_graph()
+        batch_id = uuid.uuid4().hex
+
+        def run_prompt(index, attempt):
+            thread_id = f"batch-{batch_id}-{index}-{attempt}"
+            config = get_agent_config(settings, thread_id, cancel_token=token)
+            try:
+                state = graph.invoke({"messages": messages[index]}, config)
+                return agent_answer(state["messages"])
+            finally:
+                graph.checkpointer.delete_thread(thread_id)
+                get_dataset_registry().drop_session(thread_id)
+
+    else:
+        client = create_chat_client(settings, agent=agent)
+
+        def run_prompt(index, attempt):
+            return client.invoke(messages[index]).content
+
+    return run_prompt, token
+
+
+def results_frame(results):
+    """Return batch results as a table in prompt order"""
+    df = pd.DataFrame(
+        [
+            {
+                "#": r["index"] + 1,
+                "Prompt": r["prompt"],
+                "Status": r["status"],
+                "Attempts": r["attempts"],
+                "Seconds": round(r["seconds"], 2),
+                "Response": r["response"] or r.get("error", ""),
+            }
+            for r in results
+        ],
+        columns=["#", "Prompt", "Status", "Attempts", "Seconds", "Response"],
+    )
+    return df.sort_values("#").reset_index(drop=True)
+
+
+def run_batch_prompts(prompts, settings, agent, concurrency, retries):
+    """Run a batch, updating the results table as each prompt finishes"""
+    fd, path = tempfile.mkstemp(prefix="batch_", suffix=".csv")
+    os.close(fd)
+    get_session_store().track_file(st.session_state.session_id, path)
+    writer = ResultWriter(path)
+    results = []
+    st.session_state.batch_results = results
+    st.session_state.batch_file = path
+
+    run_prompt, token = get_prompt_runner(settings, agent, prompts)
+    stop_placeholder = st.empty()
+    # Clicking Stop interrupts this script run; pending prompts are cancelled
+    stop_placeholder.button("Stop", key="stop_batch", icon="⏹")
+    progress = st.progress(0.0)
+    table = st.empty()
+    start = time.perf_counter()
+    try:
+        # Closing the batch early cancels the token, which run_batch keeps
+        # registered until the running prompts have stopped
+        with closing(
+            run_batch(prompts, run_prompt, concurrency, retries, cancel_token=token)
+        ) as batch:
+            for result in batch:
+                writer.write(result)
+                results.append(result)
+                for plot_path in split_plots(result["response"])[1]:
+                    get_session_store().track_file(
+                        st.session_state.session_id, plot_path
+                    )
+                elapsed = time.perf_counter() - start
+                progress.progress(
+                    len(results) / len(prompts),
+                    text=f"{len(results)} of {len(prompts)} prompts, "
+                    f"{len(results) / elapsed:.2f} per second",
+                )
+                table.dataframe(results_frame(results), hide_index=True)
+    finally:
+        st.session_state.batch_seconds = time.perf_counter() - start
+    # render_batch_results shows the final table
+    for placeholder in (stop_placeholder, progress, table):
+        placeholder.empty()
+
+
+def render_batch_results():
+    """Show the results of the latest batch and offer them as a CSV file"""
+    results = st.session_state.get("batch_results")
+    if not results:
+        return
+    df = results_frame(results)
+    counts = df["Status"].value_counts()
+    seconds = st.session_state.get("batch_seconds")
+    summary = ", ".join(f"{n} {status}" for status, n in counts.items())
+    if seconds:
+        summary += f" in {seconds:.1f}s ({len(df) / seconds:.2f} prompts per second)"
+    st.caption(summary)
+    st.dataframe(df, hide_index=True)
+    path = st.session_state.get("batch_file")
+    # The file is deleted with the session store's session
+    if path and os.path.exists(path):
+        with open(path, "rb") as f:
+            st.download_button(
+                "Download CSV", f, file_name="batch_results.csv", mime="text/csv"
+            )
+
+
+def render_batch_interface(settings, agent):
+    """Render the batch page: prompts in, a table of responses out"""
+    st.title("Batch Prompts")
+    st.write(
+        f"Run many prompts through the {agent} at once. Each prompt is "
+        "answered on its own, without the chat history."
+    )
+
+    text = st.text_area("Prompts, one per line", key="batch_text", height=150)
+    uploaded = st.file_uploader(
+        "Or upload prompts", type=["txt", "csv"], key="batch_upload"
+    )
+    if uploaded is not None:
+        text = read_prompt_file(uploaded)
+    template = st.text_input(
+        "Prompt template",
+        key="batch_template",
+        help=f"Each line replaces {ITEM_PLACEHOLDER}, e.g. "
+        f"'Plot the prices of {ITEM_PLACEHOLDER} in 2024'. Leave empty to send "
+        "the lines as they are.",
+    )
+    col1, col2 = st.columns(2)
+    concurrency = col1.number_input(
+        "Concurrency",
+        1,
+        BATCH_MAX_CONCURRENCY,
+        BATCH_CONCURRENCY,
+        key="batch_concurrency",
+        help="Prompts sent to the model servers at the same time",
+    )
+    retries = col2.number_input("Retries", 0, 5, BATCH_MAX_RETRIES, key="batch_retries")
+
+    prompts = parse_prompts(text, template)
+    if st.button(f"Run {len(prompts)} Prompts", type="primary", disabled=not prompts):
+        run_batch_prompts(prompts, settings, agent, int(concurrency), int(retries))
+    render_batch_results()
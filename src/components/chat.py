@@ -1,22 +1,245 @@
 import streamlit as st
-from utils.chat_utils import get_query_messages, create_chat_client
-import base64
-from langchain.schema import HumanMessage, AIMessage, SystemMessage
-import io
-from PIL import Image
+from utils.chat_utils import (
+    create_chat_client,
+    get_agent_config,
+    get_agent_input,
+    get_query_messages,
+)
+import os
+import re
+import time
+from contextlib import closing
 
+from utils.cancellation import cancel_run, finish_run, start_run
+from utils.metrics import trace, trace_turn
+from utils.model_router import model_session
+from utils.plotting import read_plot
+from utils.session_store import get_session_store
 
+# Number of latest turns rendered before "Load older messages" is used
+HISTORY_WINDOW_TURNS = int(os.environ.get("HISTORY_WINDOW_TURNS", 20))
+
+_PLOT_TAG = re.compile(r"<plot>(.*?)</plot>", re.DOTALL)
+
+
+def _load_older_turns():
+    st.session_state.history_window += HISTORY_WINDOW_TURNS
+
+
+def _window_start(messages, turns):
+    """Return the index of the first message of the latest ``turns`` turns"""
+    seen = 0
+    for i in range(len(messages) - 1, -1, -1):
+        if messages[i]["role"] == "user":
+            seen += 1
+            if seen == turns:
+                return i
+    return 0
+
+
+@st.fragment
 def display_chat_history():
-    """Display all messages in the chat history"""
-    # Iterate through all messages stored in the Streamlit session state
-    # Each message is a dictionary with 'role' (user/assistant) and 'content' keys
-    for message in st.session_state.messages:
-        # Create a chat message container with the appropriate role styling
-        # This will show user messages and AI responses in different styles
-        with st.chat_message(message["role"]):
-            # Render the message content as markdown
-            # This allows for rich text formatting in the messages
-            st.markdown(message["content"])
+    """Display the latest turns of the chat history"""
+    # Only the latest turns are rendered on each rerun, so long sessions stay
+    # responsive; older turns are added on demand. Running as a fragment,
+    # loading older turns reruns just the history instead of the whole page.
+    if "history_window" not in st.session_state:
+        st.session_state.history_window = HISTORY_WINDOW_TURNS
+    messages = st.session_state.messages
+    start = _window_start(messages, st.session_state.history_window)
+    if start > 0:
+        older_turns = sum(m["role"] == "user" for m in messages[:start])
+        st.button(
+            f"Load older messages ({older_turns} earlier turns)",
+            key="load_older_turns",
+            on_click=_load_older_turns,
+        )
+
+    with trace("render_history") as span:
+        span["messages"] = len(messages) - start
+        for message in messages[start:]:
+            # Create a chat message container with the appropriate role styling
+            # This will show user messages and AI responses in different styles
+            with st.chat_message(message["role"]):
+                display_message(message)
+
+
+def split_plots(content):
+    """Split the <plot>path</plot> tags out of assistant content"""
+    return _PLOT_TAG.sub("", content), _PLOT_TAG.findall(content)
+
+
+def display_message(message):
+    """Display a stored chat message, rendering its plots from cached bytes"""
+    for plot_path in message.get("plots", ()):
+        try:
+            st.image(read_plot(plot_path))
+        except OSError:
+            st.caption(f"Plot no longer available: {os.path.basename(plot_path)}")
+
+    # Render the message content as markdown
+    # This allows for rich text formatting in the messages
+    if message["content"].strip():
+        st.markdown(message["content"])
+    if message.get("stopped"):
+        st.caption("Stopped")
+
+
+def display_assistant_content(content):
+    """
+    Display assistant content, rendering any <plot> image tags as images.
+
+    Returns:
+        dict: The message to store in the chat history, with the plot paths
+        under "plots" so later reruns do not parse the content again
+    """
+    text, plots = split_plots(content)
+    message = {"role": "assistant", "content": text}
+    if plots:
+        message["plots"] = plots
+    display_message(message)
+    return message
+
+
+def _timed_stream(events, span, token=None):
+    """
+    Iterate over a response stream, splitting the span's wall time into
+    waiting for the model or tools and rendering (everything else).
+
+    When iteration stops early, e.g. because Streamlit interrupts the script
+    for a Stop click or a new message, a model stream is closed, which closes
+    the upstream HTTP response. An agent run (with a cancel ``token``) is
+    cancelled instead and the rest of its events are drained: its nodes stop
+    at the next token or between nodes, and the run still ends cleanly, so
+    its checkpoint never holds unanswered tool calls.
+    """
+    start = time.perf_counter()
+    span["wait_seconds"] = 0.0
+    iterator = iter(events)
+    completed = False
+    try:
+        while True:
+            waited = time.perf_counter()
+            try:
+                event = next(iterator)
+            except StopIteration:
+                completed = True
+                break
+            finally:
+                span["wait_seconds"] += time.perf_counter() - waited
+                span["render_seconds"] = (
+                    time.perf_counter() - start - span["wait_seconds"]
+                )
+            yield event
+    finally:
+        if not completed:
+            span["cancelled"] = True
+            if token is not None:
+                cancel_run(token)
+                for _ in iterator:
+                    pass
+            elif hasattr(iterator, "close"):
+                iterator.close()
+
+
+def stream_chat_response(client, messages, responses):
+    """Stream a plain chat model response token by token into ``responses``"""
+    message_placeholder = st.empty()
+    # Stored before the first token, so an interrupted response is kept
+    response = {"role": "assistant", "content": "", "stopped": True}
+    responses.append(response)
+
+    with trace("stream", agent="chat") as span, closing(
+        _timed_stream(client.stream(messages), span)
+    ) as chunks:
+        for chunk in chunks:
+            response["content"] += chunk.content
+            message_placeholder.markdown(response["content"] + "▌")
+
+        message_placeholder.markdown(response["content"])
+    del response["stopped"]
+    return responses
+
+
+def stream_agent_response(graph, data, config, responses):
+    """Stream an agent run, rendering tokens and tool calls as they happen"""
+    # "messages" yields LLM tokens, "updates" yields each finished node output
+    events = graph.stream(data, config=config, stream_mode=["messages", "updates"])
+    token = config["configurable"].get("cancel_token")
+    with trace("stream", agent="data_agent") as span, closing(
+        _timed_stream(events, span, token)
+    ) as events:
+        _render_agent_events(events, responses)
+    return responses
+
+
+def _render_agent_events(events, responses):
+    from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage
+
+    tool_status = {}
+    message_placeholder = st.empty()
+    partial_response = ""
+
+    try:
+        for mode, payload in events:
+            if mode == "messages":
+                chunk, metadata = payload
+                if metadata.get("langgraph_node") not in ("chatbot", "final_answer"):
+                    continue
+                if isinstance(chunk, AIMessageChunk) and chunk.content:
+                    partial_response += chunk.content
+                    message_placeholder.markdown(partial_response + "▌")
+                continue
+
+            for node, update in payload.items():
+                for message in (update or {}).get("messages", []):
+                    if isinstance(message, AIMessage):
+                        # Replace the streamed tokens with the final rendering
+                        with message_placeholder.container():
+                            response = display_assistant_content(message.content)
+                        if response["content"].strip() or response.get("plots"):
+                            responses.append(response)
+                        for tool_call in message.tool_calls:
+                            tool_status[tool_call["id"]] = st.status(
+                                f"Running `{tool_call['name']}`...", state="running"
+                            )
+                            tool_status[tool_call["id"]].json(tool_call["args"])
+                        message_placeholder = st.empty()
+                        partial_response = ""
+                    elif isinstance(message, ToolMessage):
+                        status = tool_status.get(message.tool_call_id)
+                        if status is None:
+                            continue
+                        failed = message.status == "error"
+                        status.update(
+                            label=f"`{message.name}` {'failed' if failed else 'finished'}",
+                            state="error" if failed else "complete",
+                            expanded=False,
+                        )
+    finally:
+        # Interrupted while the answer streamed: keep the tokens received
+        if partial_response.strip():
+            responses.append(
+                {"role": "assistant", "content": partial_response, "stopped": True}
+            )
+    return responses
+
+
+def retrieve_context(query):
+    """Search the RAG index and show the sources used for the answer"""
+    from agents.rag import format_context, search
+
+    with trace("retrieve") as span:
+        hits = search(query)
+        span["hits"] = len(hits)
+    if not hits:
+        st.caption("No indexed documents match this question.")
+        return None
+    with st.expander(f"Sources ({len(hits)})"):
+        for i, hit in enumerate(hits, start=1):
+            st.markdown(f"**[{i}] {hit['source']}, page {hit['page']}**")
+            st.caption(hit["text"][:500])
+    return format_context(hits)
 
 
 def handle_user_input(user_input, settings, agent):
@@ -26,60 +249,58 @@ def handle_user_input(user_input, settings, agent):
     with st.chat_message("user"):
         st.markdown(user_input)
 
-    # Get AI response
-    client = create_chat_client(settings, agent=agent)
-
-    # Stream the response
-    # with st.chat_message("assistant"):
-    #     message_placeholder = st.empty()
-    #     full_response = ""
-
-    #     for chunk in client.stream(get_query_messages(st.session_state.messages)):
-    #         full_response += chunk.content
-    #         message_placeholder.markdown(full_response + "▌")
-
-    #     message_placeholder.markdown(full_response)
-    config = {"configurable": {"user_id": "3", "thread_id": "1"}}
-
-    data = {
-        "messages": get_query_messages(st.session_state.messages),
-    }
-    events = client.stream(data, config=config, stream_mode="values")
-
-    for event in events:
-        if not "messages" in event:
-            continue
-        message = event["messages"][-1]
-        print(message.pretty_print())
-
-        if isinstance(message, AIMessage):
-            content = message.content
-            print(content)
-            # Check if content contains an image tag
-            if "<plot>" in content:
-                # Extract the image path between the tags
-                img_start = content.find("<plot>") + 6
-                img_end = content.find("</plot>")
-                img_path = content[img_start:img_end]
-
-                # Read and display the image using st.image
-                with st.chat_message("assistant"):
-                    st.markdown("Plotting...")
-                    st.image(img_path)
-
-                # Remove the image tags from the content for text display
-                content = content[: img_start - 6] + content[img_end + 7 :]
-
-            # Display any remaining text content
-            if content.strip():
-                with st.chat_message("assistant"):
-                    st.markdown(content)
-                    # Store the original content in session state
-                    st.session_state.messages.append(
-                        {"role": "assistant", "content": content}
+    # Clicking Stop, like sending a new message, makes Streamlit interrupt
+    # this script run; the streams then cancel the run and close the model
+    # request, and whatever was received so far is kept below
+    token = start_run()
+    responses = []
+    try:
+        # Spans recorded during the turn are grouped under its id, and its
+        # model requests go to the session's endpoint when several are
+        # configured
+        with trace_turn(
+            session_id=st.session_state.session_id, agent=agent
+        ), model_session(st.session_state.thread_id):
+            # Get AI response
+            client = create_chat_client(settings, agent=agent)
+
+            # Stream the response
+            with st.chat_message("assistant"):
+                stop_placeholder = st.empty()
+                stop_placeholder.button("Stop", key="stop_response", icon="⏹")
+                if agent == "Data Agent":
+                    config = get_agent_config(
+                        settings, st.session_state.thread_id, cancel_token=token
                     )
-    # Save the response
-    # st.session_state.messages.append({"role": "assistant", "content": full_response})
+                    data = get_agent_input(client, config, st.session_state.messages)
+                    stream_agent_response(client, data, config, responses)
+                else:
+                    context = None
+                    if agent == "RAG Agent":
+                        context = retrieve_context(user_input)
+                    with trace("prompt"):
+                        messages = get_query_messages(
+                            st.session_state.messages, settings, context=context
+                        )
+                    stream_chat_response(client, messages, responses)
+                stop_placeholder.empty()
+    finally:
+        finish_run(token)
+        # Save the response, complete or not
+        st.session_state.messages.extend(responses)
+        track_chat_memory(responses)
+
+
+def track_chat_memory(responses):
+    """Account the chat history in the session store and let it delete the
+    plots of new responses when the session expires"""
+    store = get_session_store()
+    session_id = st.session_state.session_id
+    # Read on every rerun, so it is pinned rather than spilled
+    store.put(session_id, "messages", st.session_state.messages, spillable=False)
+    for response in responses:
+        for plot_path in response.get("plots", ()):
+            store.track_file(session_id, plot_path)
 
 
 def render_chat_interface(settings, agent):
@@ -1,5 +1,11 @@
+import os
+import uuid
+
 import streamlit as st
 
+from utils.metrics import get_metrics_registry, summarize_turn
+from utils.prompt_template import prompt_date
+
 
 def render_settings_tab():
     """Render the settings tab in the sidebar"""
@@ -9,6 +15,11 @@ def render_settings_tab():
     # Max Token Slider
     max_tokens = st.slider("Max Tokens", 1024, 4096 * 2, 4096, 1024)
 
+    # Context window of the served model, bounds the prompt history
+    context_window = st.select_slider(
+        "Context Window", [4096, 8192, 16384, 32768, 65536, 131072], 16384
+    )
+
     # Top_p Slider
     top_p = st.slider("Top-p", 0.0, 1.0, 0.1, 0.05)
 
@@ -18,15 +29,320 @@ def render_settings_tab():
     # Encourage topic diversity
     presence_penalty = st.slider("Presence Penalty", 0.0, 2.0, 0.0, 0.05)
 
+    # Opt-in response cache, bypassed at temperature > 0 unless forced
+    response_cache = st.checkbox("Cache Responses", False)
+    force_cache = st.checkbox(
+        "Cache at Temperature > 0", False, disabled=not response_cache
+    )
+    if response_cache:
+        from utils.response_cache import get_response_cache
+
+        stats = get_response_cache().stats()
+        st.caption(
+            f"Cache: {stats['memory_hits'] + stats['disk_hits']} hits, "
+            f"{stats['misses']} misses, {stats['bypassed']} bypassed"
+        )
+
     return {
         "temperature": temperature,
         "max_tokens": max_tokens,
+        "context_window": context_window,
         "top_p": top_p,
         "repeat_penalty": repeat_penalty,
         "presence_penalty": presence_penalty,
+        "response_cache": response_cache,
+        "force_cache": force_cache,
+        # The date in the system prompt stays fixed for the whole chat
+        "prompt_date": st.session_state.setdefault("prompt_date", prompt_date()),
     }
 
 
+def render_performance_tab():
+    """Render the performance tab in the sidebar"""
+    registry = get_metrics_registry()
+    # Spans are recorded for the whole process; show this session's turns
+    session_id = st.session_state.get("session_id")
+    turns = [
+        e
+        for e in registry.events()
+        if e["name"] == "turn" and e.get("session_id") == session_id
+    ]
+
+    if not turns:
+        st.caption("Send a message to see where the time of a turn goes.")
+    else:
+        import pandas as pd
+
+        # Breakdown of the latest finished turn
+        last_turn = turns[-1]
+        spans = registry.events(turn_id=last_turn["turn_id"])
+        summary = summarize_turn(spans)
+        st.subheader("Last Turn")
+        col1, col2 = st.columns(2)
+        col1.metric("Total", f"{summary['total']:.2f}s")
+        col2.metric(
+            "LLM Calls",
+            summary["llm_calls"],
+            help=f"{summary['cache_hits']} served from the response cache",
+        )
+        st.dataframe(
+            pd.DataFrame(
+                {
+                    "Stage": [
+                        "LLM prefill",
+                        "LLM decode",
+                        "Tools",
+                        "Rendering",
+                        "Other",
+                    ],
+                    "Seconds": [
+                        summary["prefill"],
+                        summary["decode"],
+                        summary["tools"],
+                        summary["render"],
+                        summary["other"],
+                    ],
+                }
+            ),
+            hide_index=True,
+            use_container_width=True,
+        )
+        tokens_per_second = (
+            summary["completion_tokens"] / summary["decode"]
+            if summary["decode"]
+            else 0.0
+        )
+        st.caption(
+            f"Tokens: {summary['prompt_tokens']} prompt, "
+            f"{summary['completion_tokens']} completion "
+            f"({tokens_per_second:.1f} tokens/s)"
+        )
+        shared, rendered = (
+            summary["shared_prefix_tokens"],
+            summary["rendered_prompt_tokens"],
+        )
+        if rendered:
+            st.caption(
+                f"Prompt prefix reused: {shared / rendered:.0%} ({shared} of "
+                f"{rendered} tokens shared with the previous request)"
+            )
+
+        tools = [e for e in spans if e["name"] == "tool"]
+        if tools:
+            st.dataframe(
+                pd.DataFrame(
+                    {
+                        "Tool": [e["labels"]["tool"] for e in tools],
+                        "Seconds": [e["duration"] for e in tools],
+                        "Status": [e["status"] for e in tools],
+                    }
+                ),
+                hide_index=True,
+                use_container_width=True,
+            )
+
+        # Latency of recent turns, oldest first
+        st.subheader("Recent Turns")
+        st.bar_chart(
+            pd.DataFrame(
+                {"Seconds": [e["duration"] for e in turns[-20:]]},
+            ),
+            height=150,
+        )
+
+    from utils.chat_utils import get_model_router
+
+    router = get_model_router()
+    if router is not None:
+        import pandas as pd
+
+        st.subheader("Model Endpoints")
+        st.caption("Requests of all sessions of this process")
+        endpoints = pd.DataFrame(router.stats())
+        st.dataframe(
+            endpoints[
+                [
+                    "endpoint",
+                    "healthy",
+                    "outstanding",
+                    "requests",
+                    "failures",
+                    "header_seconds",
+                    "total_seconds",
+                ]
+            ].rename(
+                columns={
+                    "endpoint": "Endpoint",
+                    "healthy": "Healthy",
+                    "outstanding": "Queue",
+                    "requests": "Requests",
+                    "failures": "Failures",
+                    "header_seconds": "TTFB (s)",
+                    "total_seconds": "Latency (s)",
+                }
+            ),
+            hide_index=True,
+            use_container_width=True,
+        )
+
+    if "session_id" in st.session_state:
+        from utils.session_store import get_session_store
+
+        store = get_session_store()
+        session = store.session_stats(st.session_state.session_id)
+        totals = store.stats()
+        st.subheader("Memory")
+        col1, col2 = st.columns(2)
+        col1.metric(
+            "This Session",
+            f"{session['memory_bytes'] / 1024**2:.1f} MB",
+            help=f"{session['objects']} objects, budget "
+            f"{session['max_bytes'] / 1024**2:.0f} MB",
+        )
+        col2.metric(
+            "All Sessions",
+            f"{totals['memory_bytes'] / 1024**2:.1f} MB",
+            help=f"{totals['sessions']} sessions, budget "
+            f"{totals['max_bytes'] / 1024**2:.0f} MB",
+        )
+        st.caption(
+            f"Spilled to disk: {session['spilled']} objects "
+            f"({session['spilled_bytes'] / 1024**2:.1f} MB) in this session, "
+            f"{totals['spilled_bytes'] / 1024**2:.1f} MB in all; "
+            f"{totals['spills']} spills, {totals['reloads']} reloads"
+        )
+
+    # Process-wide totals and exports for dashboards
+    st.caption(
+        "Process-wide totals (all sessions): "
+        f"{registry.counter_totals('llm_requests_total')} LLM calls, "
+        f"{registry.counter_totals('llm_prompt_tokens_total')} prompt "
+        f"and {registry.counter_totals('llm_completion_tokens_total')} "
+        f"completion tokens, {registry.counter_totals('tool_calls_total')} "
+        "tool calls"
+    )
+    col1, col2 = st.columns(2)
+    col1.download_button(
+        "Prometheus",
+        registry.to_prometheus(),
+        file_name="metrics.prom",
+        mime="text/plain",
+    )
+    col2.download_button(
+        "Spans (JSONL)",
+        registry.to_jsonl(),
+        file_name="spans.jsonl",
+        mime="application/x-ndjson",
+    )
+
+
+def render_rag_options():
+    """Index uploaded PDFs and search them"""
+    from agents.rag import add_uploaded_file, index_stats, search
+
+    uploaded_files = st.file_uploader(
+        "Upload PDF", type=["pdf"], accept_multiple_files=True, key="pdf_upload"
+    )
+    indexed = st.session_state.setdefault("rag_indexed_files", set())
+    for uploaded_file in uploaded_files or []:
+        if uploaded_file.file_id in indexed:
+            continue
+        with st.spinner(f"Indexing {uploaded_file.name}..."):
+            try:
+                result = add_uploaded_file(uploaded_file)
+            except Exception as e:
+                st.error(f"Could not index {uploaded_file.name}: {e}")
+                continue
+        indexed.add(uploaded_file.file_id)
+        st.toast(
+            f"Indexed {uploaded_file.name}: {result['added']} new chunks, "
+            f"{result['duplicate']} already indexed"
+        )
+
+    stats = index_stats()
+    if stats:
+        st.caption(
+            f"Index: {stats['sources']} documents, {stats['chunks']} chunks, "
+            f"{stats['terms']} terms ({stats['bytes'] / 1024**2:.1f} MB)"
+        )
+    else:
+        st.caption("Upload PDFs to answer questions from them.")
+
+    search_query = st.text_input("Search PDF Content", key="search_query")
+    if search_query:
+        hits = search(search_query)
+        if not hits:
+            st.caption("No matches.")
+        for hit in hits:
+            st.markdown(f"**{hit['source']}, page {hit['page']}** ({hit['score']:.2f})")
+            st.caption(hit["text"][:300])
+
+
+def render_sn_options():
+    """Choose the SN Agent CSV file and ingest it into the columnar store"""
+    from utils.partitioned_store import (
+        ingest_csv,
+        load_manifest,
+        save_upload,
+        store_available,
+        store_path,
+    )
+
+    csv_path = st.text_input(
+        "CSV Path", help="A file on the server, for exports too large to upload"
+    )
+    uploaded_file = st.file_uploader("Upload CSV", type=["csv"], key="sn_upload")
+    # Copied once per upload rather than on every rerun, and again if the
+    # copy expired with the session
+    uploads = st.session_state.setdefault("sn_uploads", {})
+    if uploaded_file is not None and not os.path.isfile(
+        uploads.get(uploaded_file.file_id, "")
+    ):
+        uploads[uploaded_file.file_id] = save_upload(uploaded_file)
+        if "session_id" in st.session_state:
+            from utils.session_store import get_session_store
+
+            # Deleted with the last session that uploaded the same file
+            get_session_store().track_file(
+                st.session_state.session_id, uploads[uploaded_file.file_id]
+            )
+    if uploaded_file is not None:
+        csv_path = uploads[uploaded_file.file_id]
+    if not csv_path:
+        st.caption("Provide a CSV file with a date column and one column per ticker.")
+        return
+    if not os.path.isfile(csv_path):
+        st.error(f"File not found: {csv_path}")
+        return
+    st.session_state.sn_file_path = csv_path
+
+    if not store_available():
+        st.caption("Install pyarrow to query large files from a columnar store.")
+        return
+    manifest = load_manifest(store_path(csv_path))
+    if manifest is None and st.button("Build Columnar Store"):
+        progress = st.progress(0.0, text="Ingesting CSV...")
+        try:
+            store_dir = ingest_csv(
+                csv_path,
+                progress=lambda fraction: progress.progress(
+                    fraction, text=f"Ingesting CSV... {fraction:.0%}"
+                ),
+            )
+        except Exception as e:
+            st.error(f"Could not ingest {csv_path}: {e}")
+            return
+        progress.empty()
+        manifest = load_manifest(store_dir)
+    if manifest is not None:
+        stored = sum(p["bytes"] for p in manifest["partitions"].values())
+        st.caption(
+            f"Store: {manifest['rows']:,} rows, {len(manifest['columns'])} tickers, "
+            f"{len(manifest['partitions'])} {manifest['granularity']} partitions "
+            f"({stored / 1024**2:.1f} MB, CSV {manifest['source_bytes'] / 1024**2:.1f} MB)"
+        )
+
+
 def render_agents_tab():
     """Render the agents tab in the sidebar"""
     # Select LLM Agent
@@ -37,9 +353,18 @@ def render_agents_tab():
     # Sidebar Model Parameters
     if agent == "RAG Agent":
         st.header("RAG Agent Options")
-        uploaded_file = st.file_uploader("Upload PDF", type=["pdf"], key="pdf_upload")
-        search_query = st.text_input("Search PDF Content", key="search_query")
-        search_result = st.text_area("Search Result", "", key="search_result")
+        render_rag_options()
+    elif agent == "SN Agent":
+        st.header("Data Source")
+        render_sn_options()
+
+    # Batch Mode replaces the chat with a page of parallel prompts
+    if agent != "SN Agent":
+        st.toggle(
+            "Batch Mode",
+            key="batch_mode",
+            help="Run a list of prompts in parallel instead of chatting",
+        )
 
     # System Message Customization
     if agent != "SN Agent":  # Don't show system message for SN Agent
@@ -49,7 +374,29 @@ def render_agents_tab():
         )
 
         if st.button("Clear Chat", type="primary"):
+            plots = [
+                plot_path
+                for message in st.session_state.get("messages", [])
+                for plot_path in message.get("plots", ())
+            ]
             st.session_state.messages = []
+            st.session_state.history_summary = {}
+            st.session_state.pop("history_window", None)
+            st.session_state.pop("prompt_date", None)
+            if "session_id" in st.session_state:
+                from utils.session_store import get_session_store
+
+                # Plots of the cleared chat, unless another session shows them;
+                # batch results and exports stay until the session expires
+                store = get_session_store()
+                store.pop(st.session_state.session_id, "messages")
+                store.release_files(st.session_state.session_id, paths=plots)
+            # Start a fresh agent thread so old checkpoints are not reused
+            if "thread_id" in st.session_state:
+                from agents.datasets import get_dataset_registry
+
+                get_dataset_registry().drop_session(st.session_state.thread_id)
+            st.session_state.thread_id = uuid.uuid4().hex
 
     return agent
 
@@ -58,7 +405,7 @@ def render_sidebar():
     """Render the complete sidebar"""
     st.sidebar.header("Settings")
 
-    tab1, tab2 = st.sidebar.tabs(["Agents", "Settings"])
+    tab1, tab2, tab3 = st.sidebar.tabs(["Agents", "Settings", "Performance"])
 
     with tab1:
         agent = render_agents_tab()
@@ -66,4 +413,7 @@ def render_sidebar():
     with tab2:
         settings = render_settings_tab()
 
+    with tab3:
+        render_performance_tab()
+
     return agent, settings
@@ -1,18 +1,38 @@
 import streamlit as st
-import pandas as pd
 import json
 import os
 import tempfile
 
+from utils.data_utils import (
+    EXPORT_FORMATS,
+    available_export_formats,
+    get_csv_tickers,
+    load_panel,
+    write_frame,
+)
+from utils.analytics import (
+    ANALYSES,
+    FREQUENCIES,
+    MAX_WINDOW,
+    MIN_WINDOW,
+    parse_notes,
+    run_analysis,
+)
+from utils.plotting import downsample_frame
+from utils.session_store import get_session_store
+
+# Rows per page offered by the DataFrame and JSON views
+RESULT_PAGE_SIZES = [50, 100, 500, 1000]
+# About one point per horizontal pixel of the chart
+CHART_MAX_POINTS = int(os.environ.get("CHART_MAX_POINTS", 1000))
+
 
 def process_csv_data(csv_path, ticker_name, start_date, end_date):
     """
     Process CSV data according to specified parameters:
-    1. Read data from CSV file
-    2. Set the "date" column as index
-    3. Select a specific column based on ticker_name
-    4. Rename that column to "value"
-    5. Filter data between start_date and end_date
+    1. Load the ticker column from the cached, date-indexed panel
+    2. Rename that column to "value"
+    3. Filter data between start_date and end_date
 
     Args:
         csv_path (str): Path to the CSV file
@@ -24,23 +44,172 @@ def process_csv_data(csv_path, ticker_name, start_date, end_date):
         pandas.DataFrame: Processed DataFrame
     """
     try:
-        # Read the CSV file
-        df = pd.read_csv(csv_path)
+        df = load_panel(csv_path, [ticker_name], start_date, end_date)
+        return df.rename(columns={ticker_name: "value"})
+    except Exception as e:
+        st.error(f"Error processing CSV: {str(e)}")
+        return None
 
-        # Convert date column to datetime and set as index
-        df["date"] = pd.to_datetime(df["date"])
-        df.set_index("date", inplace=True)
 
-        # Select the specified column and rename it
-        df = df[[ticker_name]].rename(columns={ticker_name: "value"})
+def set_result(df):
+    """Store a new SN Agent result and drop the exports of the previous one"""
+    for path in st.session_state.get("sn_exports", {}).values():
+        if os.path.exists(path):
+            os.unlink(path)
+    st.session_state.sn_exports = {}
+    # Kept in the session store, which spills it to disk under memory
+    # pressure. Results can be frames of the process-wide analytics and panel
+    # caches, so the session gets a copy of its own that spilling really frees
+    get_session_store().put(st.session_state.session_id, "sn_result_df", df.copy())
+    st.session_state.sn_page = 1
+
+
+def get_result_page(df, page, page_size):
+    """Return the rows of a 1-based page of a result DataFrame"""
+    start = (page - 1) * page_size
+    return df.iloc[start : start + page_size]
+
+
+def render_analysis_controls():
+    """Render the analysis settings and return them as run_analysis kwargs"""
+    analysis_col1, analysis_col2 = st.columns(2)
+    with analysis_col1:
+        analysis = st.selectbox("Analysis", list(ANALYSES), key="sn_analysis")
+        # Default set through the key, so notes can preset it without warnings
+        st.session_state.setdefault("sn_window", 20)
+        window = st.number_input(
+            "Rolling Window",
+            MIN_WINDOW,
+            MAX_WINDOW,
+            key="sn_window",
+            disabled=not analysis.startswith("Rolling"),
+            help="Periods of the rolling mean and volatility",
+        )
+    with analysis_col2:
+        frequency = st.selectbox("Frequency", list(FREQUENCIES), key="sn_frequency")
+        log_returns = st.checkbox(
+            "Log Returns",
+            key="sn_log_returns",
+            disabled=analysis
+            not in ("Returns", "Rolling Volatility", "Correlation", "Summary"),
+        )
+    return {
+        "analysis": analysis,
+        "frequency": frequency,
+        "window": int(window),
+        "log_returns": log_returns,
+    }
+
+
+def apply_notes(notes):
+    """Preset the analysis controls from the Notes/Query text"""
+    settings = parse_notes(notes)
+    for name, value in settings.items():
+        st.session_state[f"sn_{name}"] = value
+    return settings
+
+
+def render_analysis_result(selection, settings):
+    """Run the selected analysis on the processed selection and show it"""
+    key = (selection, tuple(sorted(settings.items())))
+    store = get_session_store()
+    result = store.get(st.session_state.session_id, "sn_result_df")
+    # Recompute when the session store expired the result
+    if st.session_state.get("sn_result_key") != key or result is None:
+        csv_path, tickers, start_date, end_date = selection
+        try:
+            result = run_analysis(
+                csv_path, list(tickers), start_date, end_date, **settings
+            )
+        except Exception as e:
+            st.error(f"Error running {settings['analysis']}: {str(e)}")
+            return
+        set_result(result)
+        st.session_state.sn_result_key = key
+    render_result_views(
+        result,
+        chart=ANALYSES[settings["analysis"]] == "series",
+    )
+
+
+def render_result_views(df, chart=True):
+    """
+    Render paginated DataFrame and JSON views, a chart and downloads.
 
-        # Filter data between start and end dates
-        df = df.loc[start_date:end_date]
+    Only the rows of the current page are converted for display, and the
+    chart gets at most CHART_MAX_POINTS rows. Results that are not time
+    series (e.g. a correlation matrix) get no chart.
+    """
+    page_col1, page_col2 = st.columns(2)
+    with page_col1:
+        page_size = st.selectbox("Rows per page", RESULT_PAGE_SIZES, key="sn_page_size")
+    pages = max(1, -(-len(df) // page_size))
+    # Keep the page in range when the page size grows
+    if st.session_state.get("sn_page", 1) > pages:
+        st.session_state.sn_page = pages
+    with page_col2:
+        page = st.number_input("Page", 1, pages, key="sn_page")
+    page_df = get_result_page(df, page, page_size)
+    st.caption(
+        f"Rows {(page - 1) * page_size + 1}-{(page - 1) * page_size + len(page_df)} "
+        f"of {len(df)}, {df.shape[1]} tickers"
+    )
+
+    tabs = st.tabs(
+        ["DataFrame", "JSON", "Chart", "Download"]
+        if chart
+        else ["DataFrame", "JSON", "Download"]
+    )
+
+    with tabs[0]:
+        st.dataframe(page_df)
+
+    with tabs[1]:
+        st.json(
+            json.loads(
+                page_df.reset_index().to_json(orient="records", date_format="iso")
+            )
+        )
 
-        return df
-    except Exception as e:
-        st.error(f"Error processing CSV: {str(e)}")
-        return None
+    if chart:
+        with tabs[2]:
+            chart_df = downsample_frame(df, CHART_MAX_POINTS)
+            if len(chart_df) < len(df):
+                st.caption(f"Showing {len(chart_df)} of {len(df)} dates")
+            st.line_chart(chart_df)
+
+    with tabs[-1]:
+        render_result_downloads(df)
+
+
+def render_result_downloads(df):
+    """Offer the result as a file, written in chunks to a temporary file"""
+    fmt = st.selectbox("Format", available_export_formats(), key="sn_export_format")
+    extension, mime, _ = EXPORT_FORMATS[fmt]
+
+    exports = st.session_state.setdefault("sn_exports", {})
+    # Export files are deleted with the session store's session
+    if fmt in exports and not os.path.exists(exports[fmt]):
+        del exports[fmt]
+    if fmt not in exports:
+        if not st.button(f"Prepare {fmt} file"):
+            return
+        fd, path = tempfile.mkstemp(prefix="sn_export_", suffix=f".{extension}")
+        os.close(fd)
+        with st.spinner(f"Writing {fmt} file..."):
+            write_frame(df, path, fmt)
+        exports[fmt] = path
+        get_session_store().track_file(st.session_state.session_id, path)
+
+    path = exports[fmt]
+    st.caption(f"{os.path.getsize(path) / 1024**2:.1f} MB")
+    with open(path, "rb") as f:
+        st.download_button(
+            f"Download {fmt}",
+            f,
+            file_name=f"sn_result.{extension}",
+            mime=mime,
+        )
 
 
 def render_sn_agent_interface():
@@ -180,38 +349,52 @@ def render_sn_agent_interface():
                 and end_date
             ):
                 try:
-                    # Create empty dataframe to hold all processed ticker data
-                    all_data = pd.DataFrame()
-
-                    # If there are notes, you might want to display them or use them
+                    # Notes like "monthly drawdown" preset the analysis controls
                     if st.session_state.sn_notes:
-                        st.info(f"Processing with notes: {st.session_state.sn_notes}")
+                        applied = apply_notes(st.session_state.sn_notes)
+                        if applied:
+                            st.info(
+                                "Settings from notes: "
+                                + ", ".join(f"{k}={v}" for k, v in applied.items())
+                            )
+
+                    # Skip tickers that are not columns of the file
+                    available = set(get_csv_tickers(file_to_process))
+                    tickers = [
+                        ticker
+                        for ticker in st.session_state.selected_tickers
+                        if ticker in available
+                    ]
+                    skipped = [
+                        ticker
+                        for ticker in st.session_state.selected_tickers
+                        if ticker not in available
+                    ]
+                    if skipped:
+                        st.warning(f"Tickers not found in file: {', '.join(skipped)}")
+
+                    # Load all tickers in one pass from the cached panel
+                    all_data = load_panel(
+                        file_to_process,
+                        tickers,
+                        start_date.strftime("%Y-%m-%d"),
+                        end_date.strftime("%Y-%m-%d"),
+                    )
+
+                    # Store-backed files report what the query had to read
+                    st.session_state.sn_scan = all_data.attrs.get("scan")
 
-                    for ticker in st.session_state.selected_tickers:
-                        # Process each ticker
-                        ticker_data = process_csv_data(
+                    if not all_data.empty:
+                        # Store the selection so column 2 can analyze it; each
+                        # analysis step is memoized, so changing a setting
+                        # only recomputes the steps that depend on it
+                        st.session_state.sn_selection = (
                             file_to_process,
-                            ticker,
+                            tuple(tickers),
                             start_date.strftime("%Y-%m-%d"),
                             end_date.strftime("%Y-%m-%d"),
                         )
-
-                        if ticker_data is not None:
-                            # Rename value column to ticker name for clarity
-                            ticker_data = ticker_data.rename(columns={"value": ticker})
-
-                            # Add to all_data dataframe
-                            if all_data.empty:
-                                all_data = ticker_data
-                            else:
-                                all_data = pd.concat([all_data, ticker_data], axis=1)
-
-                    if not all_data.empty:
-                        # Store the result in session state so it can be displayed in column 2
-                        st.session_state.sn_result_df = all_data
-                        st.session_state.sn_result_json = all_data.to_json(
-                            orient="records", date_format="iso"
-                        )
+                        st.session_state.pop("sn_result_key", None)
                     else:
                         st.error(
                             "No data was processed. Please check your file path and parameters."
@@ -239,48 +422,23 @@ def render_sn_agent_interface():
                 st.markdown(st.session_state.sn_notes)
 
         # Display tabs for different output formats
-        tab1, tab2, tab3 = st.tabs(["DataFrame", "JSON", "Chart"])
-
-        with tab1:
-            if "sn_result_df" in st.session_state:
-                st.dataframe(st.session_state.sn_result_df)
-            else:
-                st.info("Process data to see results here")
-
-        with tab2:
-            if "sn_result_json" in st.session_state:
-                st.json(json.loads(st.session_state.sn_result_json))
-            else:
-                st.info("Process data to see JSON here")
-
-        with tab3:
-            if (
-                "sn_result_df" in st.session_state
-                and not st.session_state.sn_result_df.empty
-            ):
-                st.line_chart(st.session_state.sn_result_df)
-            else:
-                st.info("Process data to see chart here")
+        if "sn_selection" in st.session_state:
+            scan = st.session_state.get("sn_scan")
+            if scan:
+                st.caption(
+                    f"Read {scan['bytes_scanned'] / 1024**2:.1f} of "
+                    f"{scan['bytes_total'] / 1024**2:.1f} MB: "
+                    f"{scan['partitions_read']}/{scan['partitions_total']} partitions, "
+                    f"{scan['row_groups_read']} row groups, {scan['rows']:,} rows"
+                )
+            settings = render_analysis_controls()
+            render_analysis_result(st.session_state.sn_selection, settings)
+        else:
+            st.info("Process data to see results here")
 
 
-def create_sample_data(tickers, start_date, end_date):
+def create_sample_data(tickers, start_date, end_date, model="random_walk", seed=None):
     """Create sample data for demonstration purposes"""
-    # Convert dates to pandas datetime
-    start = pd.to_datetime(start_date)
-    end = pd.to_datetime(end_date)
-
-    # Create a date range
-    date_range = pd.date_range(start=start, end=end, freq="D")
-
-    # Create empty dataframe with date as index
-    df = pd.DataFrame(index=date_range)
-    df.index.name = "date"
-
-    # Add data for each selected ticker
-    import numpy as np
-
-    for ticker in tickers:
-        # Generate random data for demonstration
-        df[ticker] = np.random.normal(100, 10, len(date_range)).cumsum()
+    from utils.synthetic import generate_panel
 
-    return df
+    return generate_panel(tickers, start_date, end_date, model=model, seed=seed)
@@ -1,13 +1,21 @@
+import uuid
+
 import streamlit as st
 from components.sidebar import render_sidebar
-from components.chat import render_chat_interface
-from components.sn_agent import render_sn_agent_interface
+from utils.warmup import start_warmup
 
 
 def init_session_state():
     """Initialize session state variables"""
     if "messages" not in st.session_state:
         st.session_state.messages = []
+    if "thread_id" not in st.session_state:
+        # Each browser session gets its own agent checkpoint thread
+        st.session_state.thread_id = uuid.uuid4().hex
+    if "session_id" not in st.session_state:
+        # Owns the large objects and files of this browser session, across
+        # chat threads
+        st.session_state.session_id = uuid.uuid4().hex
 
 
 def main():
@@ -21,13 +29,26 @@ def main():
     agent, settings = render_sidebar()
 
     # Render appropriate interface based on selected agent
+    # Each page imports its stack on first use, so a fresh worker only loads
+    # what the selected agent needs before the first paint
     if agent == "SN Agent":
         # Render the SN Agent interface
+        from components.sn_agent import render_sn_agent_interface
+
         render_sn_agent_interface()
+    elif st.session_state.get("batch_mode"):
+        from components.batch import render_batch_interface
+
+        render_batch_interface(settings, agent)
     else:
         # Render main chat interface
+        from components.chat import render_chat_interface
+
         render_chat_interface(settings, agent)
 
+    # Load the remaining stacks in the background once the page is out
+    start_warmup()
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,289 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from utils.data_utils import file_hash, load_panel
+
+# Upper bound (in bytes) for memoized analytics results kept by this process
+ANALYTICS_CACHE_MAX_BYTES = int(
+    os.environ.get("ANALYTICS_CACHE_MAX_BYTES", 256 * 1024**2)
+)
+
+# Analyses offered by the SN Agent; "matrix" results are indexed by ticker
+ANALYSES = {
+    "Prices": "series",
+    "Returns": "series",
+    "Rolling Mean": "series",
+    "Rolling Volatility": "series",
+    "Drawdown": "series",
+    "Correlation": "matrix",
+    "Summary": "matrix",
+}
+# Resampling rules (last price of each period) and periods per year
+FREQUENCIES = {
+    "Daily": (None, 252),
+    "Weekly": ("W-FRI", 52),
+    "Monthly": ("ME", 12),
+}
+# Range of the rolling window, for the widget and for windows read from notes
+MIN_WINDOW = 2
+MAX_WINDOW = 1000
+
+
+def _nbytes(df):
+    return int(df.memory_usage(index=True, deep=False).sum())
+
+
+class AnalyticsCache:
+    """Memoized intermediate results of the analytics pipeline.
+
+    Every step is keyed by the selection (file content hash, tickers and
+    date range) plus only the parameters it depends on, so changing the
+    rolling window reuses the resampled prices and returns. Entries are
+    evicted in least-recently-used order beyond ``max_bytes``.
+    """
+
+    def __init__(self, max_bytes=ANALYTICS_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+
+        # Computed outside the lock; concurrent misses may compute twice
+        value = compute()
+        nbytes = _nbytes(value)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (value, nbytes)
+                self._nbytes += nbytes
+            while self._nbytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._nbytes -= evicted
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+
+_analytics_cache = AnalyticsCache()
+
+
+def get_analytics_cache():
+    """Return the process-wide analytics cache"""
+    return _analytics_cache
+
+
+class _Pipeline:
+    # The steps of one selection; each step memoizes under its own key
+    def __init__(self, csv_path, tickers, start_date, end_date, cache):
+        self.csv_path = csv_path
+        self.tickers = list(dict.fromkeys(tickers))
+        self.start_date = start_date
+        self.end_date = end_date
+        self.cache = cache
+        self.selection = (
+            file_hash(csv_path),
+            tuple(self.tickers),
+            start_date,
+            end_date,
+        )
+
+    def _memo(self, step, params, compute):
+        return self.cache.get_or_compute((self.selection, step, params), compute)
+
+    def prices(self, frequency):
+        def compute():
+            df = load_panel(self.csv_path, self.tickers, self.start_date, self.end_date)
+            df = df.astype(np.float64)
+            rule, _ = FREQUENCIES[frequency]
+            if rule is not None:
+                df = df.resample(rule).last().dropna(how="all")
+            return df
+
+        return self._memo("prices", (frequency,), compute)
+
+    def returns(self, frequency, log_returns):
+        def compute():
+            prices = self.prices(frequency)
+            values = prices.to_numpy()
+            with np.errstate(divide="ignore", invalid="ignore"):
+                if log_returns:
+                    returns = np.diff(np.log(values), axis=0)
+                else:
+                    returns = values[1:] / values[:-1] - 1.0
+            return pd.DataFrame(returns, index=prices.index[1:], columns=prices.columns)
+
+        return self._memo("returns", (frequency, log_returns), compute)
+
+    def rolling_mean(self, frequency, window):
+        return self._memo(
+            "rolling_mean",
+            (frequency, window),
+            lambda: self.prices(frequency).rolling(window, min_periods=window).mean(),
+        )
+
+    def rolling_volatility(self, frequency, log_returns, window):
+        _, periods_per_year = FREQUENCIES[frequency]
+
+        def compute():
+            returns = self.returns(frequency, log_returns)
+            volatility = returns.rolling(window, min_periods=window).std()
+            return volatility * np.sqrt(periods_per_year)
+
+        return self._memo(
+            "rolling_volatility", (frequency, log_returns, window), compute
+        )
+
+    def drawdown(self, frequency):
+        def compute():
+            prices = self.prices(frequency)
+            values = prices.to_numpy()
+            # Running peak of every column at once; NaN gaps keep the peak
+            peaks = np.fmax.accumulate(values, axis=0)
+            return pd.DataFrame(
+                values / peaks - 1.0, index=prices.index, columns=prices.columns
+            )
+
+        return self._memo("drawdown", (frequency,), compute)
+
+    def correlation(self, frequency, log_returns):
+        return self._memo(
+            "correlation",
+            (frequency, log_returns),
+            lambda: self.returns(frequency, log_returns).corr(),
+        )
+
+    def summary(self, frequency, log_returns):
+        _, periods_per_year = FREQUENCIES[frequency]
+
+        def compute():
+            prices = self.prices(frequency)
+            returns = self.returns(frequency, log_returns)
+            first, last = prices.bfill().iloc[0], prices.ffill().iloc[-1]
+            summary = pd.DataFrame(
+                {
+                    "total_return": last / first - 1.0,
+                    "annualized_volatility": returns.std() * np.sqrt(periods_per_year),
+                    "max_drawdown": self.drawdown(frequency).min(),
+                    "observations": prices.count(),
+                }
+            )
+            summary.index.name = "ticker"
+            return summary
+
+        return self._memo("summary", (frequency, log_returns), compute)
+
+
+def run_analysis(
+    csv_path,
+    tickers,
+    start_date,
+    end_date,
+    analysis="Prices",
+    frequency="Daily",
+    window=20,
+    log_returns=False,
+    cache=None,
+):
+    """
+    Run an analysis on all selected tickers at once.
+
+    Args:
+        csv_path (str): Path to the CSV file, must contain a "date" column
+        tickers (list[str]): Columns to analyze
+        start_date (str): Start date in YYYY-MM-DD format
+        end_date (str): End date in YYYY-MM-DD format
+        analysis (str): One of ANALYSES
+        frequency (str): One of FREQUENCIES, prices are resampled first
+        window (int): Periods of the rolling statistics
+        log_returns (bool): Use log returns instead of simple returns
+        cache (AnalyticsCache, optional): Defaults to the process-wide cache
+
+    Returns:
+        pandas.DataFrame: Date-indexed for series analyses, ticker-indexed
+        for "Correlation" and "Summary"
+    """
+    if analysis not in ANALYSES:
+        raise ValueError(f"Unknown analysis {analysis!r}, expected one of {ANALYSES}")
+    if frequency not in FREQUENCIES:
+        raise ValueError(f"Unknown frequency {frequency!r}")
+    pipeline = _Pipeline(
+        csv_path, tickers, start_date, end_date, cache or _analytics_cache
+    )
+    window = int(window)
+    if analysis == "Prices":
+        return pipeline.prices(frequency)
+    if analysis == "Returns":
+        return pipeline.returns(frequency, log_returns)
+    if analysis == "Rolling Mean":
+        return pipeline.rolling_mean(frequency, window)
+    if analysis == "Rolling Volatility":
+        return pipeline.rolling_volatility(frequency, log_returns, window)
+    if analysis == "Drawdown":
+        return pipeline.drawdown(frequency)
+    if analysis == "Correlation":
+        return pipeline.correlation(frequency, log_returns)
+    return pipeline.summary(frequency, log_returns)
+
+
+# Notes keywords and the analysis settings they select
+_NOTE_ANALYSES = [
+    (re.compile(r"\bcorrelat"), "Correlation"),
+    (re.compile(r"\bdrawdowns?\b"), "Drawdown"),
+    (re.compile(r"\bvolatility\b|\bvol\b"), "Rolling Volatility"),
+    (re.compile(r"\b(rolling|moving) (mean|average)\b|\bsma\b"), "Rolling Mean"),
+    (re.compile(r"\breturns?\b"), "Returns"),
+    (re.compile(r"\bsummary\b|\bstatistics\b"), "Summary"),
+]
+_NOTE_FREQUENCIES = [
+    (re.compile(r"\bweekly\b|\bweeks?\b"), "Weekly"),
+    (re.compile(r"\bmonthly\b|\bmonths?\b"), "Monthly"),
+    (re.compile(r"\bdaily\b"), "Daily"),
+]
+_NOTE_WINDOW = re.compile(
+    r"\b(\d{1,4})[- ]?(?:day|week|month|period)s?\b|\bwindow\D{0,3}(\d{1,4})"
+)
+
+
+def parse_notes(notes):
+    """
+    Read analysis settings from free-text notes, e.g. "monthly log returns
+    volatility over 6 months".
+
+    Returns:
+        dict: The settings mentioned, a subset of "analysis", "frequency",
+        "window" and "log_returns"
+    """
+    text = (notes or "").lower()
+    settings = {}
+    for pattern, analysis in _NOTE_ANALYSES:
+        if pattern.search(text):
+            settings["analysis"] = analysis
+            break
+    for pattern, frequency in _NOTE_FREQUENCIES:
+        if pattern.search(text):
+            settings["frequency"] = frequency
+            break
+    match = _NOTE_WINDOW.search(text)
+    if match:
+        window = int(match.group(1) or match.group(2))
+        settings["window"] = min(MAX_WINDOW, max(MIN_WINDOW, window))
+    if re.search(r"\blog\b|\blogarithmic\b", text):
+        settings["log_returns"] = True
+    return settings
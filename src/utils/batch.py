@@ -0,0 +1,209 @@
+"""Batch execution of prompts with bounded concurrency and retries.
+
+Each prompt runs on a worker thread of its own, at most ``concurrency`` at a
+time, so a batch keeps the model servers busy instead of waiting for one
+response before sending the next. Results are yielded as they finish.
+"""
+
+import csv
+import io
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from utils.cancellation import (
+    cancel_run,
+    finish_run,
+    token_cancelled,
+    wait_cancelled,
+)
+from utils.metrics import get_metrics_registry, trace
+
+logger = logging.getLogger(__name__)
+
+# Prompts run at the same time by default
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", 8))
+# Upper bound of the concurrency setting, the size of the HTTP connection pool
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", 64))
+# Retries of a failed prompt
+BATCH_MAX_RETRIES = int(os.environ.get("BATCH_MAX_RETRIES", 2))
+# Seconds before the first retry, doubled for each further one
+BATCH_RETRY_BACKOFF_SECONDS = float(os.environ.get("BATCH_RETRY_BACKOFF_SECONDS", 1.0))
+
+# Placeholder replaced by each line when a prompt template is used
+ITEM_PLACEHOLDER = "{item}"
+
+RESULT_FIELDS = ["index", "prompt", "status", "attempts", "seconds", "response"]
+
+_PLOT_TAG = re.compile(r"<plot>.*?</plot>", re.DOTALL)
+
+
+def parse_prompts(text, template=None):
+    """
+    Return the non-empty lines of ``text`` as prompts.
+
+    With a template, each line replaces ITEM_PLACEHOLDER in it, e.g. a list
+    of tickers and "Plot the prices of {item} in 2024".
+    """
+    items = [line.strip() for line in text.splitlines() if line.strip()]
+    if template and template.strip():
+        return [template.replace(ITEM_PLACEHOLDER, item) for item in items]
+    return items
+
+
+def read_prompt_file(uploaded_file):
+    """Return the text of an uploaded prompt file, one prompt per line.
+
+    CSV files contribute their "prompt" column, or their first column.
+    """
+    text = uploaded_file.getvalue().decode("utf-8-sig")
+    if not uploaded_file.name.lower().endswith(".csv"):
+        return text
+    rows = list(csv.reader(io.StringIO(text)))
+    if not rows:
+        return ""
+    header = [name.strip().lower() for name in rows[0]]
+    if "prompt" in header:
+        column = header.index("prompt")
+        rows = rows[1:]
+    else:
+        column = 0
+    return "\n".join(
+        row[column].replace("\n", " ") for row in rows if len(row) > column
+    )
+
+
+def agent_answer(messages):
+    """
+    Return the answer of an agent turn: the text of its last AI message,
+    followed by the plots its tools saved during the turn.
+    """
+    from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+    answer, plots = "", []
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            break
+        if isinstance(message, AIMessage) and not answer:
+            answer = message.content
+        elif isinstance(message, ToolMessage) and message.status != "error":
+            plots = _PLOT_TAG.findall(message.content) + plots
+    missing = [tag for tag in plots if tag not in answer]
+    return "\n".join([answer, *missing]) if missing else answer
+
+
+def _run_item(index, prompt, run_prompt, retries, backoff, cancel_token):
+    result = {"index": index, "prompt": prompt, "attempts": 0, "response": ""}
+    start = time.perf_counter()
+    while not token_cancelled(cancel_token):
+        result["attempts"] += 1
+        try:
+            with trace("batch_item") as span:
+                span["attempt"] = result["attempts"]
+                result["response"] = run_prompt(index, result["attempts"])
+            result["status"] = "ok"
+            break
+        except Exception as e:
+            logger.warning("Batch prompt %d failed: %r", index, e)
+            result["error"] = repr(e)
+            if result["attempts"] > retries:
+                result["status"] = "error"
+                break
+            if wait_cancelled(cancel_token, backoff * 2 ** (result["attempts"] - 1)):
+                break
+    result.setdefault("status", "cancelled")
+    result["seconds"] = time.perf_counter() - start
+    get_metrics_registry().inc("batch_items_total", status=result["status"])
+    return result
+
+
+def run_batch(
+    prompts,
+    run_prompt,
+    concurrency=BATCH_CONCURRENCY,
+    retries=BATCH_MAX_RETRIES,
+    backoff=BATCH_RETRY_BACKOFF_SECONDS,
+    cancel_token=None,
+):
+    """
+    Run prompts in parallel and yield their results as they finish.
+
+    Prompts that have not started when the generator is closed, or when
+    ``cancel_token`` is cancelled, are not run.
+
+    Args:
+        prompts (list): Prompt texts
+        run_prompt (callable): Called with the index of a prompt and the
+            attempt number (from 1); returns the response text and raises on
+            failure. It runs on a worker thread, so it must not use Streamlit.
+        concurrency (int): Prompts run at the same time
+        retries (int): Retries of a failed prompt
+        backoff (float): Seconds before the first retry, doubled for each
+            further one
+        cancel_token (str, optional): Run token, see utils.cancellation.
+            Closing the generator early cancels it, and it is finished once
+            every started prompt has ended, so running prompts see the
+            cancellation and stop instead of retrying.
+
+    Yields:
+        dict: Result with the RESULT_FIELDS keys, plus "error" for prompts
+        that failed at least once. "status" is "ok", "error" or "cancelled".
+    """
+    executor = ThreadPoolExecutor(
+        max_workers=max(1, min(concurrency, BATCH_MAX_CONCURRENCY)),
+        thread_name_prefix="batch",
+    )
+    completed = False
+    try:
+        futures = [
+            executor.submit(
+                _run_item, index, prompt, run_prompt, retries, backoff, cancel_token
+            )
+            for index, prompt in enumerate(prompts)
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+        completed = True
+    finally:
+        if not completed:
+            cancel_run(cancel_token)
+        # Prompts not started are dropped; the token stays registered until
+        # the running ones have seen the cancellation and ended
+        executor.shutdown(wait=False, cancel_futures=True)
+        if cancel_token is not None:
+            threading.Thread(
+                target=_finish_when_done,
+                args=(executor, cancel_token),
+                name="batch-finish",
+                daemon=True,
+            ).start()
+
+
+def _finish_when_done(executor, cancel_token):
+    executor.shutdown(wait=True)
+    finish_run(cancel_token)
+
+
+class ResultWriter:
+    """Append batch results to a CSV file as they finish"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerow(RESULT_FIELDS)
+
+    def write(self, result):
+        with open(self.path, "a", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerow(
+                [
+                    result["index"] + 1,
+                    result["prompt"],
+                    result["status"],
+                    result["attempts"],
+                    f"{result['seconds']:.2f}",
+                    result["response"] or result.get("error", ""),
+                ]
+            )
@@ -0,0 +1,67 @@
+"""Cooperative cancellation of model and agent runs.
+
+A run is identified by a token passed in the "cancel_token" entry of its
+config, so the config stays serializable for checkpoints and agent workers.
+Graph nodes check ``is_cancelled(config)`` between nodes and while tokens
+stream, and stop early once the token is cancelled.
+"""
+
+import threading
+import time
+import uuid
+
+_events = {}
+_lock = threading.Lock()
+
+
+def start_run(token=None):
+    """Register a run and return its token"""
+    token = token or uuid.uuid4().hex
+    with _lock:
+        # A cancellation that arrived before the run started still applies
+        _events.setdefault(token, threading.Event())
+    return token
+
+
+def cancel_run(token):
+    """Ask a run to stop; unknown tokens are cancelled once they start"""
+    if not token:
+        return
+    with _lock:
+        event = _events.setdefault(token, threading.Event())
+    event.set()
+
+
+def finish_run(token):
+    """Forget a finished run"""
+    with _lock:
+        _events.pop(token, None)
+
+
+def cancel_token(config):
+    """Return the cancel token of a run config, or None"""
+    return (config or {}).get("configurable", {}).get("cancel_token")
+
+
+def is_cancelled(config):
+    """Whether the run of ``config`` has been cancelled"""
+    return token_cancelled(cancel_token(config))
+
+
+def token_cancelled(token):
+    """Whether the run of ``token`` has been cancelled"""
+    if token is None:
+        return False
+    with _lock:
+        event = _events.get(token)
+    return event is not None and event.is_set()
+
+
+def wait_cancelled(token, timeout):
+    """Wait up to ``timeout`` seconds; return whether the run was cancelled"""
+    with _lock:
+        event = _events.get(token)
+    if event is None:
+        time.sleep(timeout)
+        return False
+    return event.wait(timeout)
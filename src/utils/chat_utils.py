@@ -1,45 +1,245 @@
-from langchain.schema import HumanMessage, AIMessage, SystemMessage
+import json
+import os
+from functools import lru_cache, partial
+
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+import httpx
 import streamlit as st
-from langchain_openai import ChatOpenAI
 
+from utils.model_router import LLM_ENDPOINTS, RouterTransport, parse_endpoints
+from utils.prompt_template import (
+    PROMPT_PREFIX_DIAGNOSTICS,
+    get_prompt_params,
+    observe_request,
+)
+from utils.history import (
+    compact_history,
+    count_tokens,
+    get_history_budget,
+    get_max_tokens,
+    summarize_with_llm,
+)
+
+# langchain_openai (through utils.response_cache) and the agent stack are
+# imported on first use, so pages that do not chat start without them
+
+# With LLM_ENDPOINTS set, the first endpoint stands for all of them
+DEFAULT_MODEL_HOST = next(
+    iter(parse_endpoints(LLM_ENDPOINTS)), "http://localhost:11434/v1"
+)
+DEFAULT_MODEL = "llama3.1"
+
+
+@lru_cache(maxsize=None)
+def get_model_router():
+    """Return the router over the LLM_ENDPOINTS model servers, or None"""
+    endpoints = parse_endpoints(LLM_ENDPOINTS)
+    if not endpoints:
+        return None
+    return RouterTransport(endpoints, transport=_create_transport())
+
+
+def _create_transport():
+    return httpx.HTTPTransport(
+        limits=httpx.Limits(
+            max_connections=64, max_keepalive_connections=32, keepalive_expiry=120
+        )
+    )
+
+
+@lru_cache(maxsize=None)
+def get_http_client():
+    """Return the keep-alive HTTP connection pool shared by all chat clients.
+
+    When LLM_ENDPOINTS lists several model servers, requests to any of them
+    are load balanced over all of them (see utils.model_router).
+    """
+    return httpx.Client(
+        transport=get_model_router() or _create_transport(),
+        timeout=httpx.Timeout(600.0, connect=5.0),
+        # Measures the prompt prefix reused between requests of a session
+        event_hooks={"request": [observe_request] if PROMPT_PREFIX_DIAGNOSTICS else []},
+    )
+
+
+@lru_cache(maxsize=None)
+def get_base_llm(model_host=DEFAULT_MODEL_HOST, model=DEFAULT_MODEL):
+    """Return the process-wide chat model for a model server and model name"""
+    from utils.llm_metrics import get_metrics_callback
+    from utils.response_cache import CachingChatOpenAI
+
+    return CachingChatOpenAI(
+        base_url=model_host,
+        api_key="dummy",
+        # model="deepseek-r1:32b",
+        model=model,
+        streaming=True,
+        # Report token usage in streamed responses, for the metrics callback
+        stream_usage=True,
+        http_client=get_http_client(),
+        callbacks=[get_metrics_callback()],
+    )
+
+
+@lru_cache(maxsize=None)
+def get_agent_graph(model_host=DEFAULT_MODEL_HOST, model=DEFAULT_MODEL):
+    """Return the compiled agent graph, built once per model server and model"""
+    from agents.data_research import get_graph
+
+    return get_graph(get_base_llm(model_host, model))
+
+
+@lru_cache(maxsize=None)
+def get_batch_agent_graph(model_host=DEFAULT_MODEL_HOST, model=DEFAULT_MODEL):
+    """Return an agent graph that checkpoints in memory, for one-off runs
+    (batch prompts) that must not push chat threads out of the shared store"""
+    from langgraph.checkpoint.memory import InMemorySaver
 
-def get_agent(llm, agent):
     from agents.data_research import get_graph
 
-    graph = get_graph(llm)
-    return graph
+    return get_graph(get_base_llm(model_host, model), checkpointer=InMemorySaver())
+
+
+def get_sampling_kwargs(settings):
+    """Convert sidebar settings to chat completion request parameters"""
+    from utils.response_cache import CACHE_AUTO, CACHE_FORCE, CACHE_OFF
+
+    if not settings.get("response_cache"):
+        response_cache = CACHE_OFF
+    elif settings.get("force_cache"):
+        response_cache = CACHE_FORCE
+    else:
+        response_cache = CACHE_AUTO
+
+    return {
+        "temperature": settings["temperature"],
+        "max_tokens": get_max_tokens(settings),
+        "top_p": settings["top_p"] + 1e-3,
+        "frequency_penalty": settings["repeat_penalty"],
+        "presence_penalty": settings["presence_penalty"],
+        "response_cache": response_cache,
+        # Pinned date and tool placement for a stable prompt prefix
+        **get_prompt_params(settings.get("prompt_date")),
+    }
 
 
-def get_query_messages(messages):
-    """Convert chat messages to LangChain message format"""
+@lru_cache(maxsize=64)
+def _get_chat_client(model_host, model, sampling):
+    return get_base_llm(model_host, model).bind(**json.loads(sampling))
+
+
+def get_query_messages(messages, settings=None, context=None):
+    """Convert chat messages to LangChain message format.
+
+    When settings are given, the history is kept within the token budget
+    derived from them; older turns are replaced by a rolling summary kept in
+    session state. Retrieved ``context`` (see agents.rag) is added to the
+    latest user message.
+    """
     query_messages = []
     if "system_message" in st.session_state:
-        query_messages.append(SystemMessage(content=st.session_state.system_message))
+        # A fixed id lets agent checkpoints replace the system message in place
+        # Normalized, so an unchanged system message is byte-identical on
+        # every turn and the server can reuse the cached prompt prefix
+        query_messages.append(
+            SystemMessage(
+                content=st.session_state.system_message.strip().replace("\r\n", "\n"),
+                id="system",
+            )
+        )
+
+    if settings is not None:
+        budget = get_history_budget(settings)
+        if query_messages:
+            budget -= count_tokens(query_messages[0].content)
+        if context:
+            budget -= count_tokens(context)
+        if "history_summary" not in st.session_state:
+            st.session_state.history_summary = {}
+        summary, messages = compact_history(
+            messages,
+            budget,
+            st.session_state.history_summary,
+            summarize=partial(summarize_with_llm, get_summary_llm()),
+        )
+        if summary:
+            query_messages.append(
+                SystemMessage(
+                    content=f"Summary of the earlier conversation:\n{summary}",
+                    id="history_summary",
+                )
+            )
 
     for message in messages:
         if message["role"] == "user":
             query_messages.append(HumanMessage(content=message["content"]))
         elif message["role"] == "assistant":
             query_messages.append(AIMessage(content=message["content"]))
+
+    if context and isinstance(query_messages[-1], HumanMessage):
+        # After the history, so earlier turns stay a reusable prompt prefix
+        query_messages[-1] = HumanMessage(
+            content=(
+                "Answer using the sources below and cite them by number. If "
+                "they do not contain the answer, say so.\n\n"
+                f"{context}\n\nQuestion: {query_messages[-1].content}"
+            )
+        )
     return query_messages
 
 
-def create_chat_client(settings, model_host="http://localhost:11434/v1", agent=None):
-    """Create and configure the chat client"""
-    llm = ChatOpenAI(
-        base_url=model_host,
-        api_key="dummy",
-        # model="deepseek-r1:32b",
-        model="llama3.1",
-        temperature=settings["temperature"],
-        max_tokens=settings["max_tokens"],
-        top_p=settings["top_p"] + 1e-3,
-        frequency_penalty=settings["repeat_penalty"],
-        presence_penalty=settings["presence_penalty"],
-        # streaming=True,
-    )
+def get_summary_llm(model_host=DEFAULT_MODEL_HOST, model=DEFAULT_MODEL):
+    """Return the client used to write rolling history summaries"""
+    return get_base_llm(model_host, model).bind(temperature=0.0, max_tokens=512)
 
+
+def create_chat_client(
+    settings, model_host=DEFAULT_MODEL_HOST, agent=None, model=DEFAULT_MODEL
+):
+    """Return a chat client (or agent graph) configured with the given settings.
+
+    Clients and compiled graphs are shared across messages and sessions. The
+    agent graph reads the sampling settings from the "llm_kwargs" entry of
+    the run config (see get_agent_config), so changing them never rebuilds
+    the graph or opens new connections. When AGENT_WORKER_URL is set, agent
+    runs go to the agent worker service (see agents.worker) instead of
+    running in this process.
+    """
     if agent == "Data Agent":
-        return get_agent(llm, agent)
+        if os.environ.get("AGENT_WORKER_URL"):
+            from agents.remote import get_remote_agent_graph
+
+            return get_remote_agent_graph(model_host, model)
+        return get_agent_graph(model_host, model)
+
+    sampling = json.dumps(get_sampling_kwargs(settings), sort_keys=True)
+    return _get_chat_client(model_host, model, sampling)
+
+
+def get_agent_input(graph, config, messages):
+    """Build the agent graph input for a new turn.
+
+    The checkpointer already holds the thread's history, so only the system
+    message and the newest message are sent. The full history is sent when
+    the thread has no checkpoint yet, e.g. after it was evicted.
+    """
+    state = graph.get_state(config)
+    if state.values.get("messages"):
+        messages = messages[-1:]
+    return {"messages": get_query_messages(messages)}
+
 
-    return llm
+def get_agent_config(settings, thread_id="1", cancel_token=None):
+    """Build the run config for an agent graph"""
+    config = {
+        "configurable": {
+            "user_id": "3",
+            "thread_id": thread_id,
+            "llm_kwargs": get_sampling_kwargs(settings),
+            "history_budget": get_history_budget(settings),
+        }
+    }
+    if cancel_token:
+        # Checked by the graph nodes, see utils.cancellation
+        config["configurable"]["cancel_token"] = cancel_token
+    return config
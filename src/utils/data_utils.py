@@ -0,0 +1,269 @@
+import hashlib
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional, CSV exports work without it
+    pa = None
+
+# Upper bound (in bytes) for parsed panel data kept in memory by this process
+PANEL_CACHE_MAX_BYTES = int(os.environ.get("PANEL_CACHE_MAX_BYTES", 512 * 1024**2))
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+# Rows converted and written at a time by write_frame
+EXPORT_CHUNK_ROWS = int(os.environ.get("EXPORT_CHUNK_ROWS", 100_000))
+
+# (realpath, size, mtime_ns) -> content hash, so unchanged files are hashed once
+_file_hash_memo = {}
+_file_hash_lock = threading.Lock()
+
+
+def file_hash(csv_path):
+    """Return the SHA-1 content hash of a file, memoized on its size and mtime"""
+    stat = os.stat(csv_path)
+    memo_key = (os.path.realpath(csv_path), stat.st_size, stat.st_mtime_ns)
+    with _file_hash_lock:
+        if memo_key in _file_hash_memo:
+            return _file_hash_memo[memo_key]
+
+    digest = hashlib.sha1()
+    with open(csv_path, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(block)
+
+    with _file_hash_lock:
+        _file_hash_memo[memo_key] = digest.hexdigest()
+    return _file_hash_memo[memo_key]
+
+
+class _PanelEntry:
+    """Parsed columns of a single CSV file, sorted by date"""
+
+    def __init__(self, header, index, order):
+        self.header = header
+        self.index = index
+        # Permutation that sorts rows by date, or None if already sorted
+        self.order = order
+        self.columns = {}
+        self.nbytes = index.nbytes
+
+    def add_column(self, name, values):
+        values = np.asarray(values)
+        if self.order is not None:
+            values = values[self.order]
+        self.columns[name] = values
+        self.nbytes += values.nbytes
+
+
+class PanelCache:
+    """Process-wide cache of parsed CSV columns keyed by file content hash.
+
+    Columns are parsed at most once per file: a request only reads the columns
+    that are not cached yet, and date filtering is a slice of the cached arrays.
+    Whole files are evicted in least-recently-used order once the cache grows
+    beyond ``max_bytes``.
+    """
+
+    def __init__(self, max_bytes=PANEL_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # One lock per file hash: files are parsed outside the cache-wide lock,
+        # so a slow parse only holds up requests for the same file. A lock
+        # lives only while a request holds it, so the dict does not grow
+        # with every file ever loaded
+        self._file_locks = weakref.WeakValueDictionary()
+
+    @property
+    def nbytes(self):
+        return sum(entry.nbytes for entry in self._entries.values())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def tickers(self, csv_path):
+        """Return the ticker columns (everything except "date") of a CSV file"""
+        key = file_hash(csv_path)
+        with self._file_lock(key):
+            return list(self._get_entry(csv_path, key, []).header)
+
+    def load(self, csv_path, tickers, start_date=None, end_date=None):
+        """Return a date-indexed DataFrame with one column per ticker"""
+        tickers = list(dict.fromkeys(tickers))
+        key = file_hash(csv_path)
+
+        with self._file_lock(key):
+            entry = self._get_entry(csv_path, key, tickers)
+
+            # Date filtering is a positional slice of the sorted index
+            rows = entry.index.slice_indexer(start_date, end_date)
+            return pd.DataFrame(
+                {ticker: entry.columns[ticker][rows] for ticker in tickers},
+                index=entry.index[rows],
+            )
+
+    def _file_lock(self, key):
+        with self._lock:
+            return self._file_locks.setdefault(key, threading.Lock())
+
+    def _get_entry(self, csv_path, key, tickers):
+        # Called with the file's lock held; returns the entry with ``tickers``
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is None:
+            header = pd.read_csv(csv_path, nrows=0).columns
+            if "date" not in header:
+                raise KeyError(f"Column 'date' not found in {csv_path}")
+            header = [c for c in header if c != "date"]
+            _check_columns(csv_path, header, tickers)
+            missing = tickers
+            # The dates and the requested columns in a single pass
+            parsed = pd.read_csv(csv_path, usecols=["date", *missing])
+            index = pd.DatetimeIndex(pd.to_datetime(parsed["date"]), name="date")
+            order = None
+            if not index.is_monotonic_increasing:
+                order = np.argsort(index.to_numpy(), kind="stable")
+                index = index[order]
+            entry = _PanelEntry(header, index, order)
+        else:
+            # Parse only the columns that have not been read from this file yet
+            _check_columns(csv_path, entry.header, tickers)
+            missing = [t for t in tickers if t not in entry.columns]
+            if not missing:
+                return entry
+            parsed = pd.read_csv(csv_path, usecols=missing)
+
+        for ticker in missing:
+            entry.add_column(ticker, parsed[ticker].to_numpy())
+        with self._lock:
+            # Inserted again in case it was evicted while its file was parsed
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._evict(keep=key)
+        return entry
+
+    def _evict(self, keep):
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            oldest = next(iter(self._entries))
+            if oldest == keep:
+                self._entries.move_to_end(oldest)
+                continue
+            del self._entries[oldest]
+
+
+def _check_columns(csv_path, header, tickers):
+    unknown = [t for t in tickers if t not in header]
+    if unknown:
+        raise KeyError(f"Columns not found in {csv_path}: {unknown}")
+
+
+# Module-level instance so the cache survives Streamlit reruns and is shared
+# between sessions served by the same process
+_panel_cache = PanelCache()
+
+
+def get_panel_cache():
+    """Return the process-wide panel cache"""
+    return _panel_cache
+
+
+def load_panel(csv_path, tickers, start_date=None, end_date=None):
+    """
+    Load several ticker columns of a CSV file into a single DataFrame.
+
+    The file is parsed once per content hash; later calls with other tickers
+    or dates reuse the cached columns. Files of at least STORE_MIN_BYTES, or
+    already ingested ones, are read from the partitioned columnar store
+    instead, which only decodes the partitions and columns requested.
+
+    Args:
+        csv_path (str): Path to the CSV file, must contain a "date" column
+        tickers (list[str]): Names of the columns to select
+        start_date (str): Start date for filtering in YYYY-MM-DD format
+        end_date (str): End date for filtering in YYYY-MM-DD format
+
+    Returns:
+        pandas.DataFrame: DataFrame indexed by date with one column per ticker
+    """
+    from utils.partitioned_store import ingest_csv, query_store, use_store
+
+    if use_store(csv_path):
+        return query_store(ingest_csv(csv_path), tickers, start_date, end_date)
+    return _panel_cache.load(csv_path, tickers, start_date, end_date)
+
+
+def get_csv_tickers(csv_path):
+    """Return the ticker columns available in a CSV file"""
+    from utils.partitioned_store import use_store
+
+    if use_store(csv_path):
+        # Only the header, parsing the dates of a large file is the slow part
+        return [c for c in pd.read_csv(csv_path, nrows=0).columns if c != "date"]
+    return _panel_cache.tickers(csv_path)
+
+
+# Export formats: (file extension, MIME type, needs pyarrow)
+EXPORT_FORMATS = {
+    "Parquet": ("parquet", "application/vnd.apache.parquet", True),
+    "Arrow IPC": ("arrow", "application/vnd.apache.arrow.file", True),
+    "CSV": ("csv", "text/csv", False),
+}
+
+
+def available_export_formats():
+    """Return the export formats supported by the installed packages"""
+    return [
+        name
+        for name, (_, _, needs_arrow) in EXPORT_FORMATS.items()
+        if pa is not None or not needs_arrow
+    ]
+
+
+def write_frame(df, path, fmt, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Write a DataFrame to a file in chunks of rows.
+
+    Only one chunk is converted at a time, so exporting never builds the whole
+    file in memory.
+
+    Args:
+        df (pandas.DataFrame): Data to export, the index is written as a column
+        path (str): Destination file
+        fmt (str): One of EXPORT_FORMATS
+        chunk_rows (int): Rows converted and written at a time
+
+    Returns:
+        int: Size of the written file in bytes
+    """
+    if fmt == "CSV":
+        df.to_csv(path, chunksize=chunk_rows, date_format="%Y-%m-%d")
+        return os.path.getsize(path)
+
+    if pa is None:
+        raise ImportError(f"pyarrow is required to export {fmt}")
+
+    # Inferred from the whole frame: a chunk alone can give another type,
+    # e.g. null for an object column whose first rows are all None
+    schema = pa.Schema.from_pandas(df)
+    if fmt == "Parquet":
+        writer = pq.ParquetWriter(path, schema, compression="zstd")
+    elif fmt == "Arrow IPC":
+        writer = pa.ipc.new_file(path, schema)
+    else:
+        raise ValueError(f"Unknown export format: {fmt}")
+    with writer:
+        for start in range(0, max(len(df), 1), chunk_rows):
+            chunk = df.iloc[start : start + chunk_rows]
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema))
+    return os.path.getsize(path)
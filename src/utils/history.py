@@ -0,0 +1,237 @@
+import hashlib
+import json
+import math
+import os
+import re
+from collections import OrderedDict
+from functools import lru_cache
+
+TOKENIZER_CONFIG_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "model",
+    "tokenizer_config.json",
+)
+
+# Approximation of the Llama 3 pre-tokenizer split pattern using stdlib ``re``
+# (``\p{L}`` becomes ``[^\W\d_]`` and ``\p{N}`` becomes ``\d``)
+_PRETOKENIZE_PATTERN = re.compile(
+    r"(?i:'s|'t|'re|'ve|'m|'ll|'d)"
+    r"|(?:[^\r\n\w]|_)?[^\W\d_]+"
+    r"|\d{1,3}"
+    r"| ?(?:[^\s\w]|_)+[\r\n]*"
+    r"|\s*[\r\n]+"
+    r"|\s+(?!\S)"
+    r"|\s+"
+)
+
+# Tokens reserved for the template preamble (date lines, tool headers)
+PROMPT_OVERHEAD_TOKENS = 32
+# After compaction the kept history uses at most this share of the budget, so
+# summaries are rebuilt in large steps rather than on every turn
+COMPACTION_TARGET = 0.5
+
+SUMMARY_PROMPT = (
+    "Summarize the conversation below for your own future reference. Keep "
+    "names, numbers, dates, decisions and open questions. Reply with the "
+    "summary only."
+)
+
+
+@lru_cache(maxsize=None)
+def load_tokenizer_config(path=TOKENIZER_CONFIG_PATH):
+    """Load the bundled Llama 3.1 tokenizer config"""
+    with open(path) as f:
+        return json.load(f)
+
+
+@lru_cache(maxsize=None)
+def _special_tokens_pattern():
+    config = load_tokenizer_config()
+    special_tokens = [
+        token["content"]
+        for token in config["added_tokens_decoder"].values()
+        if token.get("special")
+    ]
+    return re.compile("|".join(re.escape(token) for token in special_tokens))
+
+
+def _count_piece_tokens(piece):
+    # Common ASCII words are single tokens in the 128k Llama 3 vocabulary;
+    # other scripts take roughly one token per character
+    if piece.isascii():
+        return math.ceil(len(piece) / 6)
+    return math.ceil(len(piece.encode("utf-8")) / 3)
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text):
+    """Estimate the number of Llama 3.1 tokens in a string.
+
+    Special tokens from the tokenizer config count as one token each; the
+    remaining text is split with the Llama 3 pre-tokenizer pattern.
+    """
+    special_pattern = _special_tokens_pattern()
+    num_tokens = len(special_pattern.findall(text))
+    for segment in special_pattern.split(text):
+        for piece in _PRETOKENIZE_PATTERN.findall(segment):
+            num_tokens += _count_piece_tokens(piece)
+    return num_tokens
+
+
+@lru_cache(maxsize=None)
+def message_overhead_tokens(role):
+    """Return the template tokens that wrap a single message of a role"""
+    return count_tokens(f"<|start_header_id|>{role}<|end_header_id|>\n\n<|eot_id|>")
+
+
+def count_message_tokens(message):
+    """Return the token count of a chat message dict, cached on the message"""
+    if "tokens" not in message:
+        message["tokens"] = count_tokens(message["content"]) + (
+            message_overhead_tokens(message["role"])
+        )
+    return message["tokens"]
+
+
+def get_context_window(settings):
+    """Return the context window from settings or the tokenizer config"""
+    if settings.get("context_window"):
+        return settings["context_window"]
+    return load_tokenizer_config()["model_max_length"]
+
+
+def get_history_budget(settings):
+    """Return the number of prompt tokens available for the conversation"""
+    context_window = get_context_window(settings)
+    budget = context_window - settings["max_tokens"] - PROMPT_OVERHEAD_TOKENS
+    # Never leave less than a quarter of the context for the prompt
+    return max(budget, context_window // 4)
+
+
+def get_max_tokens(settings):
+    """Return the completion limit to request, clamped to the context left
+    after the prompt budget, so prompt and completion fit the window"""
+    context_window = get_context_window(settings)
+    remaining = context_window - get_history_budget(settings) - PROMPT_OVERHEAD_TOKENS
+    return min(settings["max_tokens"], remaining)
+
+
+class SummaryCache:
+    """LRU cache of rolling summaries keyed by their inputs"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def key(previous_summary, messages):
+        digest = hashlib.sha1(previous_summary.encode("utf-8"))
+        for message in messages:
+            digest.update(b"\0" + message["role"].encode("utf-8"))
+            digest.update(b"\0" + message["content"].encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+        return self._entries.get(key)
+
+    def put(self, key, summary):
+        self._entries[key] = summary
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+_summary_cache = SummaryCache()
+
+
+def summarize_with_llm(llm, previous_summary, messages):
+    """Fold messages into a rolling summary using a chat model"""
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    if previous_summary:
+        transcript = f"Earlier summary: {previous_summary}\n\n{transcript}"
+    response = llm.invoke(
+        [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": transcript},
+        ]
+    )
+    return response.content.strip()
+
+
+def summarize_extractive(previous_summary, messages, max_chars=200, max_total=4000):
+    """Fallback summary made of the first characters of each message"""
+    lines = [previous_summary] if previous_summary else []
+    for message in messages:
+        content = " ".join(message["content"].split())
+        if len(content) > max_chars:
+            content = content[:max_chars] + "..."
+        lines.append(f"{message['role']}: {content}")
+    # Keep the most recent part when the summary grows too long
+    return "\n".join(lines)[-max_total:]
+
+
+def count_langchain_tokens(messages):
+    """Estimate the prompt tokens of a list of LangChain messages"""
+    num_tokens = 0
+    for message in messages:
+        content = message.content
+        if not isinstance(content, str):
+            content = json.dumps(content)
+        num_tokens += count_tokens(content) + message_overhead_tokens(message.type)
+        if getattr(message, "tool_calls", None):
+            num_tokens += count_tokens(json.dumps(message.tool_calls))
+    return num_tokens
+
+
+def compact_history(messages, budget, state, summarize=None):
+    """
+    Fit a conversation into a token budget using a rolling summary.
+
+    ``state`` holds the summary between turns (``{"upto": int, "text": str}``,
+    typically kept in session state) and is updated in place. Messages before
+    ``state["upto"]`` are represented by the summary. When the rest no longer
+    fits, the oldest messages are folded into the summary until the kept
+    history uses ``COMPACTION_TARGET`` of the budget. The newest message is
+    always kept.
+
+    Args:
+        messages (list[dict]): Chat messages with 'role' and 'content' keys
+        budget (int): Maximum number of tokens for summary and messages
+        state (dict): Rolling summary state, updated in place
+        summarize (callable): ``summarize(previous_summary, messages) -> str``
+
+    Returns:
+        tuple[str, list[dict]]: The summary text and the messages to send
+    """
+    upto = min(state.get("upto", 0), max(len(messages) - 1, 0))
+    summary = state.get("text", "")
+
+    summary_tokens = count_tokens(summary) if summary else 0
+    kept_tokens = sum(count_message_tokens(m) for m in messages[upto:])
+    if summary_tokens + kept_tokens <= budget:
+        return summary, messages[upto:]
+
+    # Fold the oldest messages into the summary until the rest fits the target
+    target = int(budget * COMPACTION_TARGET)
+    new_upto = upto
+    while new_upto < len(messages) - 1 and kept_tokens > target:
+        kept_tokens -= count_message_tokens(messages[new_upto])
+        new_upto += 1
+
+    evicted = messages[upto:new_upto]
+    key = SummaryCache.key(summary, evicted)
+    new_summary = _summary_cache.get(key)
+    if new_summary is None and summarize is not None:
+        try:
+            new_summary = summarize(summary, evicted)
+            _summary_cache.put(key, new_summary)
+        except Exception:
+            new_summary = None
+    if not new_summary:
+        new_summary = summarize_extractive(summary, evicted)
+
+    state["upto"] = new_upto
+    state["text"] = new_summary
+    return new_summary, messages[new_upto:]
@@ -0,0 +1,100 @@
+import threading
+import time
+from functools import lru_cache
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from utils.metrics import current_turn_id, get_metrics_registry
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """LangChain callback recording latency, tokens and cache hits of LLM calls.
+
+    Splits each call into prefill (time to the first streamed token) and
+    decode (first token to the end), and reads token counts from the
+    response usage metadata.
+    """
+
+    def __init__(self):
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(
+        self, serialized, messages, *, run_id, metadata=None, **kwargs
+    ):
+        metadata = metadata or {}
+        with self._lock:
+            self._runs[run_id] = {
+                "start_time": time.time(),
+                "start": time.perf_counter(),
+                "first_token": None,
+                "node": metadata.get("langgraph_node"),
+                "model": metadata.get("ls_model_name"),
+                "turn_id": current_turn_id(),
+            }
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is not None and run["first_token"] is None:
+                run["first_token"] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._finish(run_id, response, "ok")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, None, "error")
+
+    def _finish(self, run_id, response, status):
+        end = time.perf_counter()
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+
+        usage, cache_hit = {}, False
+        if response is not None and response.generations:
+            message = getattr(response.generations[0][0], "message", None)
+            if message is not None:
+                usage = getattr(message, "usage_metadata", None) or {}
+                cache_hit = bool(message.response_metadata.get("cache_hit"))
+
+        registry = get_metrics_registry()
+        labels = {"node": run["node"] or "chat", "model": run["model"]}
+        duration = end - run["start"]
+        event = {
+            "name": "llm",
+            "turn_id": run["turn_id"],
+            "start": run["start_time"],
+            "duration": duration,
+            "status": status,
+            "labels": labels,
+            "cache_hit": cache_hit,
+        }
+        if run["first_token"] is not None:
+            event["prefill_seconds"] = run["first_token"] - run["start"]
+            event["decode_seconds"] = end - run["first_token"]
+            registry.observe("llm_prefill_seconds", event["prefill_seconds"], **labels)
+            registry.observe("llm_decode_seconds", event["decode_seconds"], **labels)
+        if usage:
+            event["prompt_tokens"] = usage.get("input_tokens", 0)
+            event["completion_tokens"] = usage.get("output_tokens", 0)
+            registry.inc("llm_prompt_tokens_total", event["prompt_tokens"], **labels)
+            registry.inc(
+                "llm_completion_tokens_total", event["completion_tokens"], **labels
+            )
+
+        registry.observe("span_seconds", duration, span="llm", status=status, **labels)
+        registry.inc(
+            "llm_requests_total",
+            status=status,
+            cache="hit" if cache_hit else "miss",
+            **labels,
+        )
+        registry.record(event)
+
+
+@lru_cache(maxsize=None)
+def get_metrics_callback():
+    """Return the callback handler shared by all chat models"""
+    return MetricsCallbackHandler()
@@ -0,0 +1,312 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+METRICS_PREFIX = "llama_chatbot"
+# Number of recent spans kept in memory for the sidebar and JSONL export
+METRICS_MAX_EVENTS = int(os.environ.get("METRICS_MAX_EVENTS", 5000))
+# When set, every span is also appended to this JSON lines file
+METRICS_JSONL_PATH = os.environ.get("METRICS_JSONL_PATH")
+# When set, Prometheus metrics are served on http://0.0.0.0:<port>/metrics
+METRICS_PORT = os.environ.get("METRICS_PORT")
+
+# Histogram buckets in seconds, from single renders to long generations
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Turn that spans recorded in the current context belong to
+_current_turn = contextvars.ContextVar("current_turn", default=None)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pairs
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class MetricsRegistry:
+    """Thread-safe store of counters, latency histograms and recent spans.
+
+    Counters and histograms are cumulative for the life of the process and
+    exported in the Prometheus text format. Spans (timed sections of a turn
+    with their attributes) are kept in a bounded buffer for the sidebar and
+    exported as JSON lines.
+    """
+
+    def __init__(self, max_events=METRICS_MAX_EVENTS, jsonl_path=METRICS_JSONL_PATH):
+        self.jsonl_path = jsonl_path
+        self._counters = {}
+        self._histograms = {}
+        self._events = deque(maxlen=max_events)
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        """Add ``value`` to a counter"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Record a value (in seconds) in a latency histogram"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = _Histogram(LATENCY_BUCKETS)
+            self._histograms[key].observe(value)
+
+    def record(self, event):
+        """Store a finished span and append it to the JSONL file if configured"""
+        with self._lock:
+            self._events.append(event)
+            if self.jsonl_path:
+                try:
+                    with open(self.jsonl_path, "a") as f:
+                        f.write(json.dumps(event, default=str) + "\n")
+                except OSError as e:
+                    logger.warning(
+                        "Could not write metrics to %s: %s", self.jsonl_path, e
+                    )
+
+    def events(self, turn_id=None):
+        """Return recorded spans, optionally only those of one turn"""
+        with self._lock:
+            events = list(self._events)
+        if turn_id is not None:
+            events = [e for e in events if e.get("turn_id") == turn_id]
+        return events
+
+    def counter_totals(self, name):
+        """Return the sum of a counter over all label values"""
+        with self._lock:
+            return sum(v for (n, _), v in self._counters.items() if n == name)
+
+    def counters(self, name):
+        """Return {labels: value} for a counter"""
+        with self._lock:
+            return {labels: v for (n, labels), v in self._counters.items() if n == name}
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._events.clear()
+
+    def to_prometheus(self):
+        """Render counters and histograms in the Prometheus text format"""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                (key, (list(h.counts), h.count, h.sum, h.buckets))
+                for key, h in self._histograms.items()
+            )
+
+        seen = set()
+        for (name, labels), value in counters:
+            metric = f"{METRICS_PREFIX}_{name}"
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_format_labels(labels)} {value:g}")
+
+        for (name, labels), (counts, count, total, buckets) in histograms:
+            metric = f"{METRICS_PREFIX}_{name}"
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            for bound, bucket_count in zip(buckets, counts):
+                bucket_labels = _format_labels(labels, [("le", f"{bound:g}")])
+                lines.append(f"{metric}_bucket{bucket_labels} {bucket_count}")
+            lines.append(
+                f"{metric}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}"
+            )
+            lines.append(f"{metric}_sum{_format_labels(labels)} {total:g}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def to_jsonl(self):
+        """Return the recorded spans as JSON lines"""
+        return "".join(json.dumps(e, default=str) + "\n" for e in self.events())
+
+
+@lru_cache(maxsize=None)
+def get_metrics_registry():
+    """Return the process-wide metrics registry"""
+    registry = MetricsRegistry()
+    if METRICS_PORT:
+        start_metrics_server(registry, int(METRICS_PORT))
+    return registry
+
+
+def start_metrics_server(registry, port, host="0.0.0.0"):
+    """Serve ``registry`` in the Prometheus text format on /metrics"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.to_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    try:
+        server = ThreadingHTTPServer((host, port), Handler)
+    except OSError as e:
+        # Another Streamlit process may already serve the port
+        logger.warning("Metrics server not started on port %s: %s", port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info("Serving Prometheus metrics on http://%s:%s/metrics", host, port)
+    return server
+
+
+def current_turn_id():
+    """Return the id of the turn being traced in this context, if any"""
+    return _current_turn.get()
+
+
+@contextmanager
+def trace(name, **labels):
+    """
+    Time a section of work and record it as a span.
+
+    The span is a dict; attributes set on it inside the block (token counts,
+    cache hits, ...) are recorded with it, and setting ``span["status"]``
+    marks a handled failure. The wall time also goes to the ``span_seconds``
+    histogram labeled with the span name, status and ``labels``.
+
+    Example:
+        >>> with trace("tool", tool="plot_time_series_data") as span:
+        ...     span["rows"] = len(df)
+    """
+    registry = get_metrics_registry()
+    span = {}
+    status = "ok"
+    start_time = time.time()
+    start = time.perf_counter()
+    try:
+        yield span
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        status = span.pop("status", status)
+        registry.observe("span_seconds", duration, span=name, status=status, **labels)
+        registry.record(
+            {
+                "name": name,
+                "turn_id": _current_turn.get(),
+                "start": start_time,
+                "duration": duration,
+                "status": status,
+                "labels": labels,
+                **span,
+            }
+        )
+
+
+@contextmanager
+def trace_turn(session_id=None, **labels):
+    """
+    Trace a whole chat turn; spans recorded inside it share its turn id.
+
+    The session id is recorded on the turn span, not as a label, so
+    per-session views can find their turns without a metric series per
+    session.
+    """
+    token = _current_turn.set(uuid.uuid4().hex)
+    try:
+        with trace("turn", **labels) as span:
+            span["turn_id"] = _current_turn.get()
+            span["session_id"] = session_id
+            yield span
+    finally:
+        _current_turn.reset(token)
+
+
+def summarize_turn(events):
+    """
+    Break a traced turn down into LLM prefill/decode, tools, rendering and
+    the rest.
+
+    Args:
+        events (list[dict]): Spans of a single turn
+
+    Returns:
+        dict: Wall times in seconds and token totals of the turn
+    """
+    turn = next((e for e in events if e["name"] == "turn"), None)
+    llm = [e for e in events if e["name"] == "llm"]
+    tools = [e for e in events if e["name"] == "tool"]
+    streams = [e for e in events if e["name"] == "stream"]
+    prefixes = [e for e in events if e["name"] == "prompt_prefix"]
+    tool_nodes = [
+        e for e in events if e["name"] == "node" and e["labels"].get("node") == "tools"
+    ]
+
+    summary = {
+        "total": turn["duration"] if turn else None,
+        "llm_calls": len(llm),
+        "cache_hits": sum(bool(e.get("cache_hit")) for e in llm),
+        "prefill": sum(e.get("prefill_seconds", 0) for e in llm),
+        "decode": sum(e.get("decode_seconds", 0) for e in llm),
+        "llm": sum(e["duration"] for e in llm),
+        "tool_calls": len(tools),
+        # Tools run concurrently, so the node time is what the turn waits for
+        "tools": sum(e["duration"] for e in tool_nodes),
+        "render": sum(e.get("render_seconds", 0) for e in streams),
+        "prompt_tokens": sum(e.get("prompt_tokens", 0) for e in llm),
+        "completion_tokens": sum(e.get("completion_tokens", 0) for e in llm),
+        # Prompt tokens shared with the session's previous request, which a
+        # server with prefix caching does not prefill again
+        "rendered_prompt_tokens": sum(e["prompt_tokens"] for e in prefixes),
+        "shared_prefix_tokens": sum(e["shared_tokens"] for e in prefixes),
+    }
+    if summary["total"] is not None:
+        summary["other"] = max(
+            summary["total"] - summary["llm"] - summary["tools"] - summary["render"],
+            0.0,
+        )
+    return summary
@@ -0,0 +1,301 @@
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import httpx
+
+from utils.metrics import get_metrics_registry
+
+logger = logging.getLogger(__name__)
+
+# Comma-separated base URLs of OpenAI-compatible model servers serving the
+# same models, e.g. "http://gpu1:11434/v1,http://gpu2:11434/v1". Requests to
+# any of them are spread over all of them; empty disables routing.
+LLM_ENDPOINTS = os.environ.get("LLM_ENDPOINTS", "")
+# Seconds between health probes (GET {endpoint}/models), 0 disables them
+LLM_HEALTH_INTERVAL = float(os.environ.get("LLM_HEALTH_INTERVAL", 10))
+# Keep a session on one endpoint, so the server reuses its KV cache
+LLM_SESSION_AFFINITY = os.environ.get("LLM_SESSION_AFFINITY", "1") != "0"
+# Outstanding requests a session's endpoint may have beyond the least busy
+# endpoint before the session is moved
+LLM_AFFINITY_MAX_SKEW = int(os.environ.get("LLM_AFFINITY_MAX_SKEW", 4))
+
+_session_key = ContextVar("llm_session_key", default=None)
+
+
+@contextmanager
+def model_session(key):
+    """Route the model requests made inside the block for session ``key``"""
+    token = _session_key.set(None if key is None else str(key))
+    try:
+        yield
+    finally:
+        _session_key.reset(token)
+
+
+def current_model_session():
+    """Return the key of the enclosing model_session(), or None"""
+    return _session_key.get()
+
+
+class Endpoint:
+    """A model server and its request statistics"""
+
+    def __init__(self, base_url, window=100):
+        self.base_url = base_url.rstrip("/")
+        self.url = httpx.URL(self.base_url)
+        self.healthy = True
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.last_error = None
+        self.probe_seconds = None
+        # Seconds to response headers and to the end of the body
+        self.header_seconds = deque(maxlen=window)
+        self.total_seconds = deque(maxlen=window)
+
+    def stats(self):
+        def median(values):
+            ordered = sorted(values)
+            return ordered[len(ordered) // 2] if ordered else None
+
+        return {
+            "endpoint": self.base_url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "header_seconds": median(self.header_seconds),
+            "total_seconds": median(self.total_seconds),
+            "probe_seconds": self.probe_seconds,
+            "last_error": self.last_error,
+        }
+
+
+class _TrackedStream(httpx.SyncByteStream):
+    # Keeps a request outstanding until its (streamed) body is closed
+    def __init__(self, stream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            if self._on_close is not None:
+                self._on_close()
+                self._on_close = None
+
+
+class RouterTransport(httpx.BaseTransport):
+    """
+    httpx transport spreading requests over several model servers.
+
+    Requests whose URL starts with the base URL of one of the endpoints are
+    sent to the healthy endpoint with the fewest outstanding requests, or to
+    the session's endpoint inside model_session() unless it is much busier.
+    Connection failures mark the endpoint unhealthy and the request is
+    retried on the next one; a background probe brings endpoints back. Other
+    requests pass through unchanged.
+    """
+
+    def __init__(
+        self,
+        endpoints,
+        transport=None,
+        health_interval=LLM_HEALTH_INTERVAL,
+        session_affinity=LLM_SESSION_AFFINITY,
+        max_skew=LLM_AFFINITY_MAX_SKEW,
+    ):
+        self.endpoints = [Endpoint(url) for url in endpoints]
+        if not self.endpoints:
+            raise ValueError("RouterTransport needs at least one endpoint")
+        self.session_affinity = session_affinity
+        self.max_skew = max_skew
+        self._transport = transport or httpx.HTTPTransport()
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        if health_interval > 0:
+            threading.Thread(
+                target=self._probe_loop,
+                args=(health_interval,),
+                name="llm-health-probe",
+                daemon=True,
+            ).start()
+
+    def _match(self, url):
+        # Path of the request relative to the endpoint base URL it targets
+        for endpoint in self.endpoints:
+            base = endpoint.url
+            prefix = base.raw_path.rstrip(b"/")
+            if (
+                url.scheme == base.scheme
+                and url.host == base.host
+                and url.port == base.port
+                and (url.raw_path == prefix or url.raw_path.startswith(prefix + b"/"))
+            ):
+                return url.raw_path[len(prefix) :]
+        return None
+
+    def _candidates(self):
+        # Healthy endpoints first, by outstanding requests (ties go to the
+        # least used); unhealthy ones are still tried last, in case the probe
+        # has not caught a recovery yet
+        session = _session_key.get() if self.session_affinity else None
+        with self._lock:
+            ordered = sorted(
+                self.endpoints,
+                key=lambda e: (not e.healthy, e.outstanding, e.requests),
+            )
+            healthy = [e for e in ordered if e.healthy]
+            if session is not None and healthy:
+                # Rendezvous hashing keeps sessions in place when endpoints
+                # go down or come back
+                preferred = max(
+                    healthy,
+                    key=lambda e: zlib.crc32(f"{session}|{e.base_url}".encode()),
+                )
+                if preferred.outstanding - healthy[0].outstanding <= self.max_skew:
+                    ordered.remove(preferred)
+                    ordered.insert(0, preferred)
+        return ordered
+
+    def _acquire(self, endpoint):
+        with self._lock:
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+
+    def _release(self, endpoint, start, failed=False):
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            endpoint.outstanding -= 1
+            if not failed:
+                endpoint.total_seconds.append(elapsed)
+        if not failed:
+            get_metrics_registry().observe(
+                "llm_endpoint_seconds", elapsed, endpoint=endpoint.base_url
+            )
+
+    def _mark_failed(self, endpoint, error):
+        with self._lock:
+            endpoint.healthy = False
+            endpoint.failures += 1
+            endpoint.last_error = repr(error)
+        get_metrics_registry().inc(
+            "llm_endpoint_failures_total", endpoint=endpoint.base_url
+        )
+        logger.warning("Model endpoint %s failed: %s", endpoint.base_url, error)
+
+    def handle_request(self, request):
+        path = self._match(request.url)
+        if path is None:
+            return self._transport.handle_request(request)
+
+        error = None
+        for endpoint in self._candidates():
+            raw_path = endpoint.url.raw_path.rstrip(b"/") + path
+            url = request.url.copy_with(
+                scheme=endpoint.url.scheme,
+                host=endpoint.url.host,
+                port=endpoint.url.port,
+                raw_path=raw_path,
+            )
+            headers = request.headers.copy()
+            headers["Host"] = url.netloc.decode("ascii")
+            routed = httpx.Request(
+                request.method,
+                url,
+                headers=headers,
+                stream=request.stream,
+                extensions=request.extensions,
+            )
+
+            self._acquire(endpoint)
+            start = time.perf_counter()
+            try:
+                response = self._transport.handle_request(routed)
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                self._release(endpoint, start, failed=True)
+                self._mark_failed(endpoint, e)
+                error = e
+                continue
+            except BaseException:
+                self._release(endpoint, start, failed=True)
+                raise
+
+            with self._lock:
+                endpoint.header_seconds.append(time.perf_counter() - start)
+            get_metrics_registry().inc(
+                "llm_endpoint_requests_total",
+                endpoint=endpoint.base_url,
+                status=response.status_code,
+            )
+            return httpx.Response(
+                response.status_code,
+                headers=response.headers,
+                stream=_TrackedStream(
+                    response.stream, lambda e=endpoint: self._release(e, start)
+                ),
+                extensions=response.extensions,
+            )
+        raise error
+
+    def probe(self, timeout=2.0):
+        """Check every endpoint with GET {endpoint}/models and update its health"""
+        for endpoint in self.endpoints:
+            start = time.perf_counter()
+            try:
+                response = self._transport.handle_request(
+                    httpx.Request(
+                        "GET",
+                        f"{endpoint.base_url}/models",
+                        extensions={"timeout": httpx.Timeout(timeout).as_dict()},
+                    )
+                )
+                try:
+                    response.read()
+                finally:
+                    response.close()
+                healthy = response.status_code < 500
+                error = None if healthy else f"HTTP {response.status_code}"
+            except httpx.HTTPError as e:
+                healthy, error = False, repr(e)
+
+            with self._lock:
+                if healthy and not endpoint.healthy:
+                    logger.info("Model endpoint %s is back", endpoint.base_url)
+                endpoint.healthy = healthy
+                endpoint.probe_seconds = time.perf_counter() - start
+                if error:
+                    endpoint.last_error = error
+
+    def _probe_loop(self, interval):
+        while True:
+            try:
+                self.probe()
+            except Exception:
+                logger.exception("Model endpoint health probe failed")
+            if self._closed.wait(interval):
+                return
+
+    def stats(self):
+        """Return the statistics of every endpoint"""
+        with self._lock:
+            return [endpoint.stats() for endpoint in self.endpoints]
+
+    def close(self):
+        self._closed.set()
+        self._transport.close()
+
+
+def parse_endpoints(value=LLM_ENDPOINTS):
+    """Split a comma-separated list of endpoint base URLs"""
+    return [url.strip().rstrip("/") for url in value.split(",") if url.strip()]
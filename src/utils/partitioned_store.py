@@ -0,0 +1,302 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from utils.data_utils import file_hash
+from utils.metrics import trace
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional, CSV files are then parsed in memory
+    pa = None
+
+STORE_DIR = os.environ.get("STORE_DIR", "./sn_store")
+# CSV rows parsed at a time during ingest, bounds the memory it needs
+STORE_CHUNK_ROWS = int(os.environ.get("STORE_CHUNK_ROWS", 250_000))
+# CSV files at least this large are queried through the store by load_panel
+STORE_MIN_BYTES = int(os.environ.get("STORE_MIN_BYTES", 256 * 1024**2))
+# Files with fewer rows per month in their first chunk (e.g. daily prices)
+# are partitioned by year instead of by month
+STORE_MIN_MONTH_ROWS = int(os.environ.get("STORE_MIN_MONTH_ROWS", 10_000))
+# Rows per Parquet row group; smaller groups prune date ranges more finely
+STORE_ROW_GROUP_ROWS = int(os.environ.get("STORE_ROW_GROUP_ROWS", 128 * 1024))
+
+_MANIFEST = "manifest.json"
+_COPY_CHUNK_BYTES = 1024 * 1024
+# One ingest per file at a time in this process
+_ingest_locks = {}
+_ingest_locks_lock = threading.Lock()
+
+
+def store_available():
+    """Whether pyarrow is installed, which the columnar store needs"""
+    return pa is not None
+
+
+def store_path(csv_path, root=STORE_DIR):
+    """Directory of the store for a CSV file, keyed by its content hash"""
+    return os.path.join(root, file_hash(csv_path))
+
+
+def use_store(csv_path, root=STORE_DIR):
+    """Whether a CSV file is queried through the store instead of in memory"""
+    if pa is None:
+        return False
+    return os.path.getsize(csv_path) >= STORE_MIN_BYTES or (
+        load_manifest(store_path(csv_path, root)) is not None
+    )
+
+
+def load_manifest(store_dir):
+    """Return the manifest of an ingested store, or None"""
+    try:
+        with open(os.path.join(store_dir, _MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+# Partition granularities and the date format of their keys
+_PARTITION_FORMATS = {"month": "%Y-%m", "year": "%Y"}
+
+
+def _partition_granularity(dates):
+    # Rows per month of the first chunk decide for the whole file
+    months = pc.count_distinct(pc.strftime(dates, format="%Y-%m")).as_py()
+    return "month" if len(dates) / max(months, 1) >= STORE_MIN_MONTH_ROWS else "year"
+
+
+def _write_batch(directory, table, partitions, part, granularity):
+    keys = pc.strftime(table.column("date"), format=_PARTITION_FORMATS[granularity])
+    for key in pc.unique(keys).to_pylist():
+        rows = table.filter(pc.equal(keys, key))
+        partition_dir = os.path.join(directory, f"{granularity}={key}")
+        os.makedirs(partition_dir, exist_ok=True)
+        path = os.path.join(partition_dir, f"part-{part:05d}.parquet")
+        pq.write_table(
+            rows, path, compression="zstd", row_group_size=STORE_ROW_GROUP_ROWS
+        )
+        dates = rows.column("date")
+        entry = partitions.setdefault(
+            key, {"files": [], "rows": 0, "bytes": 0, "min": None, "max": None}
+        )
+        low, high = pc.min(dates).as_py().isoformat(), pc.max(dates).as_py().isoformat()
+        entry["files"].append(os.path.relpath(path, directory))
+        entry["rows"] += rows.num_rows
+        entry["bytes"] += os.path.getsize(path)
+        entry["min"] = low if entry["min"] is None else min(entry["min"], low)
+        entry["max"] = high if entry["max"] is None else max(entry["max"], high)
+
+
+def ingest_csv(csv_path, root=STORE_DIR, chunk_rows=STORE_CHUNK_ROWS, progress=None):
+    """
+    Convert a CSV file into a date-partitioned Parquet store.
+
+    The file is parsed ``chunk_rows`` rows at a time, so memory use does
+    not depend on the file size. Ticker columns are stored as float64 and
+    every chunk is split by month (or by year for sparser data such as daily
+    prices) into its own Parquet file. Files that
+    were ingested before (same content hash) are not read again.
+
+    Args:
+        csv_path (str): CSV file with a "date" column
+        root (str): Directory holding the stores of all files
+        chunk_rows (int): CSV rows parsed at a time
+        progress (callable, optional): Called as ``progress(fraction)``
+
+    Returns:
+        str: Directory of the store
+    """
+    if pa is None:
+        raise RuntimeError("The columnar store requires pyarrow (pip install pyarrow)")
+    store_dir = store_path(csv_path, root)
+    with _ingest_locks_lock:
+        lock = _ingest_locks.setdefault(store_dir, threading.Lock())
+
+    with lock:
+        if load_manifest(store_dir) is not None:
+            return store_dir
+
+        header = pd.read_csv(csv_path, nrows=0).columns
+        if "date" not in header:
+            raise KeyError(f"Column 'date' not found in {csv_path}")
+        tickers = [c for c in header if c != "date"]
+        total_bytes = os.path.getsize(csv_path)
+
+        # Written next to the final directory and renamed when complete, so
+        # an interrupted ingest never looks finished
+        staging = f"{store_dir}.tmp-{uuid.uuid4().hex[:8]}"
+        os.makedirs(staging)
+        start = time.perf_counter()
+        partitions = {}
+        granularity = None
+        rows = 0
+        try:
+            with open(csv_path, "rb") as f:
+                # pyarrow's streaming CSV reader reads ahead without bound, so
+                # chunks are parsed by pandas and only converted by pyarrow
+                chunks = pd.read_csv(
+                    f,
+                    chunksize=chunk_rows,
+                    dtype={ticker: np.float64 for ticker in tickers},
+                )
+                for part, chunk in enumerate(chunks):
+                    chunk["date"] = pd.to_datetime(chunk["date"], format="ISO8601")
+                    table = pa.Table.from_pandas(chunk, preserve_index=False)
+                    if granularity is None:
+                        granularity = _partition_granularity(table.column("date"))
+                    _write_batch(staging, table, partitions, part, granularity)
+                    rows += table.num_rows
+                    if progress is not None:
+                        progress(min(f.tell() / max(total_bytes, 1), 1.0))
+
+            manifest = {
+                "source": os.path.abspath(csv_path),
+                "source_bytes": total_bytes,
+                "columns": tickers,
+                "rows": rows,
+                "granularity": granularity or "month",
+                "partitions": dict(sorted(partitions.items())),
+                "ingest_seconds": time.perf_counter() - start,
+            }
+            with open(os.path.join(staging, _MANIFEST), "w") as f:
+                json.dump(manifest, f)
+            shutil.rmtree(store_dir, ignore_errors=True)
+            os.replace(staging, store_dir)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+    if progress is not None:
+        progress(1.0)
+    return store_dir
+
+
+def _overlaps(low, high, start, end):
+    return (end is None or low < end) and (start is None or high >= start)
+
+
+def query_store(store_dir, tickers, start_date=None, end_date=None):
+    """
+    Read tickers between two dates from a store written by ingest_csv.
+
+    Only the partitions overlapping the date range are opened, only row
+    groups whose date statistics overlap it are read, and only the date and
+    requested ticker columns of those row groups are decoded. The end date
+    is inclusive of the whole day, like pandas' partial string indexing.
+
+    Returns:
+        pandas.DataFrame: DataFrame indexed by date with one column per
+        ticker; ``df.attrs["scan"]`` holds the partitions, row groups and
+        bytes read
+    """
+    manifest = load_manifest(store_dir)
+    if manifest is None:
+        raise FileNotFoundError(f"No columnar store in {store_dir}")
+    tickers = list(dict.fromkeys(tickers))
+    unknown = [t for t in tickers if t not in manifest["columns"]]
+    if unknown:
+        raise KeyError(f"Columns not found in {manifest['source']}: {unknown}")
+
+    start = pd.Timestamp(start_date) if start_date else None
+    end = pd.Timestamp(end_date) + pd.Timedelta(days=1) if end_date else None
+    columns = ["date", *tickers]
+    scan = {
+        "partitions_total": len(manifest["partitions"]),
+        "partitions_read": 0,
+        "row_groups_read": 0,
+        "bytes_scanned": 0,
+        "bytes_total": sum(p["bytes"] for p in manifest["partitions"].values()),
+    }
+
+    with trace("store_query") as span:
+        tables = []
+        for partition in manifest["partitions"].values():
+            low, high = pd.Timestamp(partition["min"]), pd.Timestamp(partition["max"])
+            if not _overlaps(low, high, start, end):
+                continue
+            scan["partitions_read"] += 1
+            for name in partition["files"]:
+                parquet_file = pq.ParquetFile(os.path.join(store_dir, name))
+                metadata = parquet_file.metadata
+                indices = [
+                    metadata.schema.to_arrow_schema().get_field_index(c)
+                    for c in columns
+                ]
+                row_groups = []
+                for i in range(metadata.num_row_groups):
+                    row_group = metadata.row_group(i)
+                    stats = row_group.column(indices[0]).statistics
+                    if stats is not None and stats.has_min_max:
+                        low, high = pd.Timestamp(stats.min), pd.Timestamp(stats.max)
+                        if not _overlaps(low, high, start, end):
+                            continue
+                    row_groups.append(i)
+                    scan["bytes_scanned"] += sum(
+                        row_group.column(j).total_compressed_size for j in indices
+                    )
+                if row_groups:
+                    scan["row_groups_read"] += len(row_groups)
+                    tables.append(
+                        parquet_file.read_row_groups(row_groups, columns=columns)
+                    )
+
+        if tables:
+            table = pa.concat_tables(tables)
+            mask = None
+            if start is not None:
+                mask = pc.greater_equal(table.column("date"), pa.scalar(start))
+            if end is not None:
+                before_end = pc.less(table.column("date"), pa.scalar(end))
+                mask = before_end if mask is None else pc.and_(mask, before_end)
+            if mask is not None:
+                table = table.filter(mask)
+            df = table.to_pandas()
+        else:
+            df = pd.DataFrame({c: pd.Series(dtype=np.float64) for c in columns})
+            df["date"] = pd.to_datetime(df["date"])
+
+        df = df.set_index("date").sort_index(kind="stable")
+        span.update(scan, rows=len(df))
+    df.attrs["scan"] = {**scan, "rows": len(df)}
+    return df
+
+
+def save_upload(uploaded_file, root=STORE_DIR, chunk_bytes=_COPY_CHUNK_BYTES):
+    """
+    Copy an uploaded CSV file next to the stores and return its path.
+
+    Copies are named by content hash, so uploading the same file again, in
+    any session, reuses the existing copy instead of adding another one.
+    """
+    uploads_dir = os.path.join(root, "uploads")
+    os.makedirs(uploads_dir, exist_ok=True)
+    tmp_path = os.path.join(uploads_dir, f".{uuid.uuid4().hex}.tmp")
+    digest = hashlib.sha1()
+    uploaded_file.seek(0)
+    try:
+        with open(tmp_path, "wb") as f:
+            for block in iter(lambda: uploaded_file.read(chunk_bytes), b""):
+                digest.update(block)
+                f.write(block)
+        path = os.path.join(
+            uploads_dir,
+            f"{digest.hexdigest()[:16]}-{os.path.basename(uploaded_file.name)}",
+        )
+        if os.path.exists(path):
+            os.unlink(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return path
@@ -0,0 +1,228 @@
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Series longer than this are downsampled before drawing
+PLOT_MAX_POINTS = int(os.environ.get("PLOT_MAX_POINTS", 2000))
+PLOT_CACHE_MAX_BYTES = int(os.environ.get("PLOT_CACHE_MAX_BYTES", 64 * 1024**2))
+PLOTS_DIR = os.environ.get("PLOTS_DIR", "./plots")
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Select points with the Largest-Triangle-Three-Buckets algorithm.
+
+    Keeps the first and last point and, for each of ``threshold - 2`` equal
+    buckets in between, the point forming the largest triangle with the
+    previously selected point and the average of the next bucket.
+
+    Args:
+        x (numpy.ndarray): Monotonic x values as floats
+        y (numpy.ndarray): y values
+        threshold (int): Number of points to keep
+
+    Returns:
+        numpy.ndarray: Sorted indices of the selected points
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # Bucket boundaries for the n - 2 interior points
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    # Averages of every bucket, with the last point as the final "next bucket"
+    sums_x = np.add.reduceat(x[1 : n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1 : n - 1], edges[:-1] - 1)
+    counts = np.diff(edges)
+    avg_x = np.append(sums_x / counts, x[-1])
+    avg_y = np.append(sums_y / counts, y[-1])
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_x, next_y = avg_x[bucket + 1], avg_y[bucket + 1]
+        # Twice the triangle area for every candidate point in the bucket
+        areas = np.abs(
+            (x[a] - next_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (next_y - y[a])
+        )
+        a = start + int(np.argmax(areas))
+        selected[bucket + 1] = a
+    return selected
+
+
+def downsample_series(dates, values, max_points=PLOT_MAX_POINTS):
+    """Downsample a date/value series to at most ``max_points`` points"""
+    dates = np.asarray(dates)
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) <= max_points:
+        return dates, values
+
+    if np.issubdtype(dates.dtype, np.datetime64):
+        x = dates.astype("datetime64[ns]").astype(np.int64).astype(np.float64)
+    else:
+        x = np.arange(len(values), dtype=np.float64)
+    # NaNs would poison the triangle areas
+    y = np.nan_to_num(values, nan=0.0)
+    indices = lttb_indices(x, y, max_points)
+    return dates[indices], values[indices]
+
+
+def downsample_frame(df, max_points=PLOT_MAX_POINTS):
+    """
+    Downsample the rows of a DataFrame of series for charting.
+
+    Each column keeps its own LTTB selection of ``max_points / n_columns``
+    points (at least 3); the union of the selected rows is returned, so
+    every series keeps its peaks while the total stays near ``max_points``.
+    """
+    if len(df) <= max_points or df.shape[1] == 0:
+        return df
+
+    index = df.index.to_numpy()
+    if np.issubdtype(index.dtype, np.datetime64):
+        x = index.astype("datetime64[ns]").astype(np.int64).astype(np.float64)
+    else:
+        x = np.arange(len(df), dtype=np.float64)
+
+    per_column = max(3, max_points // df.shape[1])
+    keep = np.zeros(len(df), dtype=bool)
+    for column in df.columns:
+        y = np.nan_to_num(df[column].to_numpy(dtype=np.float64), nan=0.0)
+        keep[lttb_indices(x, y, per_column)] = True
+    return df[keep]
+
+
+class PlotCache:
+    """Thread-safe LRU cache of rendered PNG bytes, bounded in total size"""
+
+    def __init__(self, max_bytes=PLOT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, png):
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = png
+            self.nbytes += len(png)
+            while self.nbytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= len(evicted)
+
+
+_plot_cache = PlotCache()
+# Saved plot files by path; files are content-addressed, so never stale
+_plot_file_cache = PlotCache()
+
+
+def _plot_key(dates, values, options):
+    digest = hashlib.sha1()
+    if dates.dtype.kind in "Mmfiub":
+        digest.update(str(dates.dtype).encode("utf-8"))
+        digest.update(np.ascontiguousarray(dates).view(np.uint8))
+    else:
+        digest.update(repr(dates.tolist()).encode("utf-8"))
+    digest.update(np.ascontiguousarray(values).view(np.uint8))
+    digest.update(repr(sorted(options.items())).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def render_time_series_png(
+    dates,
+    values,
+    title="Time Series Data",
+    xlabel="Date",
+    ylabel="Value",
+    figsize=(10, 6),
+    dpi=100,
+    max_points=PLOT_MAX_POINTS,
+):
+    """
+    Render a time series line plot to PNG bytes.
+
+    Uses a standalone Agg figure (no pyplot global state), so it is safe to
+    call from several threads at once. Results are cached by the hash of the
+    series and plot options, and long series are downsampled with LTTB first.
+
+    Returns:
+        tuple[str, bytes]: The content key of the plot and the PNG bytes
+    """
+    dates = np.asarray(dates)
+    values = np.asarray(values, dtype=np.float64)
+    options = {
+        "title": title,
+        "xlabel": xlabel,
+        "ylabel": ylabel,
+        "figsize": tuple(figsize),
+        "dpi": dpi,
+        "max_points": max_points,
+    }
+    key = _plot_key(dates, values, options)
+    png = _plot_cache.get(key)
+    if png is not None:
+        return key, png
+
+    dates, values = downsample_series(dates, values, max_points)
+
+    # matplotlib is only loaded once a plot is actually rendered
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.plot(dates, values)
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    fig.autofmt_xdate()
+
+    buffer = io.BytesIO()
+    # Fast zlib level: the plots are small and encoding dominates render time
+    fig.savefig(buffer, format="png", pil_kwargs={"compress_level": 1})
+    png = buffer.getvalue()
+    _plot_cache.put(key, png)
+    return key, png
+
+
+def save_plot(key, png, plots_dir=PLOTS_DIR):
+    """Write PNG bytes to a content-addressed file and return its path"""
+    plots_dir = os.path.abspath(plots_dir)
+    os.makedirs(plots_dir, exist_ok=True)
+    filepath = os.path.join(plots_dir, f"plot_{key[:16]}.png")
+    if not os.path.exists(filepath):
+        # Write to a temporary name first so readers never see partial files
+        tmp_path = f"{filepath}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(png)
+        os.replace(tmp_path, filepath)
+    _plot_file_cache.put(filepath, png)
+    return filepath
+
+
+def read_plot(filepath):
+    """Return the PNG bytes of a saved plot, reading the file at most once"""
+    filepath = os.path.abspath(filepath)
+    png = _plot_file_cache.get(filepath)
+    if png is None:
+        with open(filepath, "rb") as f:
+            png = f.read()
+        _plot_file_cache.put(filepath, png)
+    return png
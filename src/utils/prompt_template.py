@@ -0,0 +1,196 @@
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from functools import lru_cache
+
+from utils.history import count_tokens, load_tokenizer_config
+from utils.metrics import get_metrics_registry, trace
+from utils.model_router import current_model_session
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "model"
+)
+# Bundled chat template the served model uses (vLLM --chat-template)
+PROMPT_CHAT_TEMPLATE = os.environ.get(
+    "PROMPT_CHAT_TEMPLATE", "tool_chat_template_llama3.1_json.jinja"
+)
+# "stable" asks the server for a byte-stable prompt prefix: a pinned date and
+# the tool schemas in the system header instead of the first user message.
+# "off" sends plain OpenAI requests, e.g. for servers rejecting unknown fields.
+PROMPT_CACHE_MODE = os.environ.get("PROMPT_CACHE_MODE", "stable")
+# Also send the bundled template, so the server renders exactly what the
+# prefix diagnostic measures (vLLM's "chat_template" request field)
+PROMPT_SEND_TEMPLATE = os.environ.get("PROMPT_SEND_TEMPLATE", "0") == "1"
+# Pin the date in the system header, e.g. "26 Jul 2024"; by default each
+# chat pins the day it started
+PROMPT_DATE = os.environ.get("PROMPT_DATE", "")
+# Measure the prefix shared by consecutive requests of a session; renders
+# every prompt a second time, so it is off unless enabled
+PROMPT_PREFIX_DIAGNOSTICS = os.environ.get("PROMPT_PREFIX_DIAGNOSTICS", "0") == "1"
+
+
+def prompt_date(now=None):
+    """Return the date string for the system header"""
+    return PROMPT_DATE or (now or datetime.now()).strftime("%d %b %Y")
+
+
+def _tojson(value, indent=None):
+    # Same output as the tojson filter of transformers' chat templates
+    return json.dumps(value, ensure_ascii=False, indent=indent)
+
+
+def _raise_exception(message):
+    from jinja2.exceptions import TemplateError
+
+    raise TemplateError(message)
+
+
+@lru_cache(maxsize=None)
+def get_chat_template(name=PROMPT_CHAT_TEMPLATE):
+    """Load and compile a bundled chat template, once per process"""
+    import jinja2.ext
+    from jinja2.sandbox import ImmutableSandboxedEnvironment
+
+    # The environment transformers and vLLM render chat templates in
+    env = ImmutableSandboxedEnvironment(
+        trim_blocks=True, lstrip_blocks=True, extensions=[jinja2.ext.loopcontrols]
+    )
+    env.filters["tojson"] = _tojson
+    env.globals["raise_exception"] = _raise_exception
+    with open(os.path.join(TEMPLATE_DIR, name)) as f:
+        return env.from_string(f.read())
+
+
+def chat_template_kwargs(date_string):
+    """Template variables that keep the prompt prefix stable across turns"""
+    return {"date_string": date_string, "tools_in_user_message": False}
+
+
+def get_prompt_params(date_string=None, mode=PROMPT_CACHE_MODE):
+    """Return the request parameters of a prompt-assembly mode"""
+    if mode != "stable":
+        return {}
+    extra_body = {
+        "chat_template_kwargs": chat_template_kwargs(date_string or prompt_date())
+    }
+    if PROMPT_SEND_TEMPLATE:
+        with open(os.path.join(TEMPLATE_DIR, PROMPT_CHAT_TEMPLATE)) as f:
+            extra_body["chat_template"] = f.read()
+    return {"extra_body": extra_body}
+
+
+def _template_messages(messages):
+    # Like vLLM, hand tool call arguments to the template as objects
+    rendered = []
+    for message in messages:
+        message = dict(message)
+        if message.get("tool_calls"):
+            message["tool_calls"] = [
+                {
+                    **call,
+                    "function": {
+                        **call["function"],
+                        "arguments": json.loads(call["function"]["arguments"] or "{}"),
+                    },
+                }
+                for call in message["tool_calls"]
+            ]
+        else:
+            message.pop("tool_calls", None)
+        rendered.append(message)
+    return rendered
+
+
+def render_prompt(messages, tools=None, template=PROMPT_CHAT_TEMPLATE, **kwargs):
+    """
+    Render OpenAI-format chat messages to the prompt text the server sees.
+
+    Args:
+        messages (list[dict]): Messages of a chat completion request
+        tools (list[dict], optional): Tools of the request
+        template (str): Bundled template file name
+        **kwargs: Template variables, e.g. from chat_template_kwargs
+
+    Returns:
+        str: The rendered prompt, ending with the assistant header
+    """
+    variables = {"date_string": prompt_date(), **kwargs}
+    if tools:
+        variables["tools"] = tools
+    return get_chat_template(template).render(
+        messages=_template_messages(messages),
+        bos_token=load_tokenizer_config()["bos_token"],
+        add_generation_prompt=True,
+        **variables,
+    )
+
+
+def shared_prefix_length(a, b):
+    """Length of the common prefix of two strings"""
+    # Binary search over slice comparisons, which run at memcmp speed
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+class PrefixTracker:
+    """Remembers the last prompt of each session to measure prefix reuse"""
+
+    def __init__(self, max_sessions=256):
+        self.max_sessions = max_sessions
+        self._prompts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def observe(self, session, prompt):
+        """Return the prefix ``prompt`` shares with the session's previous one"""
+        with self._lock:
+            previous = self._prompts.pop(session, "")
+            self._prompts[session] = prompt
+            while len(self._prompts) > self.max_sessions:
+                self._prompts.popitem(last=False)
+        return shared_prefix_length(previous, prompt)
+
+
+_prefix_tracker = PrefixTracker()
+
+
+def observe_request(request):
+    """
+    httpx request hook recording how much of a chat completion prompt the
+    server can reuse from the previous request of the same session.
+    """
+    if request.method != "POST" or not request.url.path.endswith("/chat/completions"):
+        return
+    # Requests outside a model session (batches, benchmarks) have no
+    # previous request to compare with
+    session = current_model_session()
+    if session is None:
+        return
+    try:
+        body = json.loads(request.content)
+        kwargs = body.get("chat_template_kwargs") or {}
+        prompt = render_prompt(body["messages"], body.get("tools"), **kwargs)
+    except Exception as e:
+        logger.debug("Could not render the prompt for prefix diagnostics: %s", e)
+        return
+
+    shared = _prefix_tracker.observe(session, prompt)
+    with trace("prompt_prefix") as span:
+        # Uncached: prompts are long and rarely repeat exactly
+        span["prompt_tokens"] = count_tokens.__wrapped__(prompt)
+        span["shared_tokens"] = count_tokens.__wrapped__(prompt[:shared])
+        span["prompt_chars"] = len(prompt)
+        span["shared_chars"] = shared
+    registry = get_metrics_registry()
+    registry.inc("prompt_tokens_rendered_total", span["prompt_tokens"])
+    registry.inc("prompt_shared_prefix_tokens_total", span["shared_tokens"])
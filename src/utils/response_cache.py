@@ -0,0 +1,349 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Optional
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_openai import ChatOpenAI
+
+RESPONSE_CACHE_PATH = os.environ.get("RESPONSE_CACHE_PATH", "./response_cache.sqlite")
+RESPONSE_CACHE_MEMORY_ENTRIES = int(
+    os.environ.get("RESPONSE_CACHE_MEMORY_ENTRIES", 512)
+)
+RESPONSE_CACHE_DISK_ENTRIES = int(os.environ.get("RESPONSE_CACHE_DISK_ENTRIES", 50000))
+
+# Values of the "response_cache" request option
+CACHE_OFF = "off"
+CACHE_AUTO = "auto"  # only cache deterministic (temperature 0) requests
+CACHE_FORCE = "force"
+
+# Request parameters that change the generated response
+_SAMPLING_PARAMS = (
+    "temperature",
+    "top_p",
+    "max_tokens",
+    "max_completion_tokens",
+    "frequency_penalty",
+    "presence_penalty",
+    "stop",
+    "seed",
+)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _normalize_text(text):
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def _normalize_message(message):
+    content = message.content
+    if isinstance(content, str):
+        content = _normalize_text(content)
+    normalized = {"type": message.type, "content": content}
+    if getattr(message, "tool_calls", None):
+        normalized["tool_calls"] = [
+            {"name": call["name"], "args": call["args"]} for call in message.tool_calls
+        ]
+    if getattr(message, "name", None) and message.type == "tool":
+        normalized["name"] = message.name
+    return normalized
+
+
+def make_cache_key(model, messages, params):
+    """Return the cache key of a chat completion request.
+
+    Covers the model, the whitespace-normalized messages, the tool schemas
+    and the sampling parameters. Tool call ids are left out since they are
+    generated per response.
+    """
+    payload = {
+        "model": model,
+        "messages": [_normalize_message(m) for m in messages],
+        "tools": params.get("tools"),
+        "tool_choice": params.get("tool_choice"),
+        "sampling": {k: params.get(k) for k in _SAMPLING_PARAMS},
+    }
+    serialized = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def _message_to_record(message):
+    return json.dumps(
+        {
+            "content": message.content,
+            "tool_calls": [
+                {"name": call["name"], "args": call["args"]}
+                for call in message.tool_calls
+            ],
+        }
+    )
+
+
+def _message_from_record(record):
+    data = json.loads(record)
+    # Fresh tool call ids keep replayed calls distinct within a thread
+    return AIMessage(
+        content=data["content"],
+        response_metadata={"cache_hit": True},
+        tool_calls=[
+            {
+                "name": call["name"],
+                "args": call["args"],
+                "id": f"call_{uuid.uuid4().hex}",
+            }
+            for call in data["tool_calls"]
+        ],
+    )
+
+
+class ResponseCache:
+    """Two-tier (memory LRU and SQLite) cache of chat model responses"""
+
+    def __init__(
+        self,
+        path=RESPONSE_CACHE_PATH,
+        max_memory_entries=RESPONSE_CACHE_MEMORY_ENTRIES,
+        max_disk_entries=RESPONSE_CACHE_DISK_ENTRIES,
+    ):
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "bypassed": 0,
+            "stores": 0,
+        }
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_used "
+                "ON responses (last_used)"
+            )
+            self._conn.commit()
+
+    def lookup(self, key):
+        """Return the cached AIMessage for a key, or None"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return _message_from_record(self._memory[key])
+
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT value FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE responses SET last_used = ? WHERE key = ?",
+                        (time.time(), key),
+                    )
+                    self._conn.commit()
+                    self._remember(key, row[0])
+                    self._stats["disk_hits"] += 1
+                    return _message_from_record(row[0])
+
+            self._stats["misses"] += 1
+            return None
+
+    def update(self, key, message):
+        """Store the response message for a key in both tiers"""
+        record = _message_to_record(message)
+        with self._lock:
+            self._remember(key, record)
+            self._stats["stores"] += 1
+            if self._conn is None:
+                return
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, last_used) "
+                "VALUES (?, ?, ?)",
+                (key, record, time.time()),
+            )
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+                "ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_disk_entries,),
+            )
+            self._conn.commit()
+
+    def record_bypass(self):
+        with self._lock:
+            self._stats["bypassed"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM responses")
+                self._conn.commit()
+
+    def stats(self):
+        """Return hit/miss counters and the hit rate of cacheable requests"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        return stats
+
+    def _remember(self, key, record):
+        self._memory[key] = record
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+
+@lru_cache(maxsize=None)
+def get_response_cache():
+    """Return the process-wide response cache"""
+    return ResponseCache()
+
+
+def _replay_chunks(message):
+    """Split a cached message into stream chunks, word by word"""
+    for piece in re.findall(r"\s*\S+\s*", message.content) or [message.content]:
+        yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+    # The last chunk carries the tool calls and marks the response as cached
+    yield ChatGenerationChunk(
+        message=AIMessageChunk(
+            content="",
+            tool_call_chunks=[
+                {
+                    "name": call["name"],
+                    "args": json.dumps(call["args"]),
+                    "id": call["id"],
+                    "index": index,
+                }
+                for index, call in enumerate(message.tool_calls)
+            ],
+            response_metadata=message.response_metadata,
+        )
+    )
+
+
+class CachingChatOpenAI(ChatOpenAI):
+    """ChatOpenAI with an opt-in response cache.
+
+    Caching is enabled per request with the ``response_cache`` option (one of
+    ``CACHE_OFF``, ``CACHE_AUTO`` or ``CACHE_FORCE``), typically bound with
+    ``.bind(response_cache=...)``. In auto mode, requests with a temperature
+    above 0 bypass the cache. Cache hits are replayed as stream chunks so they
+    render through the same streaming path as live responses.
+    """
+
+    response_cache: Optional[Any] = None
+
+    def _get_cache(self):
+        return self.response_cache or get_response_cache()
+
+    def _cache_key(self, messages, kwargs):
+        mode = kwargs.pop("response_cache", CACHE_OFF)
+        if mode == CACHE_OFF:
+            return None
+        params = {**self._default_params, **kwargs}
+        temperature = params.get("temperature")
+        if mode == CACHE_AUTO and (temperature is None or temperature > 0):
+            self._get_cache().record_bypass()
+            return None
+        return make_cache_key(self.model_name, messages, params)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        key = self._cache_key(messages, kwargs)
+        cached = self._get_cache().lookup(key) if key else None
+        if cached is not None:
+            for chunk in _replay_chunks(cached):
+                if run_manager:
+                    run_manager.on_llm_new_token(chunk.message.content, chunk=chunk)
+                yield chunk
+            return
+
+        chunks = []
+        for chunk in super()._stream(
+            messages, stop=stop, run_manager=run_manager, **kwargs
+        ):
+            chunks.append(chunk.message)
+            yield chunk
+        if key and chunks:
+            message = chunks[0]
+            for chunk in chunks[1:]:
+                message += chunk
+            self._get_cache().update(key, message)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.streaming:
+            # ChatOpenAI generates through _stream, which handles the cache
+            return super()._generate(
+                messages, stop=stop, run_manager=run_manager, **kwargs
+            )
+
+        key = self._cache_key(messages, kwargs)
+        cached = self._get_cache().lookup(key) if key else None
+        if cached is not None:
+            return ChatResult(generations=[ChatGeneration(message=cached)])
+
+        result = super()._generate(
+            messages, stop=stop, run_manager=run_manager, **kwargs
+        )
+        if key:
+            self._get_cache().update(key, result.generations[0].message)
+        return result
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        key = self._cache_key(messages, kwargs)
+        cached = self._get_cache().lookup(key) if key else None
+        if cached is not None:
+            for chunk in _replay_chunks(cached):
+                if run_manager:
+                    await run_manager.on_llm_new_token(
+                        chunk.message.content, chunk=chunk
+                    )
+                yield chunk
+            return
+
+        chunks = []
+        async for chunk in super()._astream(
+            messages, stop=stop, run_manager=run_manager, **kwargs
+        ):
+            chunks.append(chunk.message)
+            yield chunk
+        if key and chunks:
+            message = chunks[0]
+            for chunk in chunks[1:]:
+                message += chunk
+            self._get_cache().update(key, message)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.streaming:
+            return await super()._agenerate(
+                messages, stop=stop, run_manager=run_manager, **kwargs
+            )
+
+        key = self._cache_key(messages, kwargs)
+        cached = self._get_cache().lookup(key) if key else None
+        if cached is not None:
+            return ChatResult(generations=[ChatGeneration(message=cached)])
+
+        result = await super()._agenerate(
+            messages, stop=stop, run_manager=run_manager, **kwargs
+        )
+        if key:
+            self._get_cache().update(key, result.generations[0].message)
+        return result
@@ -0,0 +1,274 @@
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+
+# BM25 parameters, fixed when an index is written
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Candidates taken from each index before hybrid results are fused
+HYBRID_CANDIDATES = 50
+
+_TOKEN = re.compile(r"[^\W_]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the "
+    "this to was were will with".split()
+)
+
+_write_lock = threading.Lock()
+
+
+def tokenize(text):
+    """Lowercase word tokens of ``text`` without stopwords"""
+    return [t for t in _TOKEN.findall(text.lower()) if t not in _STOPWORDS]
+
+
+def _save(directory, name, array):
+    np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(array))
+
+
+def _load(directory, name):
+    # Memory-mapped: processes opening the same index share one copy in the
+    # page cache, and only the postings a query touches are read
+    return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+
+
+def write_index(root, chunks, vectors=None):
+    """
+    Write a new version of the index under ``root`` and make it current.
+
+    The BM25 index is stored as compressed sparse rows: the postings of
+    term ``t`` are ``doc_ids[offsets[t]:offsets[t + 1]]`` with their
+    precomputed BM25 term weights, so a query is a few array slices and one
+    scatter-add. Readers of the previous version keep their memory maps
+    until they reopen the index.
+
+    Args:
+        root (str): Index directory
+        chunks (list[dict]): Chunks with "text", "source", "page" and "hash"
+        vectors (np.ndarray, optional): One embedding per chunk for the
+            dense index
+
+    Returns:
+        str: Directory of the new version
+    """
+    sources = sorted({chunk["source"] for chunk in chunks})
+    source_ids = {source: i for i, source in enumerate(sources)}
+    vocabulary = {}
+    term_ids, doc_ids, term_freqs = [], [], []
+    doc_lengths = np.zeros(len(chunks), dtype=np.int32)
+    for doc_id, chunk in enumerate(chunks):
+        counts = Counter(tokenize(chunk["text"]))
+        doc_lengths[doc_id] = sum(counts.values())
+        for term, count in counts.items():
+            term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+            doc_ids.append(doc_id)
+            term_freqs.append(count)
+
+    term_ids = np.asarray(term_ids, dtype=np.int32)
+    doc_ids = np.asarray(doc_ids, dtype=np.int32)
+    term_freqs = np.asarray(term_freqs, dtype=np.float32)
+    order = np.lexsort((doc_ids, term_ids))
+    term_ids, doc_ids, term_freqs = term_ids[order], doc_ids[order], term_freqs[order]
+
+    doc_freqs = np.bincount(term_ids, minlength=len(vocabulary))
+    offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    np.cumsum(doc_freqs, out=offsets[1:])
+    n_docs = len(chunks)
+    average_length = float(doc_lengths.mean()) if n_docs else 0.0
+    idf = np.log1p((n_docs - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+    length_norms = BM25_K1 * (
+        1 - BM25_B + BM25_B * doc_lengths[doc_ids] / max(average_length, 1.0)
+    )
+    weights = term_freqs * (BM25_K1 + 1) / (term_freqs + length_norms)
+
+    encoded = [chunk["text"].encode("utf-8") for chunk in chunks]
+    text_offsets = np.zeros(n_docs + 1, dtype=np.int64)
+    np.cumsum([len(text) for text in encoded], out=text_offsets[1:])
+
+    version = f"v{time.time_ns()}-{uuid.uuid4().hex[:6]}"
+    directory = os.path.join(root, version)
+    os.makedirs(directory)
+    _save(directory, "offsets", offsets)
+    _save(directory, "doc_ids", doc_ids)
+    _save(directory, "weights", weights.astype(np.float32))
+    _save(directory, "idf", idf)
+    _save(directory, "text_offsets", text_offsets)
+    _save(
+        directory,
+        "chunk_source",
+        np.asarray([source_ids[c["source"]] for c in chunks], np.int32),
+    )
+    _save(directory, "chunk_page", np.asarray([c["page"] for c in chunks], np.int32))
+    _save(directory, "chunk_hash", np.asarray([c["hash"] for c in chunks], np.uint64))
+    if vectors is not None:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        _save(directory, "vectors", vectors / np.maximum(norms, 1e-12))
+    with open(os.path.join(directory, "texts.bin"), "wb") as f:
+        for text in encoded:
+            f.write(text)
+    with open(os.path.join(directory, "meta.json"), "w") as f:
+        json.dump(
+            {
+                "vocabulary": vocabulary,
+                "sources": sources,
+                "average_length": average_length,
+                "k1": BM25_K1,
+                "b": BM25_B,
+            },
+            f,
+        )
+
+    with _write_lock:
+        current = os.path.join(root, "CURRENT")
+        previous = _read_version(root)
+        with open(current + ".tmp", "w") as f:
+            f.write(version)
+        os.replace(current + ".tmp", current)
+    if previous:
+        # Open memory maps of the old version stay valid on POSIX systems
+        shutil.rmtree(os.path.join(root, previous), ignore_errors=True)
+    return directory
+
+
+def _read_version(root):
+    try:
+        with open(os.path.join(root, "CURRENT")) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+class SearchIndex:
+    """A read-only, memory-mapped version of an index written by write_index"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        self.vocabulary = meta["vocabulary"]
+        self.sources = meta["sources"]
+        self.offsets = _load(directory, "offsets")
+        self.doc_ids = _load(directory, "doc_ids")
+        self.weights = _load(directory, "weights")
+        self.idf = _load(directory, "idf")
+        self.text_offsets = _load(directory, "text_offsets")
+        self.chunk_source = _load(directory, "chunk_source")
+        self.chunk_page = _load(directory, "chunk_page")
+        self.chunk_hash = _load(directory, "chunk_hash")
+        vectors = os.path.join(directory, "vectors.npy")
+        self.vectors = _load(directory, "vectors") if os.path.exists(vectors) else None
+        texts = os.path.join(directory, "texts.bin")
+        # np.memmap cannot map an empty file
+        self.texts = (
+            np.memmap(texts, dtype=np.uint8, mode="r")
+            if os.path.getsize(texts)
+            else np.zeros(0, dtype=np.uint8)
+        )
+
+    def __len__(self):
+        return len(self.chunk_page)
+
+    def chunk(self, i):
+        """Return chunk ``i`` as a dict with its text, source and page"""
+        start, end = self.text_offsets[i], self.text_offsets[i + 1]
+        return {
+            "text": self.texts[start:end].tobytes().decode("utf-8"),
+            "source": self.sources[self.chunk_source[i]],
+            "page": int(self.chunk_page[i]),
+        }
+
+    def chunks(self):
+        """Yield every chunk with its content hash, e.g. to rebuild the index"""
+        for i in range(len(self)):
+            yield {**self.chunk(i), "hash": int(self.chunk_hash[i])}
+
+    def bm25_scores(self, query):
+        """Return the BM25 score of every chunk for ``query``"""
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            # Every chunk appears once per term, so a plain fancy-index add is safe
+            scores[self.doc_ids[start:end]] += (
+                self.idf[term_id] * self.weights[start:end]
+            )
+        return scores
+
+    @staticmethod
+    def _top(scores, k):
+        k = min(k, len(scores))
+        if k == 0:
+            return np.zeros(0, dtype=np.int64)
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top], kind="stable")]
+
+    def search(self, query, k=5, query_vector=None):
+        """
+        Return the ``k`` best chunks for ``query``.
+
+        With a ``query_vector`` and a dense index, BM25 and vector results
+        are combined by reciprocal rank fusion.
+
+        Returns:
+            list[dict]: Chunks with their "score", best first
+        """
+        scores = self.bm25_scores(query)
+        if query_vector is None or self.vectors is None:
+            top = [i for i in self._top(scores, k) if scores[i] > 0]
+            return [{**self.chunk(i), "score": float(scores[i])} for i in top]
+
+        # A new array: asarray returns the caller's float32 array as it is
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        query_vector = query_vector / max(float(np.linalg.norm(query_vector)), 1e-12)
+        similarities = self.vectors @ query_vector
+        fused = {}
+        for ranking in (
+            [i for i in self._top(scores, HYBRID_CANDIDATES) if scores[i] > 0],
+            self._top(similarities, HYBRID_CANDIDATES),
+        ):
+            for rank, i in enumerate(ranking):
+                fused[int(i)] = fused.get(int(i), 0.0) + 1.0 / (60 + rank)
+        top = sorted(fused, key=fused.get, reverse=True)[:k]
+        return [{**self.chunk(i), "score": fused[i]} for i in top]
+
+    def stats(self):
+        return {
+            "chunks": len(self),
+            "sources": len(self.sources),
+            "terms": len(self.vocabulary),
+            "dense": self.vectors is not None,
+            "bytes": sum(
+                os.path.getsize(os.path.join(self.directory, name))
+                for name in os.listdir(self.directory)
+            ),
+        }
+
+
+@lru_cache(maxsize=4)
+def _open_index(directory):
+    return SearchIndex(directory)
+
+
+def load_index(root):
+    """Return the current version of the index under ``root``, or None"""
+    for _ in range(3):
+        version = _read_version(root)
+        if version is None:
+            return None
+        try:
+            return _open_index(os.path.join(root, version))
+        except FileNotFoundError:
+            # Replaced by a newer version between reading CURRENT and opening
+            continue
+    raise RuntimeError(f"Could not open the search index in {root}")
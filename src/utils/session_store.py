@@ -0,0 +1,299 @@
+import hashlib
+import itertools
+import os
+import pickle
+import shutil
+import sys
+import threading
+import time
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# In-memory bytes of spillable objects per browser session
+SESSION_MAX_BYTES = int(os.environ.get("SESSION_MAX_BYTES", 128 * 1024**2))
+# In-memory bytes over all sessions of this process
+SESSION_GLOBAL_MAX_BYTES = int(
+    os.environ.get("SESSION_GLOBAL_MAX_BYTES", 1024 * 1024**2)
+)
+# Where cold objects are written when a budget is exceeded
+SESSION_SPILL_DIR = os.environ.get("SESSION_SPILL_DIR", "./session_spill")
+# Sessions idle for longer are dropped with their spilled objects and files
+SESSION_TTL_SECONDS = float(os.environ.get("SESSION_TTL_SECONDS", 2 * 3600))
+
+
+def estimate_nbytes(value):
+    """Approximate memory held by DataFrames, arrays, strings, bytes and
+    containers of them"""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        usage = value.memory_usage(index=True, deep=True)
+        return int(usage.sum() if isinstance(usage, pd.Series) else usage)
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (str, bytes, bytearray)):
+        return sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            estimate_nbytes(k) + estimate_nbytes(v) for k, v in value.items()
+        )
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(estimate_nbytes(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class _Entry:
+    def __init__(self, value, nbytes, spillable, tick):
+        self.value = value
+        self.nbytes = nbytes
+        self.spillable = spillable
+        self.last_used = tick
+        # Pickle of the value; it stays valid until the value is replaced
+        self.path = None
+        # Being pickled outside the store lock
+        self.spilling = False
+
+    @property
+    def in_memory(self):
+        return self.value is not None or self.path is None
+
+
+class _Session:
+    def __init__(self):
+        self.entries = {}
+        self.files = set()
+        self.last_used = time.time()
+
+    def memory_bytes(self):
+        return sum(e.nbytes for e in self.entries.values() if e.in_memory)
+
+
+class SessionStore:
+    """Session-scoped objects with byte accounting and spill to disk.
+
+    Large per-session objects (result DataFrames, chat histories) are put
+    here instead of ``st.session_state``. When a session or the whole
+    process goes over its budget, the least recently used spillable objects
+    are pickled to ``spill_dir`` and dropped from memory; ``get`` reloads
+    them transparently. Sessions idle for ``ttl_seconds`` are dropped with
+    their spill files and the files tracked for them (plots, exports); a
+    file shared by several sessions is deleted with the last of them.
+    """
+
+    def __init__(
+        self,
+        max_bytes_per_session=SESSION_MAX_BYTES,
+        max_bytes=SESSION_GLOBAL_MAX_BYTES,
+        spill_dir=SESSION_SPILL_DIR,
+        ttl_seconds=SESSION_TTL_SECONDS,
+    ):
+        self.max_bytes_per_session = max_bytes_per_session
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.ttl_seconds = ttl_seconds
+        self.spills = 0
+        self.reloads = 0
+        self._sessions = {}
+        self._ticks = itertools.count()
+        self._lock = threading.Lock()
+
+    def _session(self, session_id):
+        self._drop_expired()
+        session = self._sessions.setdefault(session_id, _Session())
+        session.last_used = time.time()
+        return session
+
+    def put(self, session_id, name, value, spillable=True):
+        """Store an object; pinned objects (``spillable=False``) are only
+        accounted, e.g. a history the UI reads on every rerun"""
+        with self._lock:
+            session = self._session(session_id)
+            previous = session.entries.get(name)
+            if previous is not None and previous.path:
+                _remove(previous.path)
+            entry = _Entry(value, estimate_nbytes(value), spillable, next(self._ticks))
+            session.entries[name] = entry
+            victims = self._enforce(session_id, entry)
+        self._spill(victims)
+
+    def get(self, session_id, name, default=None):
+        """Return an object, reloading it from disk if it was spilled"""
+        with self._lock:
+            session = self._session(session_id)
+            entry = session.entries.get(name)
+            if entry is None:
+                return default
+            entry.last_used = next(self._ticks)
+            if entry.in_memory:
+                return entry.value
+            try:
+                with open(entry.path, "rb") as f:
+                    entry.value = pickle.load(f)
+            except OSError:
+                del session.entries[name]
+                return default
+            self.reloads += 1
+            value = entry.value
+            victims = self._enforce(session_id, entry)
+        self._spill(victims)
+        return value
+
+    def pop(self, session_id, name):
+        """Remove an object and its spill file"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            entry = session.entries.pop(name, None) if session else None
+        if entry is not None and entry.path:
+            _remove(entry.path)
+
+    def track_file(self, session_id, path):
+        """Delete ``path`` when the session expires or releases its files"""
+        with self._lock:
+            self._session(session_id).files.add(os.path.abspath(path))
+
+    def release_files(self, session_id, paths=None):
+        """Delete the files of a session, or only ``paths`` of them, that no
+        other session tracks; the others stay until the session expires"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return
+            released = session.files
+            if paths is not None:
+                released = released & {os.path.abspath(p) for p in paths}
+            files = self._unshared_files(session_id) & released
+            session.files -= released
+        for path in files:
+            _remove(path)
+
+    def drop_session(self, session_id):
+        """Drop a session's objects, spill files and tracked files"""
+        with self._lock:
+            files = self._drop(session_id)
+        for path in files:
+            _remove(path)
+
+    def session_stats(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id) or _Session()
+            entries = session.entries.values()
+            return {
+                "objects": len(session.entries),
+                "memory_bytes": sum(e.nbytes for e in entries if e.in_memory),
+                "spilled": sum(not e.in_memory for e in entries),
+                "spilled_bytes": sum(e.nbytes for e in entries if not e.in_memory),
+                "files": len(session.files),
+                "max_bytes": self.max_bytes_per_session,
+            }
+
+    def stats(self):
+        with self._lock:
+            entries = [e for s in self._sessions.values() for e in s.entries.values()]
+            return {
+                "sessions": len(self._sessions),
+                "memory_bytes": sum(e.nbytes for e in entries if e.in_memory),
+                "spilled_bytes": sum(e.nbytes for e in entries if not e.in_memory),
+                "max_bytes": self.max_bytes,
+                "spills": self.spills,
+                "reloads": self.reloads,
+            }
+
+    def _enforce(self, session_id, keep):
+        """Pick the objects to spill to get back under the budgets; the
+        caller pickles them with _spill once it has released the lock"""
+        # The object in use is never spilled, even when it alone is too big
+        victims = []
+        session = self._sessions[session_id]
+        excess = session.memory_bytes() - self.max_bytes_per_session
+        while excess > 0 and self._pick_coldest([(session_id, session)], keep, victims):
+            excess -= victims[-1][2].nbytes
+        excess = sum(s.memory_bytes() for s in self._sessions.values())
+        excess -= sum(victim[2].nbytes for victim in victims) + self.max_bytes
+        while excess > 0 and self._pick_coldest(self._sessions.items(), keep, victims):
+            excess -= victims[-1][2].nbytes
+        return victims
+
+    def _pick_coldest(self, sessions, keep, victims):
+        # Objects being pickled by another thread count as spilled already
+        candidates = [
+            (entry.last_used, session_id, name, entry)
+            for session_id, session in sessions
+            for name, entry in session.entries.items()
+            if entry.spillable
+            and entry.in_memory
+            and not entry.spilling
+            and entry is not keep
+        ]
+        if not candidates:
+            return False
+        _, session_id, name, entry = min(candidates, key=lambda c: c[0])
+        entry.spilling = True
+        victims.append((session_id, name, entry, entry.value, entry.last_used))
+        return True
+
+    def _spill(self, victims):
+        # Pickling a large frame takes long, so other sessions are not
+        # blocked by it; an object replaced or used meanwhile stays in memory
+        for session_id, name, entry, value, last_used in victims:
+            path = entry.path
+            if path is None:
+                directory = os.path.join(self.spill_dir, session_id)
+                os.makedirs(directory, exist_ok=True)
+                digest = hashlib.sha1(name.encode("utf-8")).hexdigest()[:16]
+                path = os.path.join(directory, f"{digest}-{next(self._ticks)}.pkl")
+                try:
+                    with open(path + ".tmp", "wb") as f:
+                        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                    os.replace(path + ".tmp", path)
+                except OSError:
+                    _remove(path + ".tmp")
+                    path = None
+            with self._lock:
+                entry.spilling = False
+                session = self._sessions.get(session_id)
+                current = (
+                    path is not None
+                    and session is not None
+                    and session.entries.get(name) is entry
+                    and entry.last_used == last_used
+                )
+                if current:
+                    entry.path = path
+                    entry.value = None
+                    self.spills += 1
+            if not current and path is not None and path != entry.path:
+                _remove(path)
+
+    def _unshared_files(self, session_id):
+        others = set().union(
+            *(s.files for sid, s in self._sessions.items() if sid != session_id)
+        )
+        return self._sessions[session_id].files - others
+
+    def _drop(self, session_id):
+        if session_id not in self._sessions:
+            return set()
+        files = self._unshared_files(session_id)
+        del self._sessions[session_id]
+        shutil.rmtree(os.path.join(self.spill_dir, session_id), ignore_errors=True)
+        return files
+
+    def _drop_expired(self):
+        cutoff = time.time() - self.ttl_seconds
+        expired = [sid for sid, s in self._sessions.items() if s.last_used < cutoff]
+        for session_id in expired:
+            for path in self._drop(session_id):
+                _remove(path)
+
+
+def _remove(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+@lru_cache(maxsize=None)
+def get_session_store():
+    """Return the process-wide session store"""
+    return SessionStore()
@@ -0,0 +1,251 @@
+"""Seeded synthetic price panels for demos, benchmarks and load tests.
+
+Prices for all tickers are drawn as one (dates x tickers) array per chunk,
+and a chunk continues from the last prices of the previous one, so a panel
+of any size can be generated in memory or streamed to a file. With a seed
+the output is the same whatever the chunk size.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pcsv
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional, CSV output works without it
+    pa = None
+
+# Values drawn per chunk when streaming to a file (rows x tickers)
+SYNTHETIC_CHUNK_CELLS = int(os.environ.get("SYNTHETIC_CHUNK_CELLS", 5_000_000))
+
+MODELS = ("random_walk", "gbm", "factor")
+
+
+def ticker_names(n_tickers):
+    """Return n_tickers column names: T0000, T0001, ..."""
+    return [f"T{i:04d}" for i in range(n_tickers)]
+
+
+class SyntheticMarket:
+    """
+    Price generator for a fixed universe of tickers.
+
+    Models:
+        random_walk: Prices move by start_price * volatility * N(0, 1) per period
+        gbm: Geometric Brownian motion with per-period drift and volatility
+        factor: GBM whose shocks load on n_factors common factors, which
+            explain ``correlation`` of each ticker's variance
+
+    Args:
+        n_tickers (int): Number of price columns
+        model (str): One of MODELS
+        seed (int, optional): Seed for reproducible prices
+        start_price (float): Price before the first period
+        volatility (float): Per-period volatility
+        drift (float): Per-period expected return (gbm and factor)
+        n_factors (int): Common factors of the factor model
+        correlation (float): Share of variance explained by the factors
+    """
+
+    def __init__(
+        self,
+        n_tickers,
+        model="random_walk",
+        seed=None,
+        start_price=100.0,
+        volatility=0.01,
+        drift=0.0,
+        n_factors=3,
+        correlation=0.5,
+    ):
+        if model not in MODELS:
+            raise ValueError(f"Unknown model: {model}, expected one of {MODELS}")
+        self.n_tickers = n_tickers
+        self.model = model
+        self.start_price = start_price
+        self.volatility = volatility
+        self.drift = drift
+        self.correlation = correlation
+        seeds = np.random.SeedSequence(seed).spawn(2)
+        # Idiosyncratic and factor shocks come from separate streams, so the
+        # draws do not depend on how the periods are chunked
+        self._rng = np.random.default_rng(seeds[0])
+        self._factor_rng = np.random.default_rng(seeds[1])
+        self._last = np.full(n_tickers, float(start_price))
+        if model == "factor":
+            loadings = np.random.default_rng(seed).standard_normal(
+                (n_factors, n_tickers)
+            )
+            # The first factor is the market, which every ticker loads on
+            loadings[0] = 1.0 + 0.25 * loadings[0]
+            # Unit-norm columns, so every ticker has the same total variance
+            self._loadings = loadings / np.linalg.norm(loadings, axis=0)
+
+    def _shocks(self, n_rows):
+        shocks = self._rng.standard_normal((n_rows, self.n_tickers))
+        if self.model == "factor":
+            factors = self._factor_rng.standard_normal(
+                (n_rows, self._loadings.shape[0])
+            )
+            shocks *= np.sqrt(1.0 - self.correlation)
+            shocks += np.sqrt(self.correlation) * (factors @ self._loadings)
+        return shocks
+
+    def next_prices(self, n_rows):
+        """Return the prices of the next n_rows periods as an array"""
+        shocks = self._shocks(n_rows)
+        if self.model == "random_walk":
+            shocks *= self.start_price * self.volatility
+            prices = np.cumsum(shocks, axis=0, out=shocks)
+            prices += self._last
+        else:
+            shocks *= self.volatility
+            shocks += self.drift - 0.5 * self.volatility**2
+            prices = np.cumsum(shocks, axis=0, out=shocks)
+            np.exp(prices, out=prices)
+            prices *= self._last
+        if n_rows:
+            self._last = prices[-1].copy()
+        return prices
+
+
+def generate_panel(
+    tickers, start_date, end_date=None, periods=None, freq="D", **market_kwargs
+):
+    """
+    Generate a price panel in memory.
+
+    Args:
+        tickers (list): Column names
+        start_date (str): First date
+        end_date (str, optional): Last date, or pass periods instead
+        periods (int, optional): Number of dates
+        freq (str): Pandas frequency of the dates
+        **market_kwargs: Model, seed and parameters of SyntheticMarket
+
+    Returns:
+        pandas.DataFrame: Prices indexed by "date", one column per ticker
+    """
+    dates = pd.date_range(start=start_date, end=end_date, periods=periods, freq=freq)
+    market = SyntheticMarket(len(tickers), **market_kwargs)
+    return pd.DataFrame(
+        market.next_prices(len(dates)),
+        index=pd.DatetimeIndex(dates, name="date"),
+        columns=list(tickers),
+    )
+
+
+def write_panel(
+    path,
+    tickers,
+    start_date,
+    periods,
+    freq="D",
+    fmt="CSV",
+    chunk_rows=None,
+    progress=None,
+    **market_kwargs,
+):
+    """
+    Stream a price panel to a file in chunks of rows.
+
+    Only one chunk is in memory at a time, so files of any size can be
+    written. The file has a "date" column followed by one column per ticker,
+    the layout load_panel reads.
+
+    Args:
+        path (str): Destination file
+        tickers (list): Column names
+        start_date (str): First date
+        periods (int): Number of dates
+        freq (str): Pandas frequency of the dates
+        fmt (str): "CSV", "Parquet" or "Arrow IPC"
+        chunk_rows (int, optional): Rows per chunk, by default
+            SYNTHETIC_CHUNK_CELLS values
+        progress (callable, optional): Called with the fraction written
+        **market_kwargs: Model, seed and parameters of SyntheticMarket
+
+    Returns:
+        int: Size of the written file in bytes
+    """
+    if fmt != "CSV" and pa is None:
+        raise ImportError(f"pyarrow is required to write {fmt}")
+    if fmt not in ("CSV", "Parquet", "Arrow IPC"):
+        raise ValueError(f"Unknown format: {fmt}")
+    tickers = list(tickers)
+    chunk_rows = chunk_rows or max(1, SYNTHETIC_CHUNK_CELLS // max(len(tickers), 1))
+    market = SyntheticMarket(len(tickers), **market_kwargs)
+    offset = pd.tseries.frequencies.to_offset(freq)
+    start = pd.Timestamp(start_date)
+    try:
+        # Fail before writing anything when the dates do not fit
+        fits = start + (periods - 1) * offset <= pd.Timestamp.max
+    except (OverflowError, pd.errors.OutOfBoundsDatetime):
+        fits = False
+    if not fits:
+        raise ValueError(
+            f"{periods} periods of {freq} from {start_date} end after "
+            f"{pd.Timestamp.max.date()}, use a higher frequency"
+        )
+    # Plain dates unless some timestamps have a time of day
+    daily = start == start.normalize() and (
+        not isinstance(offset, pd.tseries.offsets.Tick)
+        or offset.nanos % pd.Timedelta(days=1).value == 0
+    )
+    date_format = "%Y-%m-%d" if daily else "%Y-%m-%d %H:%M:%S"
+    with open(path, "wb") as f:
+        writer = None
+        try:
+            if fmt == "CSV":
+                f.write((",".join(["date", *tickers]) + "\n").encode("utf-8"))
+            for first_row in range(0, periods, chunk_rows):
+                n_rows = min(chunk_rows, periods - first_row)
+                dates = pd.date_range(start=start, periods=n_rows, freq=offset)
+                start = dates[-1] + offset
+                prices = market.next_prices(n_rows)
+                if fmt == "CSV":
+                    writer = _write_csv_chunk(
+                        f, writer, dates.strftime(date_format), tickers, prices
+                    )
+                else:
+                    df = pd.DataFrame(prices, columns=tickers)
+                    df.insert(0, "date", dates)
+                    table = pa.Table.from_pandas(df, preserve_index=False)
+                    if writer is None:
+                        writer = (
+                            pq.ParquetWriter(f, table.schema, compression="zstd")
+                            if fmt == "Parquet"
+                            else pa.ipc.new_file(f, table.schema)
+                        )
+                    writer.write_table(table)
+                if progress is not None:
+                    progress((first_row + n_rows) / periods)
+        finally:
+            if writer is not None:
+                writer.close()
+    return os.path.getsize(path)
+
+
+def _write_csv_chunk(f, writer, dates, tickers, prices):
+    # Rounded to 4 decimals; pyarrow's writer is several times faster than
+    # formatting floats with pandas
+    prices = np.round(prices, 4)
+    if pa is None:
+        df = pd.DataFrame(prices, columns=tickers)
+        df.insert(0, "date", dates)
+        f.write(df.to_csv(header=False, index=False).encode("utf-8"))
+        return None
+    columns = {"date": pa.array(dates)}
+    columns.update((ticker, prices[:, i]) for i, ticker in enumerate(tickers))
+    table = pa.table(columns)
+    if writer is None:
+        writer = pcsv.CSVWriter(
+            f,
+            table.schema,
+            write_options=pcsv.WriteOptions(include_header=False, quoting_style="none"),
+        )
+    writer.write_table(table)
+    return writer
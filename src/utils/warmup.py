@@ -0,0 +1,57 @@
+import importlib
+import logging
+import os
+import threading
+import time
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Set APP_WARMUP=0 to load every stack on first use instead
+APP_WARMUP = os.environ.get("APP_WARMUP", "1") != "0"
+
+# Modules loaded in the background, cheapest and most likely needed first
+WARMUP_MODULES = [
+    "components.chat",
+    "utils.response_cache",
+    "components.sn_agent",
+    "agents.data_research",
+    "matplotlib.backends.backend_agg",
+    "matplotlib.figure",
+]
+
+
+def _warm_up():
+    start = time.perf_counter()
+    for module in WARMUP_MODULES:
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            logger.warning("Warm-up import of %s failed: %s", module, e)
+
+    try:
+        from utils.chat_utils import get_agent_graph, get_base_llm
+
+        # Builds the shared client and compiles the agent graph; no requests
+        # are sent to the model server
+        get_base_llm()
+        get_agent_graph()
+    except Exception as e:
+        logger.warning("Warm-up of the chat clients failed: %s", e)
+    logger.info("Warm-up finished in %.2fs", time.perf_counter() - start)
+
+
+@lru_cache(maxsize=None)
+def start_warmup():
+    """
+    Load the heavy agent stacks in a background thread, once per process.
+
+    Called at the end of a script run, after the first page has been sent,
+    so the first paint does not wait for stacks the page does not use while
+    later agent switches find them already loaded.
+    """
+    if not APP_WARMUP:
+        return None
+    thread = threading.Thread(target=_warm_up, name="app-warmup", daemon=True)
+    thread.start()
+    return thread